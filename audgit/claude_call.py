@@ -1,9 +1,12 @@
-from anthropic import Anthropic, HUMAN_PROMPT, AI_PROMPT
+from anthropic import HUMAN_PROMPT, AI_PROMPT
+from concurrent.futures import ThreadPoolExecutor
 import os
 from dotenv import load_dotenv
 import json
 import re
-import logging as log
+
+from audgit import llm, metrics, usage
+from audgit.partition import partition
 
 # load the .env file. By default, it looks for the .env file in the same directory as the script
 # If your .env file is one directory up, you need to specify the path
@@ -12,6 +15,9 @@ load_dotenv()
 # Load the token from an environment variable
 ANTHROPIC_API_KEY = os.environ["ANTHROPIC_API_KEY"]
 
+# max concurrent partial_solution_claude_call calls per review
+MAP_CONCURRENCY = int(os.environ.get("AUDGIT_MAP_CONCURRENCY", "5"))
+
 SYSTEM_PROMPT = """
 My name is Percy Precise and I have been contributing to open source projects for over 15 years. I have very high standards when it comes to code quality and efficiency. When I conduct a code review, I am focused and blunt - my goal is to identify areas for improvement, not protect feelings.
 
@@ -63,14 +69,12 @@ Respond with a list of up to 10 files you'd like to review in order to respond t
 {AI_PROMPT}
   """
 
-    anthropic = Anthropic()
-    completion = anthropic.completions.create(
-        model="claude-2", max_tokens_to_sample=3000, prompt=prompt
-    )
+    with metrics.span("review.which_files"):
+        completion = llm.complete(prompt, purpose="which_files")
 
     pattern = r"\[[^\]]*\]"
 
-    match = re.findall(pattern, completion.completion)
+    match = re.findall(pattern, completion)
 
     # parse the matched json string back to list
     file_paths_to_review = json.loads(match[0]) if match else []
@@ -78,31 +82,11 @@ Respond with a list of up to 10 files you'd like to review in order to respond t
     return file_paths_to_review
 
 
-def partition(file_paths):
-    res = {}
-    tot_len = 0
-    for fil in file_paths:
-        try:
-            with open(fil) as fi:
-                try:
-                    content = fi.read()
-                except FileNotFoundError:
-                    continue
-                if len(content) / 3 > 90000:
-                    raise ValueError("Cannot process single file of more than 270k for now")
-                tot_len += len(content) + len(fil) + 3
-                if tot_len / 3 > 90000:
-                    yield res
-                    res = {}
-                res[fil] = content
-        except FileNotFoundError:
-            log.error("missing file %s", fil)
-            continue
-    if res:
-        yield res
+def summarize(issue_title, issue_body, partials: list[str]):
+    return complete_claude(summarize_prompt(issue_title, issue_body, partials), purpose="summarize")
 
 
-def summarize(issue_title, issue_body, partials: list[str]):
+def summarize_prompt(issue_title, issue_body, partials: list[str]):
     combo = "\n\n".join(partials)
 
     issue = f"""
@@ -132,27 +116,50 @@ Respond with a long, comprehensive unified solution and course of action in mark
 
 {AI_PROMPT}
     """
-
-    anthropic = Anthropic()
-    completion = anthropic.completions.create(
-        model="claude-2", max_tokens_to_sample=3000, prompt=prompt
-    )
-    return completion.completion
+    return prompt
 
 
-def best_solution_claude_call(issue_title: str, issue_body: str, file_paths: list[str]):
-    partials = []
-
-    for chunk in partition(file_paths):
-        partials.append(partial_solution_claude_call(issue_title, issue_body, chunk))
+def best_solution_claude_call(issue_title: str, issue_body: str, file_paths: list[str],
+                              max_concurrency: int = MAP_CONCURRENCY, transform=None):
+    chunks = list(partition(file_paths, transform=transform))
+    partials = map_partials(issue_title, issue_body, chunks, max_concurrency)
 
     if len(partials) == 1:
         return partials[0]
 
-    return summarize(issue_title, issue_body, partials)
+    with metrics.span("review.reduce"):
+        return summarize(issue_title, issue_body, partials)
+
+
+def best_solution_claude_stream(issue_title: str, issue_body: str, file_paths: list[str],
+                                max_concurrency: int = MAP_CONCURRENCY, transform=None):
+    """Same as best_solution_claude_call, but yields the final answer as it streams in.
+
+    With several chunks the map phase still runs to completion first, only the reduce call is streamed.
+    """
+    chunks = list(partition(file_paths, transform=transform))
+
+    if len(chunks) == 1:
+        yield from stream_claude(partial_solution_prompt(issue_title, issue_body, chunks[0]), purpose="partial_solution")
+        return
+
+    partials = map_partials(issue_title, issue_body, chunks, max_concurrency)
+    yield from stream_claude(summarize_prompt(issue_title, issue_body, partials), purpose="summarize")
+
+
+def map_partials(issue_title: str, issue_body: str, chunks: list[dict[str, str]],
+                 max_concurrency: int = MAP_CONCURRENCY) -> list[str]:
+    """Map phase: a partial solution per chunk, reviewed concurrently, in chunk order."""
+    with metrics.span("review.map"), ThreadPoolExecutor(max_workers=max(1, min(max_concurrency, len(chunks)))) as executor:
+        partial = usage.propagate(partial_solution_claude_call)
+        return list(executor.map(lambda chunk: partial(issue_title, issue_body, chunk), chunks))
 
 
 def partial_solution_claude_call(issue_title: str, issue_body: str, chunk: dict[str, str]):
+    return complete_claude(partial_solution_prompt(issue_title, issue_body, chunk), purpose="partial_solution")
+
+
+def partial_solution_prompt(issue_title: str, issue_body: str, chunk: dict[str, str]):
     issue = f"""
 Issue Title: {issue_title}
 
@@ -186,12 +193,16 @@ you opened a pr, instead include exact code changes and specifics if possible.:
 
 {AI_PROMPT}
   """
+    return prompt
+
+
+def complete_claude(prompt: str, purpose: str = "complete") -> str:
+    return llm.complete(prompt, model="claude-2", max_tokens=3000, purpose=purpose)
+
 
-    anthropic = Anthropic()
-    completion = anthropic.completions.create(
-        model="claude-2", max_tokens_to_sample=3000, prompt=prompt
-    )
-    return completion.completion
+def stream_claude(prompt: str, purpose: str = "stream"):
+    """Yield the completion text as it arrives."""
+    return llm.stream(prompt, model="claude-2", max_tokens=3000, purpose=purpose)
 
 # code_to_review = """
 # import requests
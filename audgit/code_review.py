@@ -1,16 +1,20 @@
 import time
 
 from nostr.event import Event
-from audgit.claude_call import which_files_claude_call, best_solution_claude_call
-from audgit.descrips import generate_file_descrips
-from audgit.get_repo_files import get_file_tree
+from audgit.claude_call import which_files_claude_call, best_solution_claude_call, best_solution_claude_stream
+from audgit.descrips import generate_file_descrips, shortlist_file_descrips
+from audgit.get_repo_files import sync_file_tree
 import requests
 import json
 import os
 from dotenv import load_dotenv
 import logging
 
+from audgit import metrics, usage
 from audgit.lightning import get_callback
+from audgit.payments import AwaitPayment
+from audgit.pipeline import Pipeline
+from audgit.symbols import make_slicer
 
 log = logging.getLogger("audgit")
 
@@ -21,6 +25,10 @@ load_dotenv()
 # Load the token from an environment variable
 TOKEN = os.environ["GITHUB_TOKEN"]
 
+# api and clone hosts, overridable to point the pipeline at local stand-ins
+GITHUB_API = os.environ.get("AUDGIT_GITHUB_API", "https://api.github.com").rstrip("/")
+GITHUB_URL = os.environ.get("AUDGIT_GITHUB_URL", "https://github.com").rstrip("/")
+
 # Define the headers to be used in the requests
 headers = {
     "Accept": "application/vnd.github.v3+json",
@@ -28,9 +36,85 @@ headers = {
 }
 
 
+# Stream the solution as progress events, flushed every N streamed tokens or N seconds
+STREAM_RESULTS = os.environ.get("AUDGIT_STREAM", "1") != "0"
+STREAM_EVERY_TOKENS = int(os.environ.get("AUDGIT_STREAM_EVERY_TOKENS", "64"))
+STREAM_EVERY_SECONDS = float(os.environ.get("AUDGIT_STREAM_EVERY_SECONDS", "3"))
+
+# attach per stage durations to the final result as a ["timings", json] tag
+TIMINGS_TAG = os.environ.get("AUDGIT_TIMINGS_TAG", "0") != "0"
+
+
+def batch_stream(deltas, every_tokens=STREAM_EVERY_TOKENS, every_seconds=STREAM_EVERY_SECONDS):
+    """Group streamed text deltas, flushing every `every_tokens` deltas or `every_seconds`."""
+    buf = []
+    last = time.monotonic()
+    for delta in deltas:
+        buf.append(delta)
+        if len(buf) >= every_tokens or time.monotonic() - last >= every_seconds:
+            yield "".join(buf)
+            buf = []
+            last = time.monotonic()
+    if buf:
+        yield "".join(buf)
+
+
+def stream_progress(event: Event, texts):
+    """Yield a progress event per text and return the whole text.
+
+    Progress events carry consecutive slices of the solution, clients stitch them by seq/offset.
+    """
+    final = ""
+    for seq, text in enumerate(texts):
+        yield Event(
+            kind=65001,  # code review job result
+            content=text,
+            tags=[
+                ["p", event.public_key],
+                ["e", event.id],
+                ["R", "claude_solution_progress"],
+                ["status", "processing"],
+                ["seq", str(seq)],
+                ["offset", str(len(final))],
+            ],
+        )
+        final += text
+    return final
+
+
 # Generate a new keypair for the demonstration
 
 
+def get_issue(owner: str, repo: str, issue_number: str) -> dict:
+    api_url = f"{GITHUB_API}/repos/{owner}/{repo}/issues/{issue_number}"
+    with metrics.span("http.github_issue"):
+        response = requests.get(api_url, headers=headers)
+
+    if response.status_code != 200:
+        raise Exception(f"Error: API request status {response.status_code}")
+
+    log.debug("Got issue...")
+    return response.json()
+
+
+def select_files(issue: dict, files_with_descriptions: dict[str, str], owner: str, repo: str, local_path: str):
+    # only the best lexical matches for the issue go into the file selection prompt
+    shortlisted = shortlist_file_descrips(
+        files_with_descriptions, owner, repo, local_path, f"{issue['title']}\n{issue['body']}"
+    )
+
+    pruned_descriptions = {
+        k.replace(local_path, "").lstrip("/").lstrip("\\"): v
+        for k, v in shortlisted.items()
+    }
+
+    file_paths_to_review: list[str] = which_files_claude_call(
+        issue["title"], issue["body"], pruned_descriptions
+    )
+
+    return file_paths_to_review, pruned_descriptions
+
+
 def code_review(event: Event) -> Event:
     log.debug("Got event...")
     issue_url = event.content
@@ -40,14 +124,27 @@ def code_review(event: Event) -> Event:
     repo = parts[-3]
     owner = parts[-4]
 
-    api_url = f"https://api.github.com/repos/{owner}/{repo}/issues/{issue_number}"
-    response = requests.get(api_url, headers=headers)
-
-    if response.status_code != 200:
-        raise Exception(f"Error: API request status {response.status_code}")
-
-    issue = response.json()
-    log.debug("Got issue...")
+    repo_url = f"{GITHUB_URL}/{owner}/{repo}.git"
+    local_path = f"/tmp/repo/{owner}/{repo}"  # Define the local path where the repo is cloned
+    usage.tag(repo=f"{owner}/{repo}")
+
+    # the issue, the invoice and the clone don't depend on each other, each stage starts as soon as its inputs are in
+    pipe = Pipeline(name=f"{owner}/{repo}#{issue_number}")
+    pipe.stage("issue", lambda: get_issue(owner, repo, issue_number))
+    pipe.stage("invoice", lambda: get_callback(msats=10000000))
+    pipe.stage("repo", lambda: sync_file_tree(repo_url, local_path))
+    pipe.stage("descriptions", lambda tree: generate_file_descrips(tree[0], owner, repo, local_path),
+               deps=["repo"])
+    pipe.stage("files", lambda issue, descriptions: select_files(issue, descriptions, owner, repo, local_path),
+               deps=["issue", "descriptions"])
+    pipe.start()
+
+    try:
+        issue = pipe.result("issue")
+        ln_callback = pipe.result("invoice")
+    except Exception:
+        pipe.cancel()
+        raise
 
     issue_msg = json.dumps(
         {
@@ -56,8 +153,6 @@ def code_review(event: Event) -> Event:
         }
     )
 
-    ln_callback = get_callback(msats=10000000)
-
     invoice = ln_callback["pr"]
 
     log.info(ln_callback)
@@ -89,23 +184,9 @@ Prepare to be claudited.
 
     yield ack_event
 
-    repo_url = f"https://github.com/{owner}/{repo}.git"
-    local_path = f"/tmp/repo/{repo}"  # Define the local path where the repo is cloned
-
-    file_paths = get_file_tree(repo_url, local_path)
-
-    files_with_descriptions = generate_file_descrips(
-        file_paths, owner, repo, f"/tmp/repo/{repo}"
-    )
-
-    pruned_descriptions = {
-        k.replace(local_path, "").lstrip("/").lstrip("\\"): v
-        for k, v in files_with_descriptions.items()
-    }
-
-    file_paths_to_review: list[str] = which_files_claude_call(
-        issue["title"], issue["body"], pruned_descriptions
-    )
+    file_paths_to_review, pruned_descriptions = pipe.result("files")
+    log.info("%s stage timings: %s", pipe.name, pipe.timings)
+    timings = {name: t["duration"] for name, t in pipe.timings.items()}
 
     full_paths = [
         os.path.join(local_path, fil.lstrip("/").lstrip("\\"))
@@ -145,22 +226,16 @@ Files:
 
     yield job_result_tmp
 
-    # Wait for the payment to be made by polling against the verify_url
+    # Wait for the payment to be made, the monitor parks the job with its payment watcher
+    # and resumes it with True once the invoice settles, or False after the timeout
 
-    got_payment = False
     if getattr(event, "evade_payment", False):
         got_payment = True
-    done_waiting = time.monotonic() + 300
-    while not got_payment and time.monotonic() < done_waiting:
-        res = requests.get(verify_url)
-        if res.status_code != 200:
-            raise Exception(f"Error: payment verification failure  {res.status_code}")
-        if res.json()["settled"]:
-            log.debug("Payment received!")
-            got_payment = True
-            break
-        log.debug("Waiting for payment...")
-        time.sleep(3)
+    else:
+        waited = time.monotonic()
+        got_payment = yield AwaitPayment(verify_url, timeout=300)
+        timings["payment_wait"] = round(time.monotonic() - waited, 3)
+        metrics.registry.observe("audgit_stage_seconds", timings["payment_wait"], stage="payment_wait")
 
     if not got_payment:
         pay_fail_event = Event(
@@ -176,17 +251,34 @@ Files:
         yield pay_fail_event
         return
 
-    final = best_solution_claude_call(issue["title"], issue["body"], full_paths)
+    # big files are cut down to the symbols the issue mentions, plus their callers and callees
+    slicer = make_slicer(owner, repo, local_path, f"{issue['title']}\n{issue['body']}")
+
+    started = time.monotonic()
+    if STREAM_RESULTS:
+        final = yield from stream_progress(
+            event, batch_stream(best_solution_claude_stream(issue["title"], issue["body"], full_paths,
+                                                            transform=slicer))
+        )
+    else:
+        final = best_solution_claude_call(issue["title"], issue["body"], full_paths, transform=slicer)
+    timings["solution"] = round(time.monotonic() - started, 3)
+    metrics.registry.observe("audgit_stage_seconds", timings["solution"], stage="solution")
+    log.info("%s timings: %s", pipe.name, timings)
+
+    tags = [
+        ["p", event.public_key],
+        ["e", event.id],
+        ["R", "claude_solution"],
+        ["status", "success"],
+    ]
+    if TIMINGS_TAG:
+        tags.append(["timings", json.dumps(timings, separators=(",", ":"))])
 
     job_result_event = Event(
         kind=65001,  # code review job result
         content=final,  # use the JSON string here
-        tags=[
-            ["p", event.public_key],
-            ["e", event.id],
-            ["R", "claude_solution"],
-            ["status", "success"],
-        ],
+        tags=tags,
     )
 
     yield job_result_event
@@ -1,16 +1,31 @@
+import base64
 import json
 import mimetypes
 import re
+import tarfile
 import threading
+import time
 import queue
+from collections import defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from itertools import islice
 from dataclasses import dataclass
-from typing import Generator, Optional
+from datetime import datetime, timezone
+from typing import BinaryIO, Generator, Optional
 
 import requests
-from bs4 import BeautifulSoup
-from urllib.parse import urljoin
+from requests.adapters import HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+from urllib.parse import parse_qs, quote, urlencode, urljoin, urlsplit
 import logging as log
 
+from audgit.frontier import Frontier
+from audgit.http_cache import DEFAULT_HTTP_CACHE, HttpCache, cached_get
+from audgit.links import extract_links
+from audgit.simhash import SimHashIndex, fingerprint
+from audgit.spool import CHUNK_SIZE, DEFAULT_SPOOL_SIZE, Body, Content, iter_content, open_content, spool
+
 from github import Github, Auth
 
 @dataclass
@@ -23,115 +38,289 @@ class Repo:
 @dataclass
 class CrawlOutput:
     url: str
-    content: bytes
+    # bytes, or a Body spooled to disk for big pages, read either with open() or read()
+    content: Content
     content_type: str
 
-def safe_get(url: str, max_page_size: int) -> None | tuple[bytes, str | None]:
+    def open(self) -> BinaryIO:
+        return open_content(self.content)
+
+    def read(self) -> bytes:
+        return bytes(self.content)
+
+    @property
+    def size(self) -> int:
+        return len(self.content)
+
+def safe_get(url: str, max_page_size: int, session: requests.Session | None = None,
+             cache: HttpCache | None = None, spool_size: int | None = None) -> None | tuple[Content, str | None, str]:
+    """(content, content type, url after redirects) or None when the fetch failed."""
     try:
-        response = requests.get(url, stream=True, timeout=5)
+        response = cached_get(session or requests, url, cache=cache, timeout=5, max_size=max_page_size,
+                              spool_size=spool_size)
     except requests.exceptions.RequestException as e:
         log.info("exception fetching %s", e)
         return None
 
-    content_size = 0
-    content_chunks = []
-
-    for chunk in response.iter_content(chunk_size=1024):
-        content_size += len(chunk)
-        content_chunks.append(chunk)
-        if content_size > max_page_size:
-            log.warning("ignoring the rest of %s: too big", url)
-            break
-
-    content = b''.join(content_chunks)
-    return content, response.headers.get("content-type")
+    return response.content, CaseInsensitiveDict(response.headers).get("content-type"), response.url
 
 
 DEFAULT_MAX_DEPTH = 10
 DEFAULT_TOTAL_SIZE = 50 * 1000 * 1000
 DEFAULT_MAX_PAGE_SIZE = 1 * 1000 * 1000
 DEFAULT_MAX_PAGES = 1000
+DEFAULT_WORKERS = 8
+DEFAULT_PER_HOST = 4
+DEFAULT_HOST_DELAY = 0.0
+# "archive": one recursive tree listing and one streamed tarball, "contents": a contents API call per file and dir
+DEFAULT_GITHUB_INGEST = "archive"
+# pages waiting for the consumer, workers block once it is full
+DEFAULT_OUTPUT_QUEUE = 16
+GITHUB_PER_PAGE = 100
+GITHUB_PAGE_WORKERS = 8
+
+
+class HostLimiter:
+    """At most per_host requests in flight per host, started at least delay seconds apart."""
+    def __init__(self, per_host: int = DEFAULT_PER_HOST, delay: float = DEFAULT_HOST_DELAY):
+        self.per_host = per_host
+        self.delay = delay
+        self.lock = threading.Lock()
+        self.slots: dict[str, threading.Semaphore] = defaultdict(lambda: threading.Semaphore(self.per_host))
+        self.next_start: dict[str, float] = defaultdict(float)
+
+    @contextmanager
+    def slot(self, url: str):
+        host = urlsplit(url).netloc
+        with self.lock:
+            sem = self.slots[host]
+        with sem:
+            with self.lock:
+                now = time.monotonic()
+                start = max(now, self.next_start[host])
+                self.next_start[host] = start + self.delay
+            if start > now:
+                time.sleep(start - now)
+            yield
+
+
+class CrawlState:
+    """Frontier, output and budgets shared by the workers of one crawl."""
+    def __init__(self, workers: int, max_depth: int, max_pages: int, max_total_size: int,
+                 queue_size: int = DEFAULT_OUTPUT_QUEUE):
+        self.frontier = Frontier(max_depth)
+        self.lock = threading.Lock()
+        # notified when a reserved page is stored or handed back
+        self.settled = threading.Condition(self.lock)
+        self.alive = workers
+        self.output_queue = queue.Queue[CrawlOutput | None](maxsize=queue_size)
+        # set when the consumer stops reading
+        self.closed = threading.Event()
+        # simhashes of the pages seen so far, when near-duplicates are skipped
+        self.fingerprints: SimHashIndex | None = None
+        self.max_pages = max_pages
+        self.max_total_size = max_total_size
+        self.pages_reserved = 0
+        self.content_count = 0
+        self.total_size = 0
+
+    def reserve_page(self) -> bool | None:
+        """Claim one page of the budget before fetching, so workers never fetch more than max_pages.
+
+        False once max_pages pages are stored. None while the rest of the budget is held by fetches in flight,
+        which may still hand their page back on a failure or a duplicate.
+        """
+        with self.lock:
+            if self.pages_reserved >= self.max_pages and self.content_count < self.max_pages:
+                # give one of them a moment to settle rather than spinning through the frontier
+                self.settled.wait(0.1)
+            if self.pages_reserved < self.max_pages:
+                self.pages_reserved += 1
+                return True
+            if self.content_count >= self.max_pages:
+                return False
+            return None
+
+    def release_page(self):
+        with self.lock:
+            self.pages_reserved -= 1
+            self.settled.notify()
+
+    def spend(self, size: int) -> bool:
+        """Count a fetched page against the budgets, False if its bytes don't fit."""
+        with self.lock:
+            if self.total_size + size > self.max_total_size:
+                return False
+            self.content_count += 1
+            self.total_size += size
+            self.settled.notify_all()
+            return True
+
+    def emit(self, output: CrawlOutput | None) -> bool:
+        """Hand output to the consumer, waiting while the queue is full. False if the consumer went away."""
+        while not self.closed.is_set():
+            try:
+                self.output_queue.put(output, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        if isinstance(output, CrawlOutput) and isinstance(output.content, Body):
+            output.content.close()
+        return False
+
+    def worker_exit(self):
+        # the last worker out closes the output
+        with self.lock:
+            self.alive -= 1
+            last = not self.alive
+        if last:
+            self.emit(None)
+
 
 class Crawler:
     """Crawls urls, yields content, content, types."""
-    def __init__(self, max_depth = DEFAULT_MAX_DEPTH, max_total_size = DEFAULT_TOTAL_SIZE, max_page_size = DEFAULT_MAX_PAGE_SIZE, max_pages = DEFAULT_MAX_PAGES):
+    def __init__(self, max_depth = DEFAULT_MAX_DEPTH, max_total_size = DEFAULT_TOTAL_SIZE, max_page_size = DEFAULT_MAX_PAGE_SIZE, max_pages = DEFAULT_MAX_PAGES,
+                 workers = DEFAULT_WORKERS, per_host = DEFAULT_PER_HOST, host_delay = DEFAULT_HOST_DELAY, link_extractor = "regex",
+                 github_ingest = DEFAULT_GITHUB_INGEST, cache_dir = DEFAULT_HTTP_CACHE, github_since = None, incremental = False,
+                 queue_size = DEFAULT_OUTPUT_QUEUE, spool_size = DEFAULT_SPOOL_SIZE,
+                 dedupe = False, dedupe_links = True, dedupe_distance = 3):
         self.max_depth = max_depth
         self.max_total_size = max_total_size
         self.max_page_size = max_page_size
         self.max_pages = max_pages
+        self.workers = workers
+        self.per_host = per_host
+        self.host_delay = host_delay
+        self.link_extractor = link_extractor
+        self.github_ingest = github_ingest
+        self.cache_dir = cache_dir
+        # only issues and prs updated after this ISO 8601 time, incremental picks up where the last full crawl started
+        self.github_since = github_since
+        self.incremental = incremental
+        # bounded hand-off to the consumer, and bodies over spool_size kept in temp files, so memory stays flat
+        self.queue_size = queue_size
+        self.spool_size = spool_size
+        # skip pages whose text is within dedupe_distance bits of a page already yielded, following their links or not
+        self.dedupe = dedupe
+        self.dedupe_links = dedupe_links
+        self.dedupe_distance = dedupe_distance
+        self.dedupe_stats = {"duplicates": 0, "duplicate_bytes": 0}
+        self._http_cache: HttpCache | None = None
+        self._lock = threading.Lock()
         self.abort_reason = ""
 
-    def worker(self, work_queue: queue.Queue[str], output_queue: queue.Queue[CrawlOutput | None], depth: int, within: str):
-        visited_urls = set()
-        content_count = 0
-        content_size = 0
-        total_size = 0
-
+    @property
+    def http_cache(self) -> HttpCache | None:
+        with self._lock:
+            if self._http_cache is None and self.cache_dir:
+                self._http_cache = HttpCache(self.cache_dir)
+        return self._http_cache
+
+    @property
+    def cache_stats(self) -> dict[str, float]:
+        """hits, revalidated, misses, evicted, bytes and hit_rate of the http cache, empty without one"""
+        return self.http_cache.stats if self.http_cache else {}
+
+    def make_session(self) -> requests.Session:
+        """One keep-alive session per crawl, its pools hold up to per_host connections for each host."""
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=32, pool_maxsize=max(self.per_host, 1))
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        return session
+
+    def worker(self, state: CrawlState, session: requests.Session, limiter: HostLimiter, within: str):
         try:
-            while True:
+            while (item := state.frontier.next()) is not None:
                 try:
-                    current_url = work_queue.get_nowait()
-                except queue.Empty:
-                    output_queue.put(None)
-                    break
-
-                if current_url in visited_urls:
-                    continue
-
-                visited_urls.add(current_url)
-                log.debug("crawler: processing: %s", current_url)
-
-                try:
-                    res = safe_get(current_url, self.max_page_size)
-                    if not res:
-                        log.info("url returned none %s", current_url)
-                        continue
-                    content, content_type = res
-                except requests.exceptions.RequestException as e:
-                    log.error("error: %s", e)
-                    continue
-
-                content_count += 1
-                content_size += len(content)
-                total_size += content_size
-
-                if content_count > self.max_pages or total_size > self.max_total_size:
-                    self.abort_reason = "size"
-                    log.info("aborting crawl because max size/pages: %s", within)
-                    output_queue.put(None)
-                    break
-
-                output_queue.put(CrawlOutput(url=current_url, content=content, content_type=content_type))
-
-                if depth > 0:
-                    if "html" in content_type:
-                        soup = BeautifulSoup(content, 'html.parser')
-                        # Find all links on the current page
-                        links = soup.find_all('a')
-                        for link in links:
-                            href = link.get('href')
-                            if href:
-                                href = href.split('#', 1)[0]
-                                # Construct absolute URL for each link
-                                absolute_url = urljoin(current_url, href)
-                                if absolute_url.startswith(within):
-                                    log.debug("crawler: found descendant URL: %s", absolute_url)
-                                    work_queue.put(absolute_url)
-                else:
-                    self.abort_reason = "depth"
-                    log.info("aborting crawl because depth: %s", within)
-
-            depth -= 1
+                    self.process(*item, state, session, limiter, within)
+                finally:
+                    state.frontier.task_done()
         except Exception as e:
             # prevent possibility of infinity
             log.exception("error in worker: %s", e)
-            output_queue.put(None)
+            state.frontier.finish()
+        finally:
+            state.worker_exit()
+
+    def process(self, current_url: str, depth: int, state: CrawlState, session: requests.Session, limiter: HostLimiter, within: str):
+        log.debug("crawler: processing: %s (depth %s)", current_url, depth)
+
+        reserved = state.reserve_page()
+        if reserved is None:
+            # the page budget isn't spent yet, fetches in flight may still give some of it back
+            state.frontier.requeue(current_url, depth)
+            return
+        if not reserved:
+            self.abort_reason = "size"
+            log.info("aborting crawl because max pages: %s", within)
+            state.frontier.finish()
+            return
+
+        try:
+            with limiter.slot(current_url):
+                res = safe_get(current_url, self.max_page_size, session, self.http_cache, self.spool_size)
+        except requests.exceptions.RequestException as e:
+            log.error("error: %s", e)
+            res = None
+        if not res:
+            log.info("url returned none %s", current_url)
+            state.release_page()
+            return
+        # relative links resolve against where the page ended up, trailing slash and redirects included
+        content, content_type, base_url = res
+        is_html = bool(content_type and "html" in content_type)
+
+        if state.fingerprints is not None and content_type and (is_html or content_type.startswith("text")):
+            value = fingerprint(iter_content(content), markup=is_html)
+            duplicate_of = state.fingerprints.check_and_add(value, current_url) if value is not None else None
+            if duplicate_of:
+                log.debug("crawler: %s is a near-duplicate of %s", current_url, duplicate_of)
+                # duplicates don't count against the budgets
+                state.release_page()
+                with state.lock:
+                    self.dedupe_stats["duplicates"] += 1
+                    self.dedupe_stats["duplicate_bytes"] += len(content)
+                if self.dedupe_links and is_html:
+                    self.follow(extract_links(content, self.link_extractor), base_url, depth, state, within)
+                if isinstance(content, Body):
+                    content.close()
+                return
+
+        if not state.spend(len(content)):
+            self.abort_reason = "size"
+            log.info("aborting crawl because max size: %s", within)
+            state.frontier.finish()
+            if isinstance(content, Body):
+                content.close()
+            return
+
+        # links are read before the page is handed over, the consumer may close a spooled body
+        links = []
+        if is_html:
+            links = extract_links(content, self.link_extractor)
+
+        if not state.emit(CrawlOutput(url=current_url, content=content, content_type=content_type)):
+            return
+
+        self.follow(links, base_url, depth, state, within)
+
+    def follow(self, links: list[str], base_url: str, depth: int, state: CrawlState, within: str):
+        # Find all links on the current page
+        for href in links:
+            # Construct absolute URL for each link
+            absolute_url = urljoin(base_url, href)
+            if absolute_url.startswith(within):
+                if state.frontier.add(absolute_url, depth + 1):
+                    log.debug("crawler: found descendant URL: %s", absolute_url)
 
     def crawl(self, url: str) -> Generator[CrawlOutput, None, None]:
         """Main entry point for crawler, allows url to be of this form: http://site.com/faq/*home
 
         That means start at /faq/home, but crawl the whole /faq.
         """
+        # a reused crawler reports why this crawl stopped, not an earlier one
+        self.abort_reason = ""
         url, within = split_within(url)
         if is_repo_root(url):
             yield from self.crawl_repo(url)
@@ -139,23 +328,37 @@ class Crawler:
             yield from self.crawl_web(url, within)
 
     def crawl_web(self, url: str, within: str) -> Generator[CrawlOutput, None, None]:
-        work_queue = queue.Queue[str]()
-        output_queue = queue.Queue[CrawlOutput]()
-        work_queue.put(url)
+        state = CrawlState(self.workers, self.max_depth, self.max_pages, self.max_total_size, self.queue_size)
+        if self.dedupe:
+            state.fingerprints = SimHashIndex(self.dedupe_distance)
+        self.dedupe_stats = {"duplicates": 0, "duplicate_bytes": 0}
+        session = self.make_session()
+        limiter = HostLimiter(self.per_host, self.host_delay)
+        state.frontier.add(url, 0)
+
+        for _ in range(self.workers):
+            threading.Thread(
+                target=self.worker,
+                args=(state, session, limiter, within),
+                daemon=True
+            ).start()
 
-        worker_thread = threading.Thread(
-            target=self.worker,
-            args=(work_queue, output_queue, self.max_depth, within),
-            daemon=True
-        )
-        worker_thread.start()
+        try:
+            while True:
+                content = state.output_queue.get()
+                if content is None:
+                    break
 
-        while True:
-            content = output_queue.get()
-            if content is None:
-                break
+                yield content
+        finally:
+            # stops the workers if the consumer goes away early
+            state.closed.set()
+            state.frontier.finish()
+            session.close()
 
-            yield content
+        if state.frontier.too_deep and not self.abort_reason:
+            self.abort_reason = "depth"
+            log.info("crawl stopped at depth %s: %s", self.max_depth, within)
 
     def crawl_repo(self, url: str) -> Generator[CrawlOutput, None, None]:
         repo = parse_repo_url(url)
@@ -168,52 +371,97 @@ class Crawler:
         gh_repo = gh.get_repo(repo.org + "/" + repo.repo)
 
         total_size = 0
-        def check_size(cont):
+        def check_size(size: int):
             nonlocal total_size
-            total_size += len(cont)
-            if total_size > self.max_total_size:
+            if total_size + size > self.max_total_size:
                 self.abort_reason = "size"
                 log.warning("stopping parse of repo because of size: %s", repo)
                 return False
+            total_size += size
             return True
 
 
-        issues = gh_repo.get_issues()
-        for issue in issues:
-            url = issue.url
-            content = json.dumps({
-            "type": "issue",
-            "title": issue.title,
-            "state": issue.state,
-            "comments": issue.comments,
-            "body": issue.body
-            }).encode()
-            content_type = "text/json"
-
-            total_size += len(content)
-            if total_size > self.max_total_size:
-                self.abort_reason = "size"
-                log.warning("stopping parse of repo because of size: %s", repo)
-
-            if not check_size(content):
+        started = datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+        since_key = f"github_since:{repo.org}/{repo.repo}"
+        since = self.github_since
+        if since is None and self.incremental and self.http_cache:
+            since = self.http_cache.get_meta(since_key)
+        if since:
+            log.info("crawling issues and pull requests of %s updated since %s", repo, since)
+
+        # pull requests come from the issues listing too, so their comment counts need no call per pr
+        pulls = []
+        for item in self.github_issues(gh_repo, repo.auth, since):
+            pr = item.get("pull_request")
+            record = {
+                "type": "pull_request" if pr else "issue",
+                "title": item["title"],
+                "state": item["state"],
+                "comments": item["comments"],
+                "body": item["body"]
+            }
+            if pr:
+                pulls.append((pr["url"], record))
+                continue
+            content = json.dumps(record).encode()
+            if not check_size(len(content)):
                 return
-            yield CrawlOutput(url=url, content=content, content_type=content_type)
+            yield CrawlOutput(url=item["url"], content=content, content_type="text/json")
 
-        pulls = gh_repo.get_pulls()
-        for pr in pulls:
-            url = pr.url
-            content = json.dumps({
-            "type": "pull_request",
-            "title": pr.title,
-            "state": pr.state,
-            "comments": pr.comments,
-            "body": pr.body
-            }).encode()
-            content_type = "text/json"
-            if not check_size(content):
+        for url, record in pulls:
+            content = json.dumps(record).encode()
+            if not check_size(len(content)):
                 return
-            yield CrawlOutput(url=url, content=content, content_type=content_type)
+            yield CrawlOutput(url=url, content=content, content_type="text/json")
+
+        if self.github_ingest == "archive":
+            yield from self.github_archive(gh_repo, check_size)
+        else:
+            yield from self.github_contents(gh_repo, check_size)
+
+        if self.incremental and self.http_cache and not self.abort_reason:
+            self.http_cache.set_meta(since_key, started)
 
+    def github_issues(self, gh_repo, auth: str | None, since: str | None) -> Generator[dict, None, None]:
+        """Issues and pull requests, in order, every page after the first fetched concurrently.
+
+        Pages go through the http cache, an unchanged page is a 304 that doesn't count against the rate limit.
+        """
+        params = {"state": "all" if since else "open", "per_page": GITHUB_PER_PAGE}
+        if since:
+            params["since"] = since
+        url = f"{gh_repo.url}/issues?{urlencode(params)}"
+        headers = github_headers(auth)
+
+        with self.make_session() as session:
+            def fetch(page_url: str):
+                res = cached_get(session, page_url, headers, self.http_cache)
+                if res.status_code != 200:
+                    raise Exception(f"Error: API request status {res.status_code}")
+                return res
+
+            first = fetch(url)
+            last = first.links.get("last")
+            if not last:
+                yield from first.json()
+                return
+            # the first page says how many there are, the rest are fetched a window of pages ahead of the consumer,
+            # so a crawl that stops early doesn't spend the rate limit on pages nobody reads
+            pages = int(parse_qs(urlsplit(last).query)["page"][0])
+            urls = (f"{url}&page={page}" for page in range(2, pages + 1))
+            pool = ThreadPoolExecutor(max_workers=GITHUB_PAGE_WORKERS)
+            try:
+                window = deque(pool.submit(fetch, page_url) for page_url in islice(urls, GITHUB_PAGE_WORKERS))
+                yield from first.json()
+                while window:
+                    res = window.popleft().result()
+                    for page_url in islice(urls, 1):
+                        window.append(pool.submit(fetch, page_url))
+                    yield from res.json()
+            finally:
+                pool.shutdown(wait=False, cancel_futures=True)
+
+    def github_contents(self, gh_repo, check_size) -> Generator[CrawlOutput, None, None]:
         sources = gh_repo.get_contents("")
         while sources:
             fil = sources.pop(0)
@@ -227,11 +475,43 @@ class Crawler:
                 content = fil.content
             if not content:
                 continue
-            if not check_size(content):
+            if not check_size(len(content)):
                 return
             content_type, _encoding = mimetypes.guess_type(fil.path, strict=False)
             yield CrawlOutput(url=url, content=content, content_type=content_type)
 
+    def github_archive(self, gh_repo, check_size) -> Generator[CrawlOutput, None, None]:
+        """Whole tree in one listing, file contents streamed out of one tarball of the same commit."""
+        ref = gh_repo.default_branch
+        sha = gh_repo.get_branch(ref).commit.sha
+        tree = gh_repo.get_git_tree(sha, recursive=True)
+        # submodules and symlinks aren't files, a truncated listing can't be used to filter
+        blobs = None if tree.truncated else {
+            el.path for el in tree.tree if el.type == "blob" and el.mode != "120000"
+        }
+
+        archive_url = gh_repo.get_archive_link("tarball", sha)
+        with requests.get(archive_url, stream=True, timeout=30) as response:
+            response.raise_for_status()
+            # members are read in order straight off the socket, nothing is buffered to disk
+            with tarfile.open(fileobj=response.raw, mode="r|gz") as tar:
+                for member in tar:
+                    if not member.isfile() or "/" not in member.name:
+                        continue
+                    # members are prefixed with "{org}-{repo}-{sha}/"
+                    path = member.name.split("/", 1)[1]
+                    if blobs is not None and path not in blobs:
+                        continue
+                    if not member.size:
+                        continue
+                    if not check_size(member.size):
+                        return
+                    member_file = tar.extractfile(member)
+                    content, _truncated = spool(iter(lambda: member_file.read(CHUNK_SIZE), b""), self.spool_size)
+                    content_type, _encoding = mimetypes.guess_type(path, strict=False)
+                    url = f"{gh_repo.url}/contents/{quote(path)}?ref={ref}"
+                    yield CrawlOutput(url=url, content=content, content_type=content_type)
+
 def parse_auth(auth: str | None) -> Optional[Auth]:
     if auth and ":" in auth:
         user, pwd = auth.split(":", 1)
@@ -241,6 +521,14 @@ def parse_auth(auth: str | None) -> Optional[Auth]:
         return Auth.Token(token)
     return None
 
+def github_headers(auth: str | None) -> dict[str, str]:
+    headers = {"Accept": "application/vnd.github.v3+json"}
+    if auth and ":" in auth:
+        headers["Authorization"] = "Basic " + base64.b64encode(auth.encode()).decode()
+    elif auth:
+        headers["Authorization"] = f"token {auth}"
+    return headers
+
 def parse_github_url(url: str) -> Repo | None:
     # only root links are seen as repo clones
     match = re.match(r"https?://(?:([^@]*)@)?(?:www.)?github.com/([^/]+)/([^/]+)/?$", url)
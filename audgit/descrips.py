@@ -1,22 +1,41 @@
 """make file descrips for better lookup of relevant files"""
 
+import hashlib
 import os
 import json
 import logging as log
+import subprocess
 from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 from threading import Lock
 
-from anthropic import Anthropic, HUMAN_PROMPT, AI_PROMPT
+from anthropic import HUMAN_PROMPT, AI_PROMPT
+
+from audgit import llm, usage
+from audgit.singleflight import SingleFlight
+from audgit.ratelimit import TokenBucket
+from audgit.retrieval import BM25Index, identifiers, path_terms, tokenize
 
 ANTHROPIC_API_KEY = os.environ["ANTHROPIC_API_KEY"]
 
+# parallel description calls per repo, and the request rate shared by all of them (requests/sec)
+DESCRIBE_CONCURRENCY = int(os.environ.get("AUDGIT_DESCRIBE_CONCURRENCY", "8"))
+DESCRIBE_RATE = float(os.environ.get("AUDGIT_DESCRIBE_RATE", "4"))
+
+describe_bucket = TokenBucket(DESCRIBE_RATE)
+
+DESCRIBE_MODEL = "claude-instant-1"
+
+# files sent to which_files_claude_call, the rest are cut by the local bm25 ranking
+SHORTLIST_K = int(os.environ.get("AUDGIT_SHORTLIST_K", "60"))
+
 
 # def complete(prompt):
 #     wompwomp = "WOMPWOMP: " + prompt + " WOMP"
 #     return wompwomp
 
 
-def complete(prompt: str):
+def complete(prompt: str, bucket: TokenBucket | None = None):
     bigger_prompt = f"""{HUMAN_PROMPT}
 
 {prompt}
@@ -24,12 +43,7 @@ def complete(prompt: str):
 {AI_PROMPT}
   """
 
-    anthropic = Anthropic()
-    completion = anthropic.completions.create(
-        model="claude-instant-1", max_tokens_to_sample=3000, prompt=bigger_prompt
-    )
-
-    return completion.completion
+    return llm.complete(bigger_prompt, model=DESCRIBE_MODEL, max_tokens=3000, bucket=bucket, purpose="describe")
 
 
 def generate_file_descrips(paths, org, name, repo_root):
@@ -37,11 +51,23 @@ def generate_file_descrips(paths, org, name, repo_root):
     filter_filepaths(paths)
     log.debug("Generating descriptions for filtered_paths.")
     pierre = ThankYouPierre(org, name, repo_root)
-    descriptions = pierre.get_descriptions()
+    # concurrent jobs on the same revision share one run
+    descriptions = describe_flight.do((pierre.canon_name, repo_root, pierre.revision()), pierre.get_descriptions)
 
     return descriptions
 
 
+def shortlist_file_descrips(descriptions, org, name, repo_root, query, k=SHORTLIST_K):
+    """Keep the k files that best match the query, ranked by the repo's bm25 index."""
+    if len(descriptions) <= k:
+        return descriptions
+    pierre = ThankYouPierre(org, name, repo_root)
+    index = pierre.get_index(descriptions)
+    shortlist = {filename: descriptions[filename] for filename, _ in index.search(query, k)}
+    log.debug("Shortlisted %s of %s files", len(shortlist), len(descriptions))
+    return shortlist
+
+
 def filter_filepaths(paths):
     """filter out non-relevant files"""
 
@@ -64,7 +90,37 @@ def filter_filepaths(paths):
     return filtered_paths
 
 
+def blob_sha(data: bytes) -> str:
+    """git blob hash of data, same as `git hash-object`"""
+    return hashlib.sha1(b"blob %d\0" % len(data) + data).hexdigest()
+
+
+def read_code(filename: str) -> str | None:
+    """file contents, None for binary or blank files"""
+    try:
+        with open(filename, 'r') as f:
+            code = f.read()
+    except (UnicodeDecodeError, FileNotFoundError):
+        return None
+    if code.strip() == '':
+        return None
+    return code
+
+
+def decode_code(data: bytes) -> str | None:
+    try:
+        code = data.decode()
+    except UnicodeDecodeError:
+        return None
+    if code.strip() == '':
+        return None
+    return code
+
+
+EMPTY_BLOB = blob_sha(b"").encode()
+
 mutexes = defaultdict(lambda: Lock())
+describe_flight = SingleFlight()
 
 
 class ThankYouPierre:
@@ -84,6 +140,13 @@ class ThankYouPierre:
         self.num_files = 0
         self.mutex = mutexes[self.canon_name]
 
+    def wanted(self, relpath: str) -> bool:
+        """Same file and directory rules as walk(), for a path relative to the repo root."""
+        *dirs, name = relpath.split("/")
+        if name[0] == '.' or not name.endswith(ThankYouPierre.extensions):
+            return False
+        return not any(d[0] == '.' or d.startswith(ThankYouPierre.directory_blacklist) for d in dirs)
+
     def walk(self, max_num_files=1000):
         num_files = 0
         for root, dirs, files in os.walk(self.local_path, topdown=True):
@@ -92,13 +155,8 @@ class ThankYouPierre:
             for name in files:
                 filename = os.path.join(root, name)
 
-                try:
-                    with open(filename, 'r') as f:
-                        code = f.read()
-                except UnicodeDecodeError:
-                    continue
-
-                if code.strip() == '': continue
+                code = read_code(filename)
+                if code is None: continue
 
                 if num_files >= max_num_files:
                     return
@@ -108,55 +166,173 @@ class ThankYouPierre:
                 num_files += 1
                 self.num_files = num_files
 
+    def revision(self) -> str | None:
+        res = subprocess.run(["git", "-C", self.local_path, "rev-parse", "-q", "--verify", "HEAD"], capture_output=True)
+        return res.stdout.decode().strip() if res.returncode == 0 else None
+
+    def list_blobs(self, max_num_files=1000) -> list[tuple[str, str, str | None]]:
+        """(filename, blob sha, code) for candidate files.
+
+        Hashes come from the git index, so no file is opened and code is None. Outside a git checkout this
+        falls back to walk() and hashes what it read, a missing or empty directory gives an empty list.
+        """
+        try:
+            out = subprocess.run(["git", "-C", self.local_path, "ls-files", "--stage", "-z"],
+                                 capture_output=True, check=True).stdout
+        except (OSError, subprocess.CalledProcessError):
+            return [(filename, blob_sha(code.encode()), code) for filename, _, _, code in self.walk(max_num_files)]
+
+        entries = []
+        for record in out.split(b"\0"):
+            if not record:
+                continue
+            meta, path = record.split(b"\t", 1)
+            mode, sha, _stage = meta.split()
+            relpath = path.decode(errors="replace")
+            # regular files only, no symlinks or submodules
+            if mode not in (b"100644", b"100755") or sha == EMPTY_BLOB or not self.wanted(relpath):
+                continue
+            entries.append((os.path.join(self.local_path, relpath), sha.decode(), None))
+            if len(entries) >= max_num_files:
+                break
+        return entries
+
+    def hash_object(self, filename) -> str | None:
+        """Blob sha git would store for the file, after eol conversion and clean filters."""
+        res = subprocess.run(["git", "-C", self.local_path, "hash-object", "--", filename], capture_output=True)
+        return res.stdout.decode().strip() if res.returncode == 0 else None
+
+    def save_path(self):
+        return os.path.join(self.tmp_path, f"{self.canon_name}_blobs.json")
+
     def load_descriptions(self):
-        save_path = os.path.join(self.tmp_path, f"{self.canon_name}_descriptions.json")
+        save_path = self.save_path()
         if not os.path.exists(save_path):
             return None
         with open(save_path, 'rb') as f:
             data = json.load(f)
         return data
 
-    def get_descriptions(self, save=True, save_every=10):
+    def get_descriptions(self, save=True, save_every=10, max_workers=DESCRIBE_CONCURRENCY, bucket=describe_bucket):
+        """Map of filename -> description.
+
+        Descriptions are cached by git blob sha, so only new content is sent for completion, and renamed or
+        moved files keep their description. None is cached for blobs that can't be described (binary, empty).
+        """
         with self.mutex:
-            descriptions = self.load_descriptions()
-            if descriptions is not None and len(descriptions) == self.num_files:
-                return descriptions
-
-            if descriptions is None:
-                descriptions = {}
-
-            generator = self.walk()
-            description_prompt = 'A 1-sentence summary in plain English of the above code, with no other commentary, is:'
-            num_files = len(descriptions)
-            for filename, root, dirs, code in generator:
-                # Skip files that already have descriptions
-                if filename in descriptions:
-                    continue
-                extension = filename.split('.')[-1]
-                if len(code) / 3 > 100000:
-                    code = code[0:300000]
-                prompt = f'File: {filename}\n\nCode:\n\n```{extension}\n{code}```\n\n{description_prompt}\nThis file'
-                try:
-                    description = complete(prompt)
-                except Exception:
-                    log.exception("Error doing completion for :%s", filename)
+            blobs = self.load_descriptions() or {}
+
+            files = {}
+            todo = {}
+            for filename, sha, code in self.list_blobs():
+                files[filename] = sha
+                if sha not in blobs and sha not in todo:
+                    todo[sha] = (filename, code)
+            self.num_files = len(files)
+            # blobs described on an earlier run are completions we didn't have to pay for
+            usage.record_cached("describe", DESCRIBE_MODEL, sum(1 for sha in set(files.values()) if sha in blobs))
+
+            if todo:
+                log.debug("Describing %s new blobs out of %s files", len(todo), len(files))
+                self.describe_all(todo, blobs, save, save_every, max_workers, bucket)
+                if save:
+                    self.save_descriptions(blobs)
+
+            return {filename: blobs[sha] for filename, sha in files.items() if blobs.get(sha)}
+
+    def describe_all(self, todo, blobs, save, save_every, max_workers, bucket):
+        num_files = 0
+        pending = set()
+        describe = usage.propagate(self.describe)
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            for sha, (filename, code) in todo.items():
+                # keep the window small so we don't hold every file's contents in memory
+                if len(pending) >= max_workers * 2:
+                    finished, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    num_files = self.collect(finished, blobs, num_files, save, save_every)
+                pending.add(executor.submit(describe, sha, filename, code, bucket))
+
+            finished, _ = wait(pending)
+            self.collect(finished, blobs, num_files, save, save_every)
+
+    def describe(self, sha, filename, code, bucket: TokenBucket | None = None):
+        if code is None:
+            try:
+                with open(filename, 'rb') as f:
+                    data = f.read()
+            except FileNotFoundError:
+                data = b""
+            if blob_sha(data) != sha and self.hash_object(filename) != sha:
+                # the checkout was refreshed under us, don't cache this content under the old hash
+                log.debug("%s changed while describing, skipping", filename)
+                return sha, filename, False
+            code = decode_code(data)
+            if code is None:
+                return sha, filename, None
+        description_prompt = 'A 1-sentence summary in plain English of the above code, with no other commentary, is:'
+        extension = filename.split('.')[-1]
+        if len(code) / 3 > 100000:
+            code = code[0:300000]
+        prompt = f'File: {filename}\n\nCode:\n\n```{extension}\n{code}```\n\n{description_prompt}\nThis file'
+
+        try:
+            return sha, filename, complete(prompt, bucket)
+        except Exception:
+            log.exception("Error doing completion for :%s", filename)
+            return sha, filename, False
+
+    def collect(self, finished, blobs, num_files, save, save_every):
+        """Store finished descriptions, checkpointing every save_every files."""
+        for future in finished:
+            sha, filename, description = future.result()
+            if description is False:
+                # failed completion, try again next time
+                continue
+            blobs[sha] = description
+
+            log.debug(f"{filename}: {description}")
+
+            if save and (num_files % save_every == 0):
+                log.debug(f'Saving descriptions for {num_files} files')
+                self.save_descriptions(blobs)
+
+            num_files += 1
+        return num_files
+
+    def get_index(self, descriptions) -> BM25Index:
+        """bm25 index over the described files: path, description and the identifiers each file defines.
+
+        Identifier terms are cached by blob sha next to the descriptions, so only new content is read.
+        """
+        with self.mutex:
+            terms_path = os.path.join(self.tmp_path, f"{self.canon_name}_terms.json")
+            cached = {}
+            if os.path.exists(terms_path):
+                with open(terms_path, 'rb') as f:
+                    cached = json.load(f)
+
+            index = BM25Index()
+            dirty = False
+            for filename, sha, code in self.list_blobs():
+                if filename not in descriptions:
                     continue
-                descriptions[filename] = description
-
-                log.debug(f"{filename}: {description}")
-
-                if save and (num_files % save_every == 0):
-                    log.debug(f'Saving descriptions for {num_files} files')
-                    self.save_descriptions(descriptions)
-
-                num_files += 1
-
-            if save:
-                self.save_descriptions(descriptions)
-
-            return descriptions
+                if sha not in cached:
+                    code = code if code is not None else read_code(filename)
+                    cached[sha] = tokenize(" ".join(identifiers(code or "")))
+                    dirty = True
+                terms = path_terms(os.path.relpath(filename, self.local_path))
+                terms.update(tokenize(descriptions[filename]))
+                terms.update(cached[sha])
+                index.add(filename, terms)
+
+            if dirty:
+                with open(terms_path + ".tmp", 'w') as f:
+                    json.dump(cached, f)
+                os.replace(terms_path + ".tmp", terms_path)
+            return index
 
     def save_descriptions(self, descriptions):
-        save_path = os.path.join(self.tmp_path, f"{self.canon_name}_descriptions.json")
-        with open(save_path, 'w') as f:
+        save_path = self.save_path()
+        with open(save_path + ".tmp", 'w') as f:
             json.dump(descriptions, f)
+        os.replace(save_path + ".tmp", save_path)
@@ -0,0 +1,122 @@
+"""crawl frontier: canonical urls, per-url depth and a compact visited set"""
+
+import hashlib
+import threading
+from collections import deque
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+DEFAULT_PORTS = {"http": 80, "https": 443}
+
+
+def canonicalize(url: str) -> str:
+    """One spelling per page: lowercase scheme and host, no default port, no fragment,
+    sorted query and no trailing slash."""
+    parts = urlsplit(url.strip())
+    scheme = parts.scheme.lower()
+    host = (parts.hostname or "").lower()
+    if parts.port and parts.port != DEFAULT_PORTS.get(scheme):
+        host = f"{host}:{parts.port}"
+    if parts.username:
+        userinfo = parts.username + (f":{parts.password}" if parts.password else "")
+        host = f"{userinfo}@{host}"
+    path = parts.path.rstrip("/") or "/"
+    query = urlencode(sorted(parse_qsl(parts.query, keep_blank_values=True)))
+    return urlunsplit((scheme, host, path, query, ""))
+
+
+class VisitedSet:
+    """Set of 64 bit url digests, a fraction of the memory of the url strings it stands for.
+
+    Collisions are possible but at 2^-64 per pair they don't matter for crawls of any realistic size.
+    """
+
+    def __init__(self):
+        self.digests: set[int] = set()
+
+    @staticmethod
+    def digest(url: str) -> int:
+        return int.from_bytes(hashlib.blake2b(url.encode(), digest_size=8).digest(), "little")
+
+    def add(self, url: str) -> bool:
+        """Add url, False if it was already there."""
+        digest = self.digest(url)
+        if digest in self.digests:
+            return False
+        self.digests.add(digest)
+        return True
+
+    def __contains__(self, url: str) -> bool:
+        return self.digest(url) in self.digests
+
+    def __len__(self) -> int:
+        return len(self.digests)
+
+
+class Frontier:
+    """Breadth first queue of (url, depth) shared by crawl workers, each canonical url is handed out once.
+
+    The crawl is over when the queue is empty and no worker holds a url it could still add links from,
+    or when finish() is called.
+    """
+
+    def __init__(self, max_depth: int):
+        self.max_depth = max_depth
+        self.cond = threading.Condition()
+        self.queue: deque[tuple[str, int]] = deque()
+        self.visited = VisitedSet()
+        self.active = 0
+        self.finished = False
+        self.too_deep = 0
+
+    def add(self, url: str, depth: int) -> bool:
+        """Queue url found at depth, False if it is too deep, already seen or the crawl is over.
+
+        The canonical form is only the visited key, url is queued as given: relative links on the page
+        resolve against it, and canonicalize drops the trailing slash they depend on.
+        """
+        with self.cond:
+            if self.finished:
+                return False
+            if depth > self.max_depth:
+                self.too_deep += 1
+                return False
+            if not self.visited.add(canonicalize(url)):
+                return False
+            self.queue.append((url, depth))
+            self.cond.notify()
+            return True
+
+    def requeue(self, url: str, depth: int):
+        """Put back a url handed out by next() that couldn't be fetched yet, at the front of the queue."""
+        with self.cond:
+            if self.finished:
+                return
+            self.queue.appendleft((url, depth))
+            self.cond.notify()
+
+    def next(self) -> tuple[str, int] | None:
+        """Next url and its depth, blocks while other workers may still add urls, None when the crawl is over.
+
+        Every url returned must be matched by a task_done() call.
+        """
+        with self.cond:
+            while not self.finished and not self.queue and self.active:
+                self.cond.wait()
+            if self.finished or not self.queue:
+                self.finished = True
+                self.cond.notify_all()
+                return None
+            self.active += 1
+            return self.queue.popleft()
+
+    def task_done(self):
+        with self.cond:
+            self.active -= 1
+            if not self.active:
+                self.cond.notify_all()
+
+    def finish(self):
+        with self.cond:
+            self.finished = True
+            self.queue.clear()
+            self.cond.notify_all()
@@ -1,7 +1,15 @@
 import os
+import logging
+from dataclasses import dataclass
+
 from dotenv import load_dotenv
 import subprocess
 
+from audgit import metrics
+from audgit.singleflight import SingleFlight
+
+log = logging.getLogger("audgit")
+
 # load the .env file. By default, it looks for the .env file in the same directory as the script
 # If your .env file is one directory up, you need to specify the path
 load_dotenv()
@@ -16,29 +24,81 @@ headers = {
 }
 
 
-def get_file_tree(repo_url: str, local_path: str):
-    """
-    Clone a repository and return the tree structure
-    """
-    if not os.path.exists(local_path):
-        print("Cloning...")
-        # Clone the repository
-        result = subprocess.run(
-            ["git", "clone", repo_url, local_path],
+@dataclass
+class RepoSync:
+    head: str
+    previous_head: str | None
+    # paths that differ from previous_head, None when there was no previous checkout
+    changed: list[str] | None
+
+
+def git(local_path: str, *args: str) -> subprocess.CompletedProcess:
+    with metrics.span("git", cmd=args[0]):
+        return subprocess.run(
+            ["git", "-C", local_path, *args],
             stdout=subprocess.PIPE,
             stderr=subprocess.PIPE,
         )
 
-        if result.returncode != 0:
-            print(f"Error cloning repository: {result.stderr.decode('utf-8')}")
-            return []
-    else:
-        print("Repository already exists. Skipping clone.")
 
+def get_head(local_path: str) -> str | None:
+    res = git(local_path, "rev-parse", "-q", "--verify", "HEAD")
+    return res.stdout.decode().strip() if res.returncode == 0 else None
+
+
+def sync_repo(repo_url: str, local_path: str) -> RepoSync | None:
+    """
+    Bring local_path to the head of the remote's default branch.
+
+    Only the tip commit is fetched (depth 1), so refreshing an unchanged repo is a single
+    small round trip. Returns None if the repository could not be fetched.
+    """
+    if not os.path.isdir(os.path.join(local_path, ".git")):
+        os.makedirs(local_path, exist_ok=True)
+        git(local_path, "init", "-q")
+
+    res = git(local_path, "remote", "set-url", "origin", repo_url)
+    if res.returncode != 0:
+        git(local_path, "remote", "add", "origin", repo_url)
+
+    previous_head = get_head(local_path)
+
+    log.debug("fetching %s", repo_url)
+    res = git(local_path, "fetch", "-q", "--depth", "1", "origin", "HEAD")
+    if res.returncode != 0:
+        log.error("Error fetching repository: %s", res.stderr.decode("utf-8"))
+        return None
+
+    head = git(local_path, "rev-parse", "FETCH_HEAD").stdout.decode().strip()
+
+    changed = None
+    if previous_head:
+        if previous_head == head:
+            changed = []
+        else:
+            res = git(local_path, "diff", "--name-only", "-z", previous_head, head)
+            changed = [p for p in res.stdout.decode().split("\0") if p] if res.returncode == 0 else None
+
+    if head != previous_head:
+        res = git(local_path, "reset", "-q", "--hard", head)
+        if res.returncode != 0:
+            log.error("Error updating repository: %s", res.stderr.decode("utf-8"))
+            return None
+
+    log.info("synced %s at %s, changed: %s", repo_url, head, "all" if changed is None else len(changed))
+    return RepoSync(head=head, previous_head=previous_head, changed=changed)
+
+
+# one clone/refresh at a time per checkout, concurrent jobs share its result
+repo_flight = SingleFlight()
+
+
+def list_files(local_path: str):
     file_paths = []
 
     # Walk the repository
     for root, dirs, files in os.walk(local_path):
+        dirs[:] = [d for d in dirs if d != ".git"]
         for file in files:
             # Get the full file path
             full_path = os.path.join(root, file)
@@ -51,6 +111,33 @@ def get_file_tree(repo_url: str, local_path: str):
     return file_paths
 
 
+def sync_file_tree(repo_url: str, local_path: str, refresh: bool = True) -> tuple[list[str], RepoSync | None]:
+    """
+    Clone or refresh a repository, return its files and what the refresh changed
+
+    The RepoSync is None when nothing was fetched (no refresh, or the fetch failed), its changed paths
+    let callers keep caches keyed by path instead of dropping them wholesale.
+    """
+    sync = None
+    if refresh or not os.path.exists(local_path):
+        sync = repo_flight.do(local_path, sync_repo, repo_url, local_path)
+        if not sync:
+            if get_head(local_path) is None:
+                return [], None
+            log.warning("Refresh failed, using the existing checkout of %s", repo_url)
+    else:
+        log.info("Repository already exists. Skipping clone.")
+
+    return list_files(local_path), sync
+
+
+def get_file_tree(repo_url: str, local_path: str, refresh: bool = True):
+    """
+    Clone or refresh a repository and return the tree structure
+    """
+    return sync_file_tree(repo_url, local_path, refresh)[0]
+
+
 def get_file_contents(local_path: str, file_paths: list):
     """
     This function opens each file in a repository and reads its contents.
@@ -0,0 +1,275 @@
+"""on-disk http cache revalidated with ETag / Last-Modified, so an unchanged resource costs a 304"""
+
+import hashlib
+import json
+import math
+import os
+import re
+import sqlite3
+import time
+import logging
+from dataclasses import dataclass, field
+import threading
+
+import requests
+from requests.structures import CaseInsensitiveDict
+from requests.utils import parse_header_links
+
+from audgit.spool import CHUNK_SIZE, Content, iter_content, spool
+
+log = logging.getLogger("audgit")
+
+# off unless a directory is given, it keeps the bodies of authenticated requests (private issues included)
+DEFAULT_HTTP_CACHE = os.environ.get("AUDGIT_HTTP_CACHE") or None
+# least recently used bodies are dropped once the cache holds more than this
+HTTP_CACHE_MAX_BYTES = int(os.environ.get("AUDGIT_HTTP_CACHE_MAX_BYTES", 500 * 1000 * 1000))
+
+MAX_AGE = re.compile(r"max-age=(\d+)")
+
+
+@dataclass
+class CachedResponse:
+    url: str
+    status_code: int
+    headers: dict[str, str]
+    content: Content
+    # served from disk, still fresh or after the server answered 304
+    from_cache: bool = False
+    links: dict[str, str] = field(init=False)
+
+    def __post_init__(self):
+        link = next((v for k, v in self.headers.items() if k.lower() == "link"), "")
+        self.links = {
+            entry["rel"]: entry["url"] for entry in parse_header_links(link) if "rel" in entry
+        } if link else {}
+
+    def json(self):
+        return json.loads(bytes(self.content))
+
+
+@dataclass
+class Entry:
+    etag: str | None
+    last_modified: str | None
+    headers: dict[str, str]
+    expires: float
+
+    @property
+    def fresh(self) -> bool:
+        return time.time() < self.expires
+
+
+def max_age(headers) -> float | None:
+    """Seconds the response may be served without asking the server, None if it must not be stored."""
+    cache_control = CaseInsensitiveDict(headers).get("Cache-Control", "").lower()
+    if "no-store" in cache_control:
+        return None
+    if "no-cache" in cache_control:
+        return 0
+    match = MAX_AGE.search(cache_control)
+    return int(match[1]) if match else 0
+
+
+def read_body(response: requests.Response, url: str, max_size: int | None,
+              spool_size: int | None = None) -> tuple[Content, bool]:
+    """Body of a streamed response cut at max_size, spooled past spool_size. (content, truncated)"""
+    if max_size is None and spool_size is None:
+        return response.content, False
+    content, truncated = spool(response.iter_content(chunk_size=CHUNK_SIZE),
+                               spool_size if spool_size is not None else math.inf, max_size)
+    if truncated:
+        log.warning("ignoring the rest of %s: too big", url)
+    return content, truncated
+
+
+class HttpCache:
+    """Bodies live in files named by key, validators and headers in a sqlite index next to them."""
+
+    def __init__(self, path: str, max_bytes: int = HTTP_CACHE_MAX_BYTES):
+        self.path = path
+        self.max_bytes = max_bytes
+        # hits: fresh, no request. revalidated: 304 served from disk. misses: full download
+        self.counts = {"hits": 0, "revalidated": 0, "misses": 0, "evicted": 0}
+        os.makedirs(os.path.join(path, "bodies"), mode=0o700, exist_ok=True)
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(os.path.join(path, "index.db"), check_same_thread=False, isolation_level=None)
+        with self.lock:
+            self.db.execute("PRAGMA journal_mode=WAL")
+            self.db.execute("PRAGMA synchronous=NORMAL")
+            self.db.execute(
+                "CREATE TABLE IF NOT EXISTS entries ("
+                "key TEXT PRIMARY KEY, url TEXT, etag TEXT, last_modified TEXT, headers TEXT, size INTEGER, accessed REAL, "
+                "expires REAL DEFAULT 0)"
+            )
+            columns = {row[1] for row in self.db.execute("PRAGMA table_info(entries)")}
+            if "expires" not in columns:
+                self.db.execute("ALTER TABLE entries ADD COLUMN expires REAL DEFAULT 0")
+            self.db.execute("CREATE INDEX IF NOT EXISTS entries_accessed ON entries (accessed)")
+            self.db.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+            self.size = self.db.execute("SELECT coalesce(sum(size), 0) FROM entries").fetchone()[0]
+
+    @staticmethod
+    def key(url: str, vary: str = "") -> str:
+        # vary keeps responses seen with different credentials apart
+        return hashlib.sha256(f"{vary}\n{url}".encode()).hexdigest()
+
+    def body_path(self, key: str) -> str:
+        return os.path.join(self.path, "bodies", key)
+
+    def lookup(self, key: str) -> Entry | None:
+        """The cached response, if its body is still on disk."""
+        with self.lock:
+            row = self.db.execute(
+                "SELECT etag, last_modified, headers, expires FROM entries WHERE key = ?", (key,)
+            ).fetchone()
+        if not row or not os.path.exists(self.body_path(key)):
+            return None
+        return Entry(row[0], row[1], json.loads(row[2]), row[3] or 0)
+
+    def read(self, key: str, spool_size: int | None = None) -> Content | None:
+        """The stored body, None if it was evicted since lookup()."""
+        try:
+            f = open(self.body_path(key), "rb")
+        except FileNotFoundError:
+            return None
+        with f:
+            if spool_size is None:
+                return f.read()
+            return spool(iter(lambda: f.read(CHUNK_SIZE), b""), spool_size)[0]
+
+    def put(self, key: str, url: str, headers: dict[str, str], content: Content, expires: float = 0):
+        validators = CaseInsensitiveDict(headers)
+        path = self.body_path(key)
+        tmp = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp, "wb") as f:
+            for chunk in iter_content(content):
+                f.write(chunk)
+        os.replace(tmp, path)
+        with self.lock:
+            row = self.db.execute("SELECT size FROM entries WHERE key = ?", (key,)).fetchone()
+            self.db.execute(
+                "INSERT OR REPLACE INTO entries (key, url, etag, last_modified, headers, size, accessed, expires) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (key, url, validators.get("ETag"), validators.get("Last-Modified"), json.dumps(headers), len(content),
+                 time.time(), expires),
+            )
+            self.size += len(content) - (row[0] if row else 0)
+        if self.size > self.max_bytes:
+            self.evict()
+
+    def evict(self):
+        """Drop least recently used entries until the cache is back under 90% of max_bytes."""
+        target = self.max_bytes * 0.9
+        with self.lock:
+            victims = []
+            size = self.size
+            for key, entry_size in self.db.execute("SELECT key, size FROM entries ORDER BY accessed"):
+                if size <= target:
+                    break
+                victims.append(key)
+                size -= entry_size
+            self.db.executemany("DELETE FROM entries WHERE key = ?", [(key,) for key in victims])
+            self.size = size
+            self.counts["evicted"] += len(victims)
+        for key in victims:
+            try:
+                os.remove(self.body_path(key))
+            except FileNotFoundError:
+                pass
+        log.debug("http cache: evicted %s entries", len(victims))
+
+    def touch(self, key: str, headers: dict[str, str] | None = None, expires: float | None = None):
+        with self.lock:
+            self.db.execute(
+                "UPDATE entries SET headers = coalesce(?, headers), expires = coalesce(?, expires), accessed = ? "
+                "WHERE key = ?",
+                (json.dumps(headers) if headers is not None else None, expires, time.time(), key),
+            )
+
+    def count(self, name: str):
+        with self.lock:
+            self.counts[name] += 1
+
+    @property
+    def stats(self) -> dict[str, float]:
+        with self.lock:
+            stats: dict[str, float] = dict(self.counts)
+            stats["bytes"] = self.size
+        total = stats["hits"] + stats["revalidated"] + stats["misses"]
+        stats["hit_rate"] = (stats["hits"] + stats["revalidated"]) / total if total else 0.0
+        return stats
+
+    def get(self, session: requests.Session, url: str, headers: dict[str, str] | None = None,
+            timeout: float = 30, max_size: int | None = None, spool_size: int | None = None) -> CachedResponse:
+        """GET url, served from disk while fresh, revalidated once stale. Bodies over max_size are cut and not stored."""
+        request_headers = headers
+        headers = dict(headers or {})
+        key = self.key(url, headers.get("Authorization", ""))
+        entry = self.lookup(key)
+        if entry and entry.fresh:
+            content = self.read(key, spool_size)
+            if content is not None:
+                self.count("hits")
+                self.touch(key)
+                return CachedResponse(url, 200, entry.headers, content, from_cache=True)
+            entry = None
+        if entry:
+            if entry.etag:
+                headers["If-None-Match"] = entry.etag
+            if entry.last_modified:
+                headers["If-Modified-Since"] = entry.last_modified
+
+        with session.get(url, headers=headers, timeout=timeout, stream=max_size is not None or spool_size is not None) as res:
+            if res.status_code == 304 and entry:
+                log.debug("http cache: %s not modified", url)
+                # a 304 refreshes the stored headers
+                merged = CaseInsensitiveDict(entry.headers)
+                merged.update({k: v for k, v in res.headers.items() if k.lower() != "content-length"})
+                stored = dict(merged)
+                age = max_age(stored)
+                content = self.read(key, spool_size)
+                if content is None:
+                    # evicted while we asked, the next lookup misses and fetches the body again
+                    log.debug("http cache: %s evicted during revalidation", url)
+                    return self.get(session, url, request_headers, timeout, max_size, spool_size)
+                self.count("revalidated")
+                self.touch(key, stored, time.time() + (age or 0))
+                return CachedResponse(url, 200, stored, content, from_cache=True)
+
+            content, truncated = read_body(res, url, max_size, spool_size)
+            resp_headers = dict(res.headers)
+            status = res.status_code
+            final_url = res.url or url
+
+        self.count("misses")
+        age = max_age(resp_headers)
+        validators = CaseInsensitiveDict(resp_headers)
+        validated = "ETag" in validators or "Last-Modified" in validators
+        if status == 200 and not truncated and age is not None and (validated or age):
+            self.put(key, url, resp_headers, content, time.time() + age)
+        return CachedResponse(final_url, status, resp_headers, content)
+
+    def get_meta(self, key: str) -> str | None:
+        with self.lock:
+            row = self.db.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def set_meta(self, key: str, value: str):
+        with self.lock:
+            self.db.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, value))
+
+    def close(self):
+        with self.lock:
+            self.db.close()
+
+
+def cached_get(session: requests.Session, url: str, headers: dict[str, str] | None = None,
+               cache: HttpCache | None = None, timeout: float = 30, max_size: int | None = None,
+               spool_size: int | None = None) -> CachedResponse:
+    """GET through the cache when there is one."""
+    if cache is not None:
+        return cache.get(session, url, headers, timeout, max_size, spool_size)
+    stream = max_size is not None or spool_size is not None
+    with session.get(url, headers=headers, timeout=timeout, stream=stream) as res:
+        content, _truncated = read_body(res, url, max_size, spool_size)
+        return CachedResponse(res.url or url, res.status_code, dict(res.headers), content)
@@ -3,6 +3,8 @@ import requests
 import os
 from dotenv import load_dotenv
 
+from audgit import metrics
+
 # load the .env file. By default, it looks for the .env file in the same directory as the script
 # If your .env file is one directory up, you need to specify the path
 load_dotenv()
@@ -10,6 +12,9 @@ load_dotenv()
 # Load the lightning address from an environment variable
 LIGHTNING_ADDRESS = os.environ["LIGHTNING_ADDRESS"]
 
+# lnurl endpoints are https, only a local stand-in would be reached over http
+LNURL_SCHEME = os.environ.get("AUDGIT_LNURL_SCHEME", "https")
+
 
 def get_callback_url(lnaddr: str):
     # split the lightning address into username@domain.com
@@ -17,7 +22,8 @@ def get_callback_url(lnaddr: str):
     username = parts[0]
     domain = parts[1]
 
-    res = requests.get(f"https://{domain}/.well-known/lnurlp/{username}")
+    with metrics.span("http.lnurlp"):
+        res = requests.get(f"{LNURL_SCHEME}://{domain}/.well-known/lnurlp/{username}")
     if res.status_code != 200:
         raise Exception(f"Error: API request status {res.status_code}")
     callback = res.json()["callback"]
@@ -30,12 +36,13 @@ def get_verif_url(lnaddr: str):
     username = parts[0]
     domain = parts[1]
 
-    return f"https://{domain}/.well-known/lnurlp/{username}/verify"
+    return f"{LNURL_SCHEME}://{domain}/.well-known/lnurlp/{username}/verify"
 
 
 def get_callback(msats: int):
     c = get_callback_url(LIGHTNING_ADDRESS)
-    res = requests.get(f"{c}?amount={msats}")
+    with metrics.span("http.invoice"):
+        res = requests.get(f"{c}?amount={msats}")
     if res.status_code != 200:
         raise Exception(f"Error: API request status {res.status_code}")
     ret = res.json()
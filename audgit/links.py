@@ -0,0 +1,147 @@
+"""pluggable <a href> extraction for the crawler"""
+
+import html
+import multiprocessing
+import os
+import re
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from typing import Iterable, Protocol
+
+from audgit.spool import Body, Content
+
+# pages at least this big are parsed in a worker process, off the crawl threads. Pages that were spooled
+# (AUDGIT_SPOOL_SIZE) are read there from their temp file, smaller ones are sent over as bytes
+LINKS_PROCESS_THRESHOLD = int(os.environ.get("AUDGIT_LINKS_PROCESS_THRESHOLD", 256 * 1024))
+LINKS_PROCESSES = int(os.environ.get("AUDGIT_LINKS_PROCESSES", min(4, os.cpu_count() or 1)))
+
+CHUNK_SIZE = 64 * 1024
+
+ANCHOR = re.compile(
+    rb"""<a\s[^>]*?\bhref\s*=\s*(?:"([^"]*)"|'([^']*)'|([^\s"'>]+))""",
+    re.IGNORECASE,
+)
+# markup whose content never holds real anchors
+SKIP = re.compile(rb"<!--.*?-->|<script\b.*?</script\s*>|<style\b.*?</style\s*>", re.IGNORECASE | re.DOTALL)
+OPENER = re.compile(rb"<!--|<script\b|<style\b", re.IGNORECASE)
+# a tag, comment or script block may be cut by a chunk boundary, keep this much unparsed tail at most
+MAX_TAIL = 16 * 1024
+
+
+class LinkExtractor(Protocol):
+    def links(self, content: bytes) -> list[str]:
+        """Raw href values of the anchors in an html page, in document order."""
+        ...
+
+
+class SoupExtractor:
+    """Full html.parser tree, slow but as lenient as a browser."""
+
+    def links(self, content: bytes) -> list[str]:
+        from bs4 import BeautifulSoup
+        soup = BeautifulSoup(content, "html.parser")
+        return [href for link in soup.find_all("a") if (href := link.get("href"))]
+
+
+class HrefScanner:
+    """Incremental href scanner, feed it a page chunk by chunk as it is downloaded."""
+
+    def __init__(self):
+        self.tail = b""
+
+    def feed(self, chunk: bytes) -> list[str]:
+        # complete comments and script/style blocks go first, whatever is left of one is still open
+        data = SKIP.sub(b"", self.tail + chunk)
+        # everything before the last '<' and before an open block is complete markup
+        cut = data.rfind(b"<")
+        if cut < 0:
+            cut = len(data)
+        if opened := OPENER.search(data):
+            cut = min(cut, opened.start())
+        cut = max(cut, len(data) - MAX_TAIL)
+        self.tail = data[cut:]
+        return self._scan(data[:cut])
+
+    def close(self) -> list[str]:
+        data, self.tail = self.tail, b""
+        if opened := OPENER.search(data):
+            # never closed, like a browser treat the rest of the page as its content
+            data = data[:opened.start()]
+        return self._scan(data)
+
+    @staticmethod
+    def _scan(data: bytes) -> list[str]:
+        out = []
+        for match in ANCHOR.finditer(data):
+            raw = match[1] if match[1] is not None else match[2] if match[2] is not None else match[3]
+            href = html.unescape(raw.decode("utf-8", "replace")).strip()
+            if href:
+                out.append(href)
+        return out
+
+
+class RegexExtractor:
+    """Streaming regex scan over the raw bytes, no tree and no decode of the whole page."""
+
+    def links(self, content: bytes | Iterable[bytes]) -> list[str]:
+        scanner = HrefScanner()
+        out: list[str] = []
+        if isinstance(content, (bytes, bytearray, memoryview)):
+            view = memoryview(content)
+            chunks: Iterable[bytes] = (bytes(view[i:i + CHUNK_SIZE]) for i in range(0, len(view), CHUNK_SIZE))
+        else:
+            chunks = content
+        for chunk in chunks:
+            out += scanner.feed(chunk)
+        out += scanner.close()
+        return out
+
+
+EXTRACTORS: dict[str, LinkExtractor] = {
+    "soup": SoupExtractor(),
+    "regex": RegexExtractor(),
+}
+
+_pool: ProcessPoolExecutor | None = None
+_pool_lock = threading.Lock()
+
+
+def get_pool() -> ProcessPoolExecutor:
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                # spawn, forking a process full of crawl threads isn't safe
+                _pool = ProcessPoolExecutor(max_workers=LINKS_PROCESSES, mp_context=multiprocessing.get_context("spawn"))
+    return _pool
+
+
+def _extract(name: str, content: bytes) -> list[str]:
+    return EXTRACTORS[name].links(content)
+
+
+def _extract_file(name: str, path: str) -> list[str]:
+    with open(path, "rb") as f:
+        if name == "regex":
+            return EXTRACTORS[name].links(iter(lambda: f.read(CHUNK_SIZE), b""))
+        return EXTRACTORS[name].links(f.read())
+
+
+def extract_links(content: Content, extractor: str = "regex", threshold: int = LINKS_PROCESS_THRESHOLD) -> list[str]:
+    """Hrefs in content using the named extractor, big pages are handed to the process pool.
+
+    A spooled body must stay open until this returns, the worker reads its temp file.
+    """
+    if extractor not in EXTRACTORS:
+        raise ValueError(f"unknown link extractor {extractor}, expected one of {list(EXTRACTORS)}")
+    big = bool(threshold) and len(content) >= threshold
+    if isinstance(content, Body):
+        if big and (path := content.path):
+            # only the path crosses the process boundary, the worker streams the file
+            return get_pool().submit(_extract_file, extractor, path).result()
+        if extractor == "regex":
+            return EXTRACTORS["regex"].links(content.chunks())
+        content = content.read()
+    if big:
+        return get_pool().submit(_extract, extractor, content).result()
+    return _extract(extractor, content)
@@ -0,0 +1,114 @@
+"""process-wide anthropic client used by every llm call"""
+
+import os
+import time
+import logging
+from threading import Lock
+
+import anthropic
+import httpx
+from anthropic import Anthropic
+
+from audgit import metrics, usage
+from audgit.ratelimit import TokenBucket, retry_call
+
+log = logging.getLogger("audgit")
+
+# connection pool and timeouts shared by all calls, retries are done here rather than in the sdk
+LLM_MAX_CONNECTIONS = int(os.environ.get("AUDGIT_LLM_MAX_CONNECTIONS", "64"))
+LLM_CONNECT_TIMEOUT = float(os.environ.get("AUDGIT_LLM_CONNECT_TIMEOUT", "10"))
+LLM_TIMEOUT = float(os.environ.get("AUDGIT_LLM_TIMEOUT", "600"))
+LLM_RETRIES = int(os.environ.get("AUDGIT_LLM_RETRIES", "5"))
+
+DEFAULT_MODEL = "claude-2"
+DEFAULT_MAX_TOKENS = 3000
+
+_client: Anthropic | None = None
+_client_lock = Lock()
+
+
+def get_client() -> Anthropic:
+    """The shared client, created on first use. httpx clients are thread-safe, so one is enough."""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = Anthropic(
+                    base_url=os.environ.get("ANTHROPIC_BASE_URL") or None,
+                    timeout=httpx.Timeout(LLM_TIMEOUT, connect=LLM_CONNECT_TIMEOUT),
+                    max_retries=0,
+                    connection_pool_limits=httpx.Limits(
+                        max_connections=LLM_MAX_CONNECTIONS,
+                        max_keepalive_connections=LLM_MAX_CONNECTIONS,
+                        keepalive_expiry=60,
+                    ),
+                )
+    return _client
+
+
+def is_retryable(ex: BaseException) -> bool:
+    if isinstance(ex, (anthropic.APIConnectionError, anthropic.RateLimitError, anthropic.InternalServerError)):
+        return True
+    status = getattr(ex, "status_code", None)
+    return status is not None and (status == 429 or status >= 500)
+
+
+def complete(prompt: str, model: str = DEFAULT_MODEL, max_tokens: int = DEFAULT_MAX_TOKENS,
+             bucket: TokenBucket | None = None, purpose: str = "complete") -> str:
+    """Blocking completion, retried on rate limits, overload and connection errors.
+
+    Tokens and latency (retries and rate limit waits included) are accounted under purpose, see usage.py.
+    """
+    def call():
+        if bucket:
+            with metrics.span("llm.ratelimit", model=model):
+                bucket.acquire()
+        return get_client().completions.create(model=model, max_tokens_to_sample=max_tokens, prompt=prompt)
+
+    start = time.monotonic()
+    completion = ""
+    try:
+        with metrics.span("llm.complete", model=model):
+            completion = retry_call(call, is_retryable=is_retryable, retries=LLM_RETRIES).completion
+        return completion
+    finally:
+        usage.record(purpose, model, prompt, completion, time.monotonic() - start, ok=bool(completion))
+
+
+def stream(prompt: str, model: str = DEFAULT_MODEL, max_tokens: int = DEFAULT_MAX_TOKENS, purpose: str = "stream"):
+    """Yield completion text as it arrives. Only opening the stream is retried, never a partial answer.
+
+    Accounted like complete once the stream ends or is closed, with what was received so far.
+    """
+    def call():
+        return get_client().completions.create(
+            model=model, max_tokens_to_sample=max_tokens, prompt=prompt, stream=True
+        )
+
+    # time to first token and the whole stream, the consumer's time between tokens included
+    start = time.monotonic()
+    first = True
+    received: list[str] = []
+    finished = False
+    try:
+        with metrics.span("llm.stream", model=model):
+            for completion in retry_call(call, is_retryable=is_retryable, retries=LLM_RETRIES):
+                if completion.completion:
+                    if first:
+                        metrics.registry.observe("audgit_span_seconds", time.monotonic() - start,
+                                                 span="llm.first_token", model=model)
+                        first = False
+                    received.append(completion.completion)
+                    yield completion.completion
+        finished = True
+    finally:
+        usage.record(purpose, model, prompt, "".join(received), time.monotonic() - start, ok=finished)
+
+
+def count_tokens(text: str) -> int:
+    return get_client().count_tokens(text)
+
+
+def count_tokens_batch(texts: list[str]) -> list[int]:
+    """Token count of each text, in one tokenizer pass."""
+    return [len(encoding.ids) for encoding in get_client().get_tokenizer().encode_batch(texts)]
@@ -1,6 +1,8 @@
 import argparse
 import logging
+import time
 
+from audgit import metrics, usage
 from audgit.code_review import code_review
 from audgit.monitor import Monitor
 
@@ -14,7 +16,14 @@ def parse_args():
     )
     parser.add_argument("--list", action="store_true", help="Show job list")
     parser.add_argument("--start", action="store_true", help="Start processing jobs")
+    parser.add_argument("--aio", action="store_true", help="Use the asyncio relay loop for --start/--one")
     parser.add_argument("--review", help="Review a single github issue")
+    parser.add_argument(
+        "--usage", nargs="?", const="repo", choices=usage.GROUPS,
+        help="Report llm tokens, latency and cost, grouped by repo (default), job, handler, model or call",
+    )
+    parser.add_argument("--since", type=float, help="Only report usage of the last N hours")
+    parser.add_argument("--top", type=int, help="Only report the N most expensive rows")
 
     return parser.parse_args()
 
@@ -36,16 +45,30 @@ def main():
     if args.debug:
         log.setLevel(logging.DEBUG)
 
+    if args.usage:
+        since = time.time() - args.since * 3600 if args.since else None
+        print(usage.report(args.usage, since=since, limit=args.top))
+        return
+
+    # AUDGIT_METRICS_PORT / AUDGIT_METRICS_DUMP
+    metrics.start_exporters()
+
     mon = Monitor(debug=args.debug)
 
     mon.add_handler("code-review", code_review)
 
     if args.start:
-        mon.start()
+        if args.aio:
+            mon.start_async()
+        else:
+            mon.start()
     if args.list:
         mon.list()
     if args.one:
-        mon.one()
+        if args.aio:
+            mon.start_async(once=True)
+        else:
+            mon.one()
     if args.review:
         mon.cli_review(args.review)
 
@@ -0,0 +1,254 @@
+"""in-process counters, gauges, latency histograms and spans, served as prometheus text or dumped as json"""
+
+import bisect
+import json
+import math
+import os
+import threading
+import time
+import logging
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable
+
+log = logging.getLogger("audgit")
+
+# serve /metrics (prometheus text) and /metrics.json on this port when set
+METRICS_PORT = os.environ.get("AUDGIT_METRICS_PORT")
+# or write the json snapshot to this file every AUDGIT_METRICS_DUMP_INTERVAL seconds
+METRICS_DUMP = os.environ.get("AUDGIT_METRICS_DUMP")
+METRICS_DUMP_INTERVAL = float(os.environ.get("AUDGIT_METRICS_DUMP_INTERVAL", "60"))
+
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, math.inf)
+
+Labels = tuple[tuple[str, str], ...]
+
+
+def _labels(labels: dict) -> Labels:
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _fmt(labels: Labels, extra: tuple[tuple[str, str], ...] = ()) -> str:
+    pairs = labels + extra
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in pairs) + "}"
+
+
+def _num(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class Histogram:
+    def __init__(self, buckets: tuple[float, ...] = BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q: float) -> float:
+        """Upper bound of the bucket holding the q-th observation."""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return self.buckets[-1]
+
+
+class Registry:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters: dict[tuple[str, Labels], float] = {}
+        self.gauges: dict[tuple[str, Labels], float | Callable[[], float]] = {}
+        self.histograms: dict[tuple[str, Labels], Histogram] = {}
+        self.help: dict[str, str] = {}
+
+    def describe(self, name: str, text: str):
+        self.help[name] = text
+
+    def inc(self, name: str, value: float = 1, **labels):
+        key = (name, _labels(labels))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def set_gauge(self, name: str, value: float | Callable[[], float], **labels):
+        """A value, or a function read at export time."""
+        with self.lock:
+            self.gauges[(name, _labels(labels))] = value
+
+    def observe(self, name: str, value: float, **labels):
+        key = (name, _labels(labels))
+        with self.lock:
+            hist = self.histograms.get(key)
+            if hist is None:
+                hist = self.histograms[key] = Histogram()
+            hist.observe(value)
+
+    def clear(self):
+        with self.lock:
+            self.counters.clear()
+            self.gauges.clear()
+            self.histograms.clear()
+
+    def _gauge_values(self) -> dict[tuple[str, Labels], float]:
+        with self.lock:
+            gauges = dict(self.gauges)
+        values = {}
+        for key, value in gauges.items():
+            try:
+                values[key] = float(value() if callable(value) else value)
+            except Exception:
+                log.debug("gauge %s failed", key[0], exc_info=True)
+        return values
+
+    def prometheus(self) -> str:
+        lines: list[str] = []
+        gauges = self._gauge_values()
+        with self.lock:
+            families: dict[str, tuple[str, list]] = {}
+            for (name, labels), value in self.counters.items():
+                families.setdefault(name, ("counter", []))[1].append((labels, value))
+            for (name, labels), value in gauges.items():
+                families.setdefault(name, ("gauge", []))[1].append((labels, value))
+            for (name, labels), hist in self.histograms.items():
+                families.setdefault(name, ("histogram", []))[1].append(
+                    (labels, (list(hist.counts), hist.sum, hist.count, hist.buckets)))
+
+        for name in sorted(families):
+            kind, series = families[name]
+            if name in self.help:
+                lines.append(f"# HELP {name} {self.help[name]}")
+            lines.append(f"# TYPE {name} {kind}")
+            for labels, value in sorted(series, key=lambda s: s[0]):
+                if kind != "histogram":
+                    lines.append(f"{name}{_fmt(labels)} {_num(value)}")
+                    continue
+                counts, total, count, buckets = value
+                cumulative = 0
+                for bound, n in zip(buckets, counts):
+                    cumulative += n
+                    lines.append(f"{name}_bucket{_fmt(labels, (('le', _num(bound)),))} {cumulative}")
+                lines.append(f"{name}_sum{_fmt(labels)} {_num(total)}")
+                lines.append(f"{name}_count{_fmt(labels)} {count}")
+        return "\n".join(lines) + "\n"
+
+    def snapshot(self) -> dict:
+        def series(name, labels):
+            return {"name": name, "labels": dict(labels)}
+
+        gauges = self._gauge_values()
+        with self.lock:
+            return {
+                "time": time.time(),
+                "counters": [{**series(n, labels), "value": v} for (n, labels), v in self.counters.items()],
+                "gauges": [{**series(n, labels), "value": v} for (n, labels), v in gauges.items()],
+                "histograms": [
+                    {
+                        **series(n, labels),
+                        "count": h.count,
+                        "sum": round(h.sum, 6),
+                        "p50": h.quantile(0.5),
+                        "p95": h.quantile(0.95),
+                        "p99": h.quantile(0.99),
+                    }
+                    for (n, labels), h in self.histograms.items()
+                ],
+            }
+
+
+registry = Registry()
+registry.describe("audgit_span_seconds", "Duration of instrumented operations")
+registry.describe("audgit_span_errors_total", "Instrumented operations that raised")
+
+
+@contextmanager
+def span(name: str, **labels):
+    """Time the block into audgit_span_seconds{span=name}, counting it in audgit_span_errors_total if it raises."""
+    start = time.monotonic()
+    try:
+        yield
+    except BaseException:
+        registry.inc("audgit_span_errors_total", span=name, **labels)
+        raise
+    finally:
+        registry.observe("audgit_span_seconds", time.monotonic() - start, span=name, **labels)
+
+
+def timed(name: str, **labels):
+    """Decorator version of span."""
+    def wrap(fn):
+        def inner(*args, **kwargs):
+            with span(name, **labels):
+                return fn(*args, **kwargs)
+        inner.__name__ = fn.__name__
+        inner.__doc__ = fn.__doc__
+        inner.__wrapped__ = fn
+        return inner
+    return wrap
+
+
+class _Handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        path = self.path.split("?", 1)[0]
+        if path == "/metrics":
+            body, ctype = registry.prometheus().encode(), "text/plain; version=0.0.4"
+        elif path == "/metrics.json":
+            body, ctype = json.dumps(registry.snapshot()).encode(), "application/json"
+        else:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", ctype)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def serve(port: int, host: str = "127.0.0.1") -> ThreadingHTTPServer:
+    server = ThreadingHTTPServer((host, port), _Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics", daemon=True).start()
+    log.info("serving metrics on http://%s:%s/metrics", host, server.server_port)
+    return server
+
+
+def dump_every(path: str, interval: float = METRICS_DUMP_INTERVAL) -> threading.Thread:
+    def run():
+        while True:
+            time.sleep(interval)
+            try:
+                with open(path + ".tmp", "w") as f:
+                    json.dump(registry.snapshot(), f)
+                os.replace(path + ".tmp", path)
+            except Exception:
+                log.exception("metrics dump failed")
+
+    thread = threading.Thread(target=run, name="metrics-dump", daemon=True)
+    thread.start()
+    return thread
+
+
+def start_exporters():
+    """Start whatever the environment asks for, AUDGIT_METRICS_PORT and/or AUDGIT_METRICS_DUMP."""
+    if METRICS_PORT:
+        serve(int(METRICS_PORT))
+    if METRICS_DUMP:
+        dump_every(METRICS_DUMP)
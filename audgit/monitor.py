@@ -1,4 +1,8 @@
+import asyncio
+import contextvars
+import inspect
 import os
+import threading
 from concurrent.futures import ThreadPoolExecutor
 from queue import Empty
 from typing import cast, Callable
@@ -12,34 +16,95 @@ import time
 import uuid
 import logging
 
+from audgit import metrics, usage
+from audgit.payments import AwaitPayment, PaymentResult, PaymentWatcher
+from audgit.store import JobStore, DEFAULT_STATE_DB
+
 log = logging.getLogger("audgit")
 
+# after a restart, jobs created this long before the last checkpoint are looked at again
+STATE_SLACK = 60
+
 
 def get_tag(event, param):
     for tag in event.tags:
         if tag[0] == param:
             return tag[1]
+
+
+END = object()
+
+
+def advance(results, value=None):
+    """Next item from a handler, resuming it with value (or raising value in it) if given. END when finished."""
+    try:
+        if isinstance(value, BaseException):
+            return results.throw(value)
+        if value is not None:
+            return results.send(value)
+        return next(results)
+    except StopIteration:
+        return END
+
 class Executor:
 
   def __init__(self, max_workers=10):
     self.executor = ThreadPoolExecutor(max_workers=max_workers)
+    self.lock = threading.Lock()
+    # submitted but not started, and running
+    self.queued = 0
+    self.active = 0
 
   def submit(self, fn, *args, **kwargs):
-    return self.executor.submit(fn, *args, **kwargs)
+    with self.lock:
+      self.queued += 1
+    return self.executor.submit(self._run, fn, *args, **kwargs)
+
+  def _run(self, fn, *args, **kwargs):
+    with self.lock:
+      self.queued -= 1
+      self.active += 1
+    try:
+      return fn(*args, **kwargs)
+    finally:
+      with self.lock:
+        self.active -= 1
 
 class Monitor:
-    def __init__(self, debug: bool):
+    def __init__(self, debug: bool, store: JobStore | None = None):
         self.stop = False
         self.debug = debug
         self.handlers: dict[str, Callable] = {}
         self.private_key = PrivateKey.from_hex(os.environ["NOSTR_PRIVKEY"])
         self.since = int(time.time() - 7200)
         self.executor = Executor()
+        self.payments = PaymentWatcher()
+        self.store = store if store is not None else JobStore(os.environ.get("AUDGIT_STATE_DB", DEFAULT_STATE_DB))
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._inbox: asyncio.Queue | None = None
+        # read at export time, so a replaced executor or watcher is picked up
+        metrics.registry.set_gauge("audgit_executor_queue_depth", lambda: self.executor.queued)
+        metrics.registry.set_gauge("audgit_executor_active_workers", lambda: self.executor.active)
+        metrics.registry.set_gauge("audgit_payments_pending", lambda: self.payments.pending)
 
     def add_handler(self, name, func):
         self.handlers[name] = func
 
-    def start(self, once=False):
+    def get_done(self) -> set[str]:
+        last_seen = self.store.last_seen()
+        if last_seen is not None:
+            # everything we handled is in the store, so only look back as far as the last checkpoint
+            self.since = min(self.since, last_seen - STATE_SLACK)
+            # jobs the last run claimed but never answered are handled again when the relays deliver them
+            released = self.store.release_claims()
+            if released:
+                log.info("re-queueing %s jobs claimed without a result", len(released))
+                self.since = min([self.since] + [created_at - STATE_SLACK for _, created_at in released if created_at])
+            done = self.store.job_ids()
+            log.info("loaded %s jobs from %s, since: %s", len(done), self.store.path, self.since)
+            return done
+
+        log.info("no job state checkpoint, replaying relays")
         done: set[str] = set()
 
         for event in self.enum(filter=[self.get_reply_filter()]):
@@ -48,6 +113,33 @@ class Monitor:
             if status and ref_event:
                 log.debug("done: %s (%s)", event.id, status)
                 done.add(ref_event)
+                self.store.set_state(ref_event, status)
+
+        # the store now knows everything replayed, later restarts read it instead of the relays
+        self.store.set_last_seen(self.since + STATE_SLACK)
+        return done
+
+    def is_new_job(self, event: Event, done: set[str]) -> bool:
+        name = get_tag(event, "j")
+        if name not in self.handlers:
+            return False
+
+        if event.id in done:
+            return False
+
+        if event.created_at < self.since:
+            return False
+
+        return True
+
+    def claim(self, event: Event, done: set[str]):
+        """Checkpoint a job before it is dispatched, relays deliver the same event once per relay."""
+        done.add(event.id)
+        self.store.set_state(event.id, "started", handler=get_tag(event, "j"), created_at=event.created_at)
+        self.store.set_last_seen(event.created_at)
+
+    def start(self, once=False):
+        done = self.get_done()
 
         relay_manager, _sub_id = self._subscribe(filter=self.get_job_filter())
 
@@ -56,16 +148,11 @@ class Monitor:
             try:
                 while event_msg := relay_manager.message_pool.events.get(timeout=5):
                     event: Event = cast(Event, event_msg.event)
-                    name = get_tag(event, "j")
-                    if name not in self.handlers:
-                        continue
-
-                    if event.id in done:
-                        continue
-
-                    if event.created_at < self.since:
+                    if not self.is_new_job(event, done):
                         continue
 
+                    self.claim(event, done)
+                    metrics.registry.inc("audgit_jobs_total", handler=get_tag(event, "j"))
                     self.executor.submit(self.handle_event, event, relay_manager)
 
                     if once:
@@ -80,23 +167,183 @@ class Monitor:
 
         relay_manager.close_all_relay_connections()
 
-    def handle_event(self, event, relay_manager):
+    def handle_event(self, event, relay_manager, results=None, value: PaymentResult | None = None,
+                     ctx: contextvars.Context | None = None):
         name = get_tag(event, "j")
+        # every step of the job runs in the job's context, so its llm calls are accounted to it
+        if ctx is None:
+            ctx = usage.job_context(job=event.id, handler=name)
         try:
-            result: Event
-            for result in self.handlers[name](event):
-                result.kind = 65001
-                result.public_key = self.private_key.public_key.hex()
-                self.private_key.sign_event(result)
-                if result:
-                    log.info("publishing result {%s}, for event: %s", result.tags, event.id)
-                    relay_manager.publish_event(result)
+            if results is None:
+                results = iter(ctx.run(self.handlers[name], event))
+            while (result := ctx.run(advance, results, value)) is not END:
+                value = None
+                if isinstance(result, AwaitPayment):
+                    # park the job, the watcher resubmits it once the invoice settles or times out
+                    self.payments.watch(
+                        result.verify_url,
+                        lambda paid: self.executor.submit(self.handle_event, event, relay_manager, results, paid, ctx),
+                        result.timeout,
+                    )
+                    return
+                self.publish_result(result, event, relay_manager)
         except Exception as ex:
             log.exception("Exception in handler")
-            result = Event(kind=65001, content=f"Exception: {repr(ex)}", tags=[["e", event.id], ["status", "failure"]])
-            result.pubkey = self.private_key.public_key.hex(),
-            self.private_key.sign_event(result)
+            self.publish_failure(ex, event, relay_manager)
+
+    def publish_result(self, result: Event, event: Event, relay_manager):
+        result.kind = 65001
+        result.public_key = self.private_key.public_key.hex()
+        self.private_key.sign_event(result)
+        if result:
+            log.info("publishing result {%s}, for event: %s", result.tags, event.id)
             relay_manager.publish_event(result)
+            status = get_tag(result, "status") or "processing"
+            self.store.set_state(event.id, status)
+            metrics.registry.inc("audgit_results_total", handler=get_tag(event, "j"), status=status)
+
+    def publish_failure(self, ex: BaseException, event: Event, relay_manager):
+        result = Event(kind=65001, content=f"Exception: {repr(ex)}", tags=[["e", event.id], ["status", "failure"]])
+        result.public_key = self.private_key.public_key.hex()
+        self.private_key.sign_event(result)
+        relay_manager.publish_event(result)
+        self.store.set_state(event.id, "failure")
+        metrics.registry.inc("audgit_results_total", handler=get_tag(event, "j"), status="failure")
+
+    def start_async(self, once=False):
+        try:
+            asyncio.run(self.run(once=once))
+        except KeyboardInterrupt:
+            log.info("monitor interrupted")
+
+    async def run(self, once=False, idle_timeout=5):
+        """Asyncio relay loop: jobs are dispatched as tasks as soon as a relay delivers them.
+
+        Sync generator handlers have each step run on the executor, async generator handlers run on the loop.
+        Cancelling run() cancels all in-flight jobs and closes the relay connections.
+        """
+        loop = asyncio.get_running_loop()
+        done = await loop.run_in_executor(None, self.get_done)
+
+        relay_manager, _sub_id = self._subscribe(filter=self.get_job_filter())
+
+        inbox: asyncio.Queue = asyncio.Queue()
+        self._inbox = inbox
+        self._loop = loop
+        pump = threading.Thread(target=self._pump, args=(relay_manager, loop, inbox), daemon=True)
+        pump.start()
+
+        jobs: set[asyncio.Task] = set()
+        try:
+            while not self.stop:
+                try:
+                    if once:
+                        event_msg = await asyncio.wait_for(inbox.get(), timeout=idle_timeout)
+                    else:
+                        event_msg = await inbox.get()
+                except asyncio.TimeoutError:
+                    log.info("no events for --once flag")
+                    break
+
+                if event_msg is None:
+                    break
+
+                event: Event = cast(Event, event_msg.event)
+                if not self.is_new_job(event, done):
+                    continue
+
+                self.claim(event, done)
+                metrics.registry.inc("audgit_jobs_total", handler=get_tag(event, "j"))
+                job = asyncio.create_task(self.handle_event_async(event, relay_manager), name=event.id)
+                jobs.add(job)
+                job.add_done_callback(jobs.discard)
+
+                if once:
+                    break
+
+            if jobs:
+                await asyncio.gather(*jobs)
+        finally:
+            for job in jobs:
+                job.cancel()
+            if jobs:
+                await asyncio.gather(*jobs, return_exceptions=True)
+            # unblock the pump thread, it is parked on the message pool
+            relay_manager.message_pool.events.put(None)
+            relay_manager.close_all_relay_connections()
+            self._loop = None
+
+    def shutdown(self):
+        """Stop the relay loop, safe to call from any thread."""
+        self.stop = True
+        loop, inbox = self._loop, self._inbox
+        if loop is not None and inbox is not None:
+            loop.call_soon_threadsafe(inbox.put_nowait, None)
+
+    def _pump(self, relay_manager, loop: asyncio.AbstractEventLoop, inbox: asyncio.Queue):
+        # relay messages land on a thread-safe queue fed by the websocket threads, hand them to the loop as they arrive
+        while not self.stop:
+            try:
+                event_msg = relay_manager.message_pool.events.get()
+            except Exception as ex:
+                log.debug("relay message pump stopped: %s", ex)
+                event_msg = None
+            try:
+                loop.call_soon_threadsafe(inbox.put_nowait, event_msg)
+            except RuntimeError:
+                # loop is closed
+                return
+            if event_msg is None:
+                return
+
+    async def handle_event_async(self, event, relay_manager):
+        name = get_tag(event, "j")
+        handler = self.handlers[name]
+        value: PaymentResult | None = None
+        # the task has its own copy of the context, sync steps run in one made from it
+        usage.tag(job=event.id, handler=name)
+        ctx = contextvars.copy_context()
+        try:
+            if inspect.isasyncgenfunction(handler):
+                agen = handler(event)
+                while True:
+                    try:
+                        if isinstance(value, BaseException):
+                            result = await agen.athrow(value)
+                        else:
+                            result = await agen.asend(value)
+                    except StopAsyncIteration:
+                        return
+                    value = None
+                    if isinstance(result, AwaitPayment):
+                        value = await self.await_payment(result)
+                        continue
+                    self.publish_result(result, event, relay_manager)
+
+            # through the executor wrapper, not its pool, so the steps show in its gauges
+            results = iter(await asyncio.wrap_future(self.executor.submit(ctx.run, handler, event)))
+            while (result := await asyncio.wrap_future(self.executor.submit(ctx.run, advance, results, value))) is not END:
+                value = None
+                if isinstance(result, AwaitPayment):
+                    value = await self.await_payment(result)
+                    continue
+                self.publish_result(result, event, relay_manager)
+        except asyncio.CancelledError:
+            log.info("cancelled job: %s", event.id)
+            raise
+        except Exception as ex:
+            log.exception("Exception in handler")
+            self.publish_failure(ex, event, relay_manager)
+
+    async def await_payment(self, request: AwaitPayment) -> PaymentResult:
+        loop = asyncio.get_running_loop()
+        paid: asyncio.Future = loop.create_future()
+
+        def settle(res: PaymentResult):
+            loop.call_soon_threadsafe(lambda: paid.done() or paid.set_result(res))
+
+        self.payments.watch(request.verify_url, settle, request.timeout)
+        return await paid
 
     def _subscribe(self, filter: Filter | list[Filter]):
         relay_manager = RelayManager()
@@ -129,7 +376,17 @@ class Monitor:
         name = "code-review"
         event = Event(content=issue, tags=[["j", "code-review"]])
         event.evade_payment = True
-        for result in self.handlers[name](event):
+        ctx = usage.job_context(job=event.id, handler=name)
+        results = iter(ctx.run(self.handlers[name], event))
+        value = None
+        while (result := ctx.run(advance, results, value)) is not END:
+            value = None
+            if isinstance(result, AwaitPayment):
+                try:
+                    value = self.payments.wait(result.verify_url, result.timeout)
+                except Exception as ex:
+                    value = ex
+                continue
             print(result)
 
     def enum(self, filter):
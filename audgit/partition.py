@@ -0,0 +1,194 @@
+"""pack files into as few prompt-sized chunks as possible"""
+
+import hashlib
+import os
+import re
+import logging
+from collections import OrderedDict, defaultdict
+from dataclasses import dataclass
+from threading import Lock
+
+from audgit import llm
+
+log = logging.getLogger("audgit")
+
+# token budget for the code in a single map call
+MAX_CHUNK_TOKENS = 90000
+
+# <FileName></FileName><FileContents></FileContents> wrapper around every file
+FILE_OVERHEAD_TOKENS = 16
+
+# top level definitions in the languages we review, used as split points for oversized files
+BOUNDARY = re.compile(
+    r"^(?:@|async\s+def\b|def\b|class\b|function\b|export\b|func\b|fn\b|pub\b|impl\b|struct\b|interface\b|type\b|"
+    r"contract\b|library\b|public\b|private\b|protected\b|static\b|const\b|module\b)"
+)
+
+# line ends as python and git count them, str.splitlines also breaks on form feeds and unicode separators
+LINE_END = re.compile(r"(?<=\n)|(?<=\r)(?!\n)")
+
+_counts: OrderedDict[str, int] = OrderedDict()
+_counts_lock = Lock()
+MAX_CACHED_COUNTS = 100000
+
+
+@dataclass
+class Piece:
+    name: str
+    content: str
+    tokens: int
+
+    @property
+    def directory(self):
+        return os.path.dirname(self.name.rsplit(":", 1)[0])
+
+
+def split_lines(text: str) -> list[str]:
+    """Lines of text with their ends, split on \\n, \\r\\n and \\r only, so line numbers match ast's."""
+    lines = LINE_END.split(text)
+    if not lines[-1]:
+        lines.pop()
+    return lines
+
+
+def count_tokens(text: str) -> int:
+    """Claude token count of text, cached by content hash."""
+    key = hashlib.sha1(text.encode(errors="surrogatepass")).hexdigest()
+    with _counts_lock:
+        if key in _counts:
+            _counts.move_to_end(key)
+            return _counts[key]
+
+    count = llm.count_tokens(text)
+
+    with _counts_lock:
+        _counts[key] = count
+        if len(_counts) > MAX_CACHED_COUNTS:
+            _counts.popitem(last=False)
+    return count
+
+
+def count_line_tokens(lines: list[str]) -> list[int]:
+    """Token count of every line, in one pass. The tokenizer doesn't merge across newlines, so in practice
+    a line counted alone is never lower than inside a range, and running totals bound the range from above."""
+    return llm.count_tokens_batch(lines)
+
+
+def split_source(name: str, content: str, budget: int) -> list[Piece]:
+    """Split a file into line ranges under budget, cutting at top level definitions where possible."""
+    lines = split_lines(content)
+
+    # segments start at a top level definition, comments and decorators directly above it stay attached
+    starts = [0]
+    for i, line in enumerate(lines):
+        if i and BOUNDARY.match(line) and not BOUNDARY.match(lines[i - 1]):
+            start = i
+            while start > starts[-1] + 1 and lines[start - 1].lstrip().startswith(("#", "//", "/*", "*")):
+                start -= 1
+            if start > starts[-1]:
+                starts.append(start)
+    starts.append(len(lines))
+
+    segments: list[tuple[int, int]] = []
+    line_tokens: list[int] | None = None
+    for begin, end in zip(starts, starts[1:]):
+        if count_tokens("".join(lines[begin:end])) <= budget:
+            segments.append((begin, end))
+            continue
+        # a single definition over budget, fall back to cutting by lines on a running total,
+        # every line is tokenized once rather than every candidate range
+        if line_tokens is None:
+            line_tokens = count_line_tokens(lines)
+        cur = begin
+        while cur < end:
+            stop, total = cur + 1, line_tokens[cur]
+            while stop < end and total + line_tokens[stop] <= budget:
+                total += line_tokens[stop]
+                stop += 1
+            segments.append((cur, stop))
+            cur = stop
+
+    pieces: list[Piece] = []
+    begin = end = 0
+    tokens = 0
+    for seg_begin, seg_end in segments:
+        seg_tokens = count_tokens("".join(lines[seg_begin:seg_end]))
+        if end > begin and tokens + seg_tokens > budget:
+            pieces.append(_piece(name, lines, begin, end, tokens))
+            begin, tokens = seg_begin, 0
+        end = seg_end
+        tokens += seg_tokens
+    if end > begin:
+        pieces.append(_piece(name, lines, begin, end, tokens))
+    return pieces
+
+
+def _piece(name, lines, begin, end, tokens):
+    return Piece(name=f"{name}:{begin + 1}-{end}", content="".join(lines[begin:end]), tokens=tokens)
+
+
+def read_files(file_paths) -> dict[str, str]:
+    contents = {}
+    for fil in file_paths:
+        try:
+            with open(fil) as fi:
+                contents[fil] = fi.read()
+        except (FileNotFoundError, IsADirectoryError):
+            log.error("missing file %s", fil)
+        except UnicodeDecodeError:
+            log.error("not a text file %s", fil)
+    return contents
+
+
+def read_pieces(file_paths, budget: int = MAX_CHUNK_TOKENS, transform=None) -> list[Piece]:
+    """Files as pieces that fit in budget. transform can rewrite the {path: content} map first, e.g. to slice it."""
+    contents = read_files(file_paths)
+    if transform:
+        contents = transform(contents)
+    pieces = []
+    for fil, content in contents.items():
+        tokens = count_tokens(content) + count_tokens(fil) + FILE_OVERHEAD_TOKENS
+        if tokens <= budget:
+            pieces.append(Piece(name=fil, content=content, tokens=tokens))
+            continue
+        log.debug("splitting %s, %s tokens", fil, tokens)
+        for piece in split_source(fil, content, budget - count_tokens(fil) - FILE_OVERHEAD_TOKENS - 8):
+            piece.tokens += count_tokens(piece.name) + FILE_OVERHEAD_TOKENS
+            pieces.append(piece)
+    return pieces
+
+
+def pack(pieces: list[Piece], budget: int = MAX_CHUNK_TOKENS) -> list[list[Piece]]:
+    """First-fit-decreasing bin packing, files from the same directory share a bin when they fit in one."""
+    groups: dict[str, list[Piece]] = defaultdict(list)
+    for piece in pieces:
+        groups[piece.directory].append(piece)
+
+    items: list[list[Piece]] = []
+    for group in groups.values():
+        if sum(p.tokens for p in group) <= budget:
+            items.append(group)
+        else:
+            items.extend([p] for p in group)
+
+    items.sort(key=lambda item: sum(p.tokens for p in item), reverse=True)
+
+    bins: list[list[Piece]] = []
+    room: list[int] = []
+    for item in items:
+        size = sum(p.tokens for p in item)
+        for i, free in enumerate(room):
+            if size <= free:
+                bins[i].extend(item)
+                room[i] -= size
+                break
+        else:
+            bins.append(list(item))
+            room.append(budget - size)
+    return bins
+
+
+def partition(file_paths, budget: int = MAX_CHUNK_TOKENS, transform=None):
+    """Yield {name: content} chunks that each fit in budget tokens."""
+    for chunk in pack(read_pieces(file_paths, budget, transform), budget):
+        yield {p.name: p.content for p in chunk}
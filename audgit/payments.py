@@ -0,0 +1,140 @@
+"""one watcher for every outstanding invoice, so jobs waiting on payment don't hold a worker thread"""
+
+import time
+import threading
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Callable
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from audgit import metrics
+
+log = logging.getLogger("audgit")
+
+PAYMENT_POLL_INTERVAL = 3
+PAYMENT_TIMEOUT = 300
+
+# paid: True, timed out: False, verification failed: the exception
+PaymentResult = bool | Exception
+
+
+@dataclass
+class AwaitPayment:
+    """Yielded by a handler to park the job until the invoice settles.
+
+    The monitor resumes the handler by sending True when paid or False on timeout, verification errors are
+    thrown into it.
+    """
+    verify_url: str
+    timeout: float = PAYMENT_TIMEOUT
+
+
+@dataclass
+class _Waiter:
+    verify_url: str
+    deadline: float
+    callback: Callable[[PaymentResult], None]
+
+
+class PaymentWatcher:
+    def __init__(self, interval: float = PAYMENT_POLL_INTERVAL, max_workers: int = 8):
+        self.interval = interval
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=max_workers, pool_maxsize=max_workers)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="payments")
+        self.waiters: list[_Waiter] = []
+        self.lock = threading.Lock()
+        self.wake = threading.Event()
+        self.thread: threading.Thread | None = None
+        self.stop = False
+
+    def watch(self, verify_url: str, callback: Callable[[PaymentResult], None], timeout: float = PAYMENT_TIMEOUT):
+        """Call callback once, from the watcher thread, when the invoice settles, fails or times out."""
+        with self.lock:
+            self.waiters.append(_Waiter(verify_url, time.monotonic() + timeout, callback))
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, name="payment-watcher", daemon=True)
+                self.thread.start()
+        self.wake.set()
+
+    def wait(self, verify_url: str, timeout: float = PAYMENT_TIMEOUT) -> bool:
+        """Blocking version of watch, for callers outside the monitor."""
+        done = threading.Event()
+        res: list[PaymentResult] = []
+        self.watch(verify_url, lambda paid: (res.append(paid), done.set()), timeout)
+        done.wait()
+        if isinstance(res[0], Exception):
+            raise res[0]
+        return res[0]
+
+    @property
+    def pending(self) -> int:
+        with self.lock:
+            return len(self.waiters)
+
+    def check(self, verify_url: str) -> PaymentResult:
+        try:
+            with metrics.span("http.payment_check"):
+                res = self.session.get(verify_url, timeout=10)
+        except requests.exceptions.RequestException as ex:
+            # network trouble, try again next round
+            log.debug("payment check failed for %s: %s", verify_url, ex)
+            return False
+        if res.status_code != 200:
+            return Exception(f"Error: payment verification failure  {res.status_code}")
+        try:
+            return bool(res.json()["settled"])
+        except (ValueError, KeyError, TypeError) as ex:
+            # e.g. an lnurl {"status": "ERROR"} reply, or not json at all
+            return Exception(f"Error: payment verification failure  {ex!r}")
+
+    def _check(self, verify_url: str) -> PaymentResult:
+        """check that never raises, one bad verify url mustn't stop the others from being resolved"""
+        try:
+            return self.check(verify_url)
+        except Exception:
+            log.exception("payment check failed for %s", verify_url)
+            return False
+
+    def poll(self):
+        with self.lock:
+            urls = list({w.verify_url for w in self.waiters})
+        if not urls:
+            return
+
+        results = dict(zip(urls, self.pool.map(self._check, urls)))
+
+        now = time.monotonic()
+        finished: list[tuple[_Waiter, PaymentResult]] = []
+        with self.lock:
+            keep = []
+            for waiter in self.waiters:
+                res = results.get(waiter.verify_url, False)
+                if res is not False:
+                    finished.append((waiter, res))
+                elif now >= waiter.deadline:
+                    finished.append((waiter, False))
+                else:
+                    keep.append(waiter)
+            self.waiters = keep
+
+        for waiter, res in finished:
+            log.debug("payment %s: %s", waiter.verify_url, res)
+            try:
+                waiter.callback(res)
+            except Exception:
+                log.exception("payment callback failed")
+
+    def run(self):
+        while not self.stop:
+            try:
+                self.poll()
+            except Exception:
+                log.exception("payment watcher poll failed")
+            self.wake.wait(self.interval)
+            self.wake.clear()
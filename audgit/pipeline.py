@@ -0,0 +1,133 @@
+"""run job stages as a dependency graph, independent stages in parallel"""
+
+import contextvars
+import time
+import threading
+import logging
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Any, Callable
+
+from audgit import metrics
+
+log = logging.getLogger("audgit")
+
+# stages never wait on each other inside a worker, so one pool can serve every running job
+stage_executor = ThreadPoolExecutor(max_workers=32, thread_name_prefix="stage")
+
+
+@dataclass
+class Stage:
+    name: str
+    fn: Callable[..., Any]
+    deps: tuple[str, ...]
+    future: Future = field(default_factory=Future)
+    started: float | None = None
+    finished: float | None = None
+    # set under the pipeline lock by whoever submits or fails the stage, so that happens once
+    claimed: bool = False
+
+
+class Pipeline:
+    """Stages start as soon as all their dependencies have results, and get those results as arguments.
+
+    A failed stage fails everything downstream of it with the same exception.
+    """
+
+    def __init__(self, name: str = "", executor: ThreadPoolExecutor = stage_executor):
+        self.name = name
+        self.executor = executor
+        self.stages: dict[str, Stage] = {}
+        self.lock = threading.Lock()
+        self.created = time.monotonic()
+        self.started = False
+        # stages run in the context the pipeline was made in, so they see the job's context variables
+        self.context = contextvars.copy_context()
+
+    def stage(self, name: str, fn: Callable[..., Any], deps: tuple[str, ...] | list[str] = ()) -> "Pipeline":
+        if self.started:
+            raise RuntimeError("can't add stages to a running pipeline")
+        if name in self.stages:
+            raise ValueError(f"duplicate stage {name}")
+        missing = [dep for dep in deps if dep not in self.stages]
+        if missing:
+            raise ValueError(f"stage {name} depends on unknown stages {missing}")
+        self.stages[name] = Stage(name, fn, tuple(deps))
+        return self
+
+    def start(self) -> "Pipeline":
+        self.started = True
+        for stage in self.stages.values():
+            if not stage.deps:
+                self._submit(stage)
+            else:
+                for dep in stage.deps:
+                    self.stages[dep].future.add_done_callback(lambda _f, stage=stage: self._ready(stage))
+        return self
+
+    def _ready(self, stage: Stage):
+        deps = [self.stages[dep].future for dep in stage.deps]
+        if not all(f.done() for f in deps):
+            return
+        if not self._claim(stage):
+            return
+        failed = next((f for f in deps if f.cancelled() or f.exception() is not None), None)
+        if failed is not None:
+            stage.future.set_exception(failed.exception() if not failed.cancelled() else RuntimeError("cancelled"))
+            return
+        stage.started = time.monotonic()
+        self.executor.submit(self.context.copy().run, self._run, stage, [f.result() for f in deps])
+
+    def _submit(self, stage: Stage):
+        if not self._claim(stage):
+            return
+        stage.started = time.monotonic()
+        self.executor.submit(self.context.copy().run, self._run, stage, [])
+
+    def _claim(self, stage: Stage) -> bool:
+        """True for the one caller that gets to run or fail the stage.
+
+        Futures are completed outside the lock, their callbacks start downstream stages and need it.
+        """
+        with self.lock:
+            if stage.claimed:
+                return False
+            stage.claimed = True
+            return True
+
+    def _run(self, stage: Stage, args: list):
+        if stage.future.done():
+            return
+        try:
+            res = stage.fn(*args)
+        except BaseException as ex:
+            stage.finished = time.monotonic()
+            log.debug("%s: stage %s failed after %.2fs", self.name, stage.name, stage.finished - stage.started)
+            metrics.registry.inc("audgit_stage_errors_total", stage=stage.name)
+            metrics.registry.observe("audgit_stage_seconds", stage.finished - stage.started, stage=stage.name)
+            stage.future.set_exception(ex)
+            return
+        stage.finished = time.monotonic()
+        log.debug("%s: stage %s took %.2fs", self.name, stage.name, stage.finished - stage.started)
+        metrics.registry.observe("audgit_stage_seconds", stage.finished - stage.started, stage=stage.name)
+        stage.future.set_result(res)
+
+    def result(self, name: str, timeout: float | None = None):
+        return self.stages[name].future.result(timeout)
+
+    def cancel(self):
+        """Fail every stage that hasn't started, running ones finish in the background."""
+        for stage in self.stages.values():
+            if self._claim(stage):
+                stage.future.set_exception(RuntimeError("cancelled"))
+
+    @property
+    def timings(self) -> dict[str, dict[str, float]]:
+        """Per finished stage: start offset from pipeline creation and duration, in seconds."""
+        return {
+            stage.name: {
+                "start": round(stage.started - self.created, 3),
+                "duration": round(stage.finished - stage.started, 3),
+            }
+            for stage in self.stages.values() if stage.started is not None and stage.finished is not None
+        }
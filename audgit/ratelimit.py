@@ -0,0 +1,69 @@
+"""rate limiting and retry helpers for outbound api calls"""
+
+import random
+import threading
+import time
+import logging
+from typing import Callable, TypeVar
+
+log = logging.getLogger("audgit")
+
+T = TypeVar("T")
+
+
+class TokenBucket:
+    """Thread-safe token bucket, refills `rate` tokens per second up to `capacity`."""
+
+    def __init__(self, rate: float, capacity: float | None = None):
+        if rate <= 0:
+            raise ValueError("rate must be positive")
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(1.0, rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def try_acquire(self, tokens: float = 1.0) -> float:
+        """Take tokens if available and return 0, otherwise return the seconds to wait."""
+        with self.lock:
+            self._refill()
+            if self.tokens >= tokens:
+                self.tokens -= tokens
+                return 0.0
+            return (tokens - self.tokens) / self.rate
+
+    def acquire(self, tokens: float = 1.0):
+        while wait := self.try_acquire(tokens):
+            time.sleep(wait)
+
+
+def retry_after(ex: BaseException) -> float | None:
+    response = getattr(ex, "response", None)
+    headers = getattr(response, "headers", None) or {}
+    try:
+        return float(headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+
+def retry_call(fn: Callable[..., T], *args, is_retryable: Callable[[BaseException], bool], retries: int = 5,
+               base_delay: float = 1.0, max_delay: float = 30.0, **kwargs) -> T:
+    """Call fn, retrying with exponential backoff and jitter while is_retryable(exception) holds."""
+    attempt = 0
+    while True:
+        try:
+            return fn(*args, **kwargs)
+        except Exception as ex:
+            if attempt >= retries or not is_retryable(ex):
+                raise
+            delay = retry_after(ex)
+            if delay is None:
+                delay = min(max_delay, base_delay * 2 ** attempt) * (0.5 + random.random() / 2)
+            attempt += 1
+            log.debug("retrying %s in %.1fs (attempt %s): %r", getattr(fn, "__name__", fn), delay, attempt, ex)
+            time.sleep(delay)
@@ -0,0 +1,79 @@
+"""lexical (bm25) index over file paths, descriptions and identifiers, to shortlist files for an issue"""
+
+import math
+import re
+from collections import Counter, defaultdict
+
+WORD = re.compile(r"[A-Za-z_][A-Za-z0-9_]*|[0-9]+")
+CAMEL = re.compile(r"[A-Z]+(?=[A-Z][a-z])|[A-Z]?[a-z]+|[A-Z]+|[0-9]+")
+DEFINITION = re.compile(
+    r"\b(?:def|class|function|func|fn|interface|struct|type|contract|enum|trait|impl)\s+([A-Za-z_][A-Za-z0-9_]*)"
+)
+IMPORT = re.compile(r"^\s*(?:from|import|require|use|#include)\s+[\"'<]?([A-Za-z0-9_./@:-]+)", re.M)
+
+STOPWORDS = frozenset(
+    "a an and are as at be but by for from has have in is it its of on or that the this to was were will with "
+    "not no do does when what which who how can should would could i we you they he she my our your file code".split()
+)
+
+# path words count more than description words, they are what the model has to pick from
+PATH_WEIGHT = 3
+
+
+def tokenize(text: str) -> list[str]:
+    """Lowercased words, with snake_case and camelCase identifiers split into their parts as well."""
+    terms = []
+    for word in WORD.findall(text):
+        parts = [part for chunk in word.split("_") for part in CAMEL.findall(chunk)]
+        low = word.strip("_").lower()
+        if low not in STOPWORDS and len(low) > 1:
+            terms.append(low)
+        if len(parts) > 1:
+            terms.extend(p.lower() for p in parts if len(p) > 1 and p.lower() not in STOPWORDS)
+    return terms
+
+
+def identifiers(code: str) -> list[str]:
+    """Names defined or imported by a source file."""
+    return DEFINITION.findall(code) + IMPORT.findall(code)
+
+
+def path_terms(path: str) -> Counter:
+    terms = Counter()
+    for _ in range(PATH_WEIGHT):
+        terms.update(tokenize(path.replace("/", " ").replace(".", " ")))
+    return terms
+
+
+class BM25Index:
+    def __init__(self, k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self.docs: list[str] = []
+        self.lengths: list[int] = []
+        self.postings: dict[str, list[tuple[int, int]]] = defaultdict(list)
+
+    def add(self, name: str, terms: Counter):
+        doc = len(self.docs)
+        self.docs.append(name)
+        self.lengths.append(sum(terms.values()))
+        for term, tf in terms.items():
+            self.postings[term].append((doc, tf))
+
+    def search(self, query: str, k: int = 50) -> list[tuple[str, float]]:
+        """Top k (name, score), best first. Documents without any query term score 0 and keep insertion order."""
+        n = len(self.docs)
+        if not n:
+            return []
+        avg = sum(self.lengths) / n or 1
+        scores = [0.0] * n
+        for term in set(tokenize(query)):
+            postings = self.postings.get(term)
+            if not postings:
+                continue
+            idf = math.log(1 + (n - len(postings) + 0.5) / (len(postings) + 0.5))
+            for doc, tf in postings:
+                norm = tf + self.k1 * (1 - self.b + self.b * self.lengths[doc] / avg)
+                scores[doc] += idf * tf * (self.k1 + 1) / norm
+        ranked = sorted(range(n), key=lambda doc: -scores[doc])[:k]
+        return [(self.docs[doc], scores[doc]) for doc in ranked]
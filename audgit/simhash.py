@@ -0,0 +1,143 @@
+"""64 bit simhash fingerprints of page text, and an lsh index to find near-duplicates among them"""
+
+import codecs
+import hashlib
+import re
+import threading
+from collections import defaultdict
+from typing import Iterable, Iterator
+
+WORD = re.compile(r"\w+")
+TAG = re.compile(r"<[^>]*>")
+SKIP = re.compile(r"<(script|style)\b.*?</\1\s*>|<!--.*?-->", re.IGNORECASE | re.DOTALL)
+OPENER = re.compile(r"<(?:script|style)\b|<!--", re.IGNORECASE)
+PARTIAL_WORD = re.compile(r"\w+\Z")
+MAX_TAIL = 64 * 1024
+SHINGLE = 3
+# pages with fewer words than this are all alike to a fingerprint, they are never called duplicates
+MIN_WORDS = 16
+
+
+def words(chunks: Iterable[bytes], markup: bool = True) -> Iterator[str]:
+    """Lowercase words of a streamed document, tags, scripts and comments dropped when markup is set."""
+    decoder = codecs.getincrementaldecoder("utf-8")("replace")
+    tail = ""
+    for chunk in chunks:
+        text = tail + decoder.decode(chunk)
+        if markup:
+            text = SKIP.sub(" ", text)
+        # an unfinished tag, block or word waits for the next chunk
+        cut = len(text)
+        if markup:
+            if (lt := text.rfind("<")) > text.rfind(">"):
+                cut = lt
+            if (opened := OPENER.search(text)) and opened.start() < cut:
+                cut = opened.start()
+        if match := PARTIAL_WORD.search(text, 0, cut):
+            cut = match.start()
+        if len(text) - cut > MAX_TAIL:
+            cut = len(text)
+        body, tail = text[:cut], text[cut:]
+        yield from (w.lower() for w in WORD.findall(TAG.sub(" ", body) if markup else body))
+
+    text = tail + decoder.decode(b"", final=True)
+    if markup:
+        text = TAG.sub(" ", SKIP.sub(" ", text))
+    yield from (w.lower() for w in WORD.findall(text))
+
+
+def simhash(features: Iterable[str]) -> tuple[int, int]:
+    """(fingerprint, number of features). Each feature votes on every bit with its own 64 bit hash."""
+    # counting hash bytes per position is 8 updates per feature instead of 64 bit updates
+    tables = [[0] * 256 for _ in range(8)]
+    total = 0
+    for feature in features:
+        digest = hashlib.blake2b(feature.encode(), digest_size=8).digest()
+        for pos, byte in enumerate(digest):
+            tables[pos][byte] += 1
+        total += 1
+
+    fingerprint = 0
+    for pos, table in enumerate(tables):
+        for bit in range(8):
+            ones = sum(count for value, count in enumerate(table) if value >> bit & 1)
+            if ones * 2 > total:
+                fingerprint |= 1 << (pos * 8 + bit)
+    return fingerprint, total
+
+
+def fingerprint(chunks: Iterable[bytes], markup: bool = True) -> int | None:
+    """Simhash over word shingles of a document, None when it is too short to compare."""
+    window: list[str] = []
+    count = 0
+
+    def shingles():
+        nonlocal count
+        for word in words(chunks, markup):
+            count += 1
+            window.append(word)
+            if len(window) > SHINGLE:
+                window.pop(0)
+            if len(window) == SHINGLE:
+                yield " ".join(window)
+
+    value, _total = simhash(shingles())
+    if count < MIN_WORDS:
+        return None
+    return value
+
+
+def distance(a: int, b: int) -> int:
+    return (a ^ b).bit_count()
+
+
+class SimHashIndex:
+    """Fingerprints split in bands, two within max_distance bits share at least one band exactly.
+
+    bands must be larger than max_distance for that to hold.
+    """
+
+    def __init__(self, max_distance: int = 3, bands: int = 4):
+        if bands <= max_distance:
+            raise ValueError("need more bands than max_distance")
+        self.max_distance = max_distance
+        self.bands = bands
+        self.width = 64 // bands
+        self.mask = (1 << self.width) - 1
+        self.buckets: dict[tuple[int, int], list[tuple[int, str]]] = defaultdict(list)
+        self.lock = threading.Lock()
+        self.count = 0
+
+    def keys(self, value: int) -> list[tuple[int, int]]:
+        return [(band, (value >> (band * self.width)) & self.mask) for band in range(self.bands)]
+
+    def find(self, value: int) -> str | None:
+        with self.lock:
+            return self._find(value)
+
+    def _find(self, value: int) -> str | None:
+        for key in self.keys(value):
+            for other, name in self.buckets.get(key, ()):
+                if distance(value, other) <= self.max_distance:
+                    return name
+        return None
+
+    def add(self, value: int, name: str):
+        with self.lock:
+            self._add(value, name)
+
+    def _add(self, value: int, name: str):
+        for key in self.keys(value):
+            self.buckets[key].append((value, name))
+        self.count += 1
+
+    def check_and_add(self, value: int, name: str) -> str | None:
+        """Name of a near-duplicate already in the index, or None after adding value under name."""
+        with self.lock:
+            if (dup := self._find(value)) is not None:
+                return dup
+            self._add(value, name)
+            return None
+
+    def __len__(self) -> int:
+        return self.count
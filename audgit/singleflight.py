@@ -0,0 +1,42 @@
+"""collapse concurrent calls for the same key into one"""
+
+import threading
+import logging
+from concurrent.futures import Future
+from typing import Any, Callable, Hashable
+
+log = logging.getLogger("audgit")
+
+
+class SingleFlight:
+    """The first caller for a key runs fn, callers arriving while it runs wait and get the same result or exception.
+
+    Nothing is cached, a call for the key after the first one finished runs fn again.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.calls: dict[Hashable, Future] = {}
+
+    def do(self, key: Hashable, fn: Callable[..., Any], *args, **kwargs):
+        with self.lock:
+            future = self.calls.get(key)
+            leader = future is None
+            if leader:
+                future = self.calls[key] = Future()
+
+        if not leader:
+            log.debug("waiting on in-flight call for %s", key)
+            return future.result()
+
+        try:
+            res = fn(*args, **kwargs)
+        except BaseException as ex:
+            future.set_exception(ex)
+            raise
+        else:
+            future.set_result(res)
+            return res
+        finally:
+            with self.lock:
+                del self.calls[key]
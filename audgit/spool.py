@@ -0,0 +1,148 @@
+"""page bodies that stay in memory while small and spill to a temp file once they grow"""
+
+import io
+import os
+import tempfile
+import threading
+import weakref
+from typing import BinaryIO, Iterable, Iterator
+
+# bodies bigger than this are kept on disk, not in memory
+DEFAULT_SPOOL_SIZE = int(os.environ.get("AUDGIT_SPOOL_SIZE", 256 * 1024))
+CHUNK_SIZE = 64 * 1024
+
+
+def _remove(file: BinaryIO, path: str):
+    file.close()
+    try:
+        os.unlink(path)
+    except FileNotFoundError:
+        pass
+
+
+class Body:
+    """Write-once spooled body, any number of independent readers once written.
+
+    Once on disk it is a named temp file, so another process can read it by path.
+    """
+
+    def __init__(self, spool_size: int = DEFAULT_SPOOL_SIZE):
+        self.spool_size = spool_size
+        self.file: BinaryIO = io.BytesIO()
+        self._path: str | None = None
+        self._cleanup: weakref.finalize | None = None
+        self.size = 0
+        self.lock = threading.Lock()
+
+    def write(self, data: bytes):
+        with self.lock:
+            if self._path is None and self.size + len(data) > self.spool_size:
+                self._rollover()
+            self.file.seek(0, io.SEEK_END)
+            self.file.write(data)
+            self.size += len(data)
+
+    def _rollover(self):
+        disk = tempfile.NamedTemporaryFile(prefix="audgit-body-", delete=False)
+        disk.write(self.file.getvalue())
+        self.file = disk
+        self._path = disk.name
+        # the file goes with the body even if nobody calls close()
+        self._cleanup = weakref.finalize(self, _remove, disk, disk.name)
+
+    def pread(self, pos: int, n: int) -> bytes:
+        with self.lock:
+            self.file.seek(pos)
+            return self.file.read(n)
+
+    def open(self) -> BinaryIO:
+        """A reader positioned at the start, readers don't share a position."""
+        return io.BufferedReader(_Reader(self), buffer_size=CHUNK_SIZE)
+
+    def read(self) -> bytes:
+        return self.pread(0, self.size)
+
+    def chunks(self, size: int = CHUNK_SIZE) -> Iterator[bytes]:
+        for pos in range(0, self.size, size):
+            yield self.pread(pos, size)
+
+    @property
+    def on_disk(self) -> bool:
+        return self._path is not None
+
+    @property
+    def path(self) -> str | None:
+        """The temp file, flushed so other readers see everything written, None while in memory."""
+        with self.lock:
+            if self._path is not None:
+                self.file.flush()
+            return self._path
+
+    def close(self):
+        with self.lock:
+            if self._cleanup is not None:
+                self._cleanup()
+            else:
+                self.file.close()
+
+    def __len__(self) -> int:
+        return self.size
+
+    def __bytes__(self) -> bytes:
+        return self.read()
+
+
+class _Reader(io.RawIOBase):
+    def __init__(self, body: Body):
+        self.body = body
+        self.pos = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buf) -> int:
+        data = self.body.pread(self.pos, len(buf))
+        buf[:len(data)] = data
+        self.pos += len(data)
+        return len(data)
+
+
+Content = bytes | Body
+
+
+def spool(chunks: Iterable[bytes], spool_size: int = DEFAULT_SPOOL_SIZE, max_size: int | None = None) -> tuple[Content, bool]:
+    """Collect chunks, cut at max_size. (content, truncated), content is bytes unless it outgrew spool_size."""
+    buf: list[bytes] = []
+    held = 0
+    body: Body | None = None
+    size = 0
+    truncated = False
+    for chunk in chunks:
+        if max_size is not None and size + len(chunk) > max_size:
+            chunk = chunk[:max_size - size]
+            truncated = True
+        size += len(chunk)
+        if body is None:
+            buf.append(chunk)
+            held += len(chunk)
+            if held > spool_size:
+                body = Body(spool_size)
+                for part in buf:
+                    body.write(part)
+                buf = []
+        else:
+            body.write(chunk)
+        if truncated:
+            break
+    return (body if body is not None else b"".join(buf)), truncated
+
+
+def open_content(content: Content) -> BinaryIO:
+    return content.open() if isinstance(content, Body) else io.BytesIO(content)
+
+
+def iter_content(content: Content) -> Iterator[bytes]:
+    if isinstance(content, Body):
+        yield from content.chunks()
+    else:
+        yield content
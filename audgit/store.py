@@ -0,0 +1,84 @@
+"""local job state, so a restarted monitor knows what it already handled without replaying the relays"""
+
+import os
+import sqlite3
+import time
+import logging
+from threading import Lock
+
+log = logging.getLogger("audgit")
+
+DEFAULT_STATE_DB = os.path.expanduser("~/.audgit/state.db")
+
+
+class JobStore:
+    def __init__(self, path: str = DEFAULT_STATE_DB):
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.path = path
+        self.lock = Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        with self.lock:
+            self.db.execute("PRAGMA journal_mode=WAL")
+            self.db.execute("PRAGMA synchronous=NORMAL")
+            self.db.execute(
+                "CREATE TABLE IF NOT EXISTS jobs ("
+                "id TEXT PRIMARY KEY, handler TEXT, state TEXT, created_at INTEGER, updated_at REAL)"
+            )
+            self.db.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+
+    def set_state(self, job_id: str, state: str, handler: str | None = None, created_at: int | None = None):
+        with self.lock:
+            self.db.execute(
+                "INSERT INTO jobs (id, handler, state, created_at, updated_at) VALUES (?, ?, ?, ?, ?) "
+                "ON CONFLICT(id) DO UPDATE SET state=excluded.state, updated_at=excluded.updated_at, "
+                "handler=coalesce(excluded.handler, jobs.handler), created_at=coalesce(excluded.created_at, jobs.created_at)",
+                (job_id, handler, state, created_at, time.time()),
+            )
+
+    def get_state(self, job_id: str) -> str | None:
+        with self.lock:
+            row = self.db.execute("SELECT state FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return row[0] if row else None
+
+    def job_ids(self) -> set[str]:
+        with self.lock:
+            return {row[0] for row in self.db.execute("SELECT id FROM jobs")}
+
+    def jobs(self, state: str | None = None) -> list[tuple[str, str, str, int, float]]:
+        """(id, handler, state, created_at, updated_at), newest first"""
+        query = "SELECT id, handler, state, created_at, updated_at FROM jobs"
+        args: tuple = ()
+        if state:
+            query += " WHERE state = ?"
+            args = (state,)
+        with self.lock:
+            return self.db.execute(query + " ORDER BY created_at DESC", args).fetchall()
+
+    def release_claims(self) -> list[tuple[str, int]]:
+        """Forget jobs still marked started, (id, created_at) of each.
+
+        Only call this before dispatching: a claim without a published result then belongs to a run that died.
+        """
+        with self.lock:
+            rows = self.db.execute("SELECT id, created_at FROM jobs WHERE state = 'started'").fetchall()
+            self.db.execute("DELETE FROM jobs WHERE state = 'started'")
+        return rows
+
+    def last_seen(self) -> int | None:
+        """created_at of the newest job claimed, None before the first checkpoint"""
+        with self.lock:
+            row = self.db.execute("SELECT value FROM meta WHERE key = 'last_seen'").fetchone()
+        return int(row[0]) if row else None
+
+    def set_last_seen(self, created_at: int):
+        with self.lock:
+            self.db.execute(
+                "INSERT INTO meta (key, value) VALUES ('last_seen', ?) "
+                "ON CONFLICT(key) DO UPDATE SET value = max(CAST(value AS INTEGER), CAST(excluded.value AS INTEGER))",
+                (str(int(created_at)),),
+            )
+
+    def close(self):
+        with self.lock:
+            self.db.close()
@@ -0,0 +1,233 @@
+"""symbol index (functions, classes, methods, imports) used to send only the relevant parts of big files"""
+
+import ast
+import bisect
+import json
+import os
+import re
+import logging
+from dataclasses import dataclass, field, asdict
+from threading import Lock
+
+from audgit.descrips import blob_sha
+from audgit.partition import BOUNDARY, count_tokens, split_lines
+from audgit.retrieval import DEFINITION, IMPORT, tokenize
+
+log = logging.getLogger("audgit")
+
+# files under this many tokens are always sent whole
+SLICE_MIN_TOKENS = int(os.environ.get("AUDGIT_SLICE_MIN_TOKENS", "4000"))
+
+CALL = re.compile(r"\b([A-Za-z_][A-Za-z0-9_]*)\s*\(")
+
+_cache_locks: dict[str, Lock] = {}
+
+
+@dataclass
+class Symbol:
+    name: str
+    kind: str  # function, class, method or import
+    start_line: int  # 1-based, inclusive
+    end_line: int
+    start_byte: int
+    end_byte: int
+    parent: str | None = None
+    calls: list[str] = field(default_factory=list)
+
+    @property
+    def short_name(self):
+        return self.name.rsplit(".", 1)[-1]
+
+
+def _byte_offsets(code: str) -> list[int]:
+    offsets = [0]
+    for line in split_lines(code):
+        offsets.append(offsets[-1] + len(line.encode()))
+    return offsets
+
+
+def _calls(node: ast.AST) -> list[str]:
+    names = set()
+    for sub in ast.walk(node):
+        if isinstance(sub, ast.Call):
+            if isinstance(sub.func, ast.Name):
+                names.add(sub.func.id)
+            elif isinstance(sub.func, ast.Attribute):
+                names.add(sub.func.attr)
+    return sorted(names)
+
+
+def python_symbols(code: str) -> list[Symbol]:
+    tree = ast.parse(code)
+    offsets = _byte_offsets(code)
+
+    def make(node, name, kind, parent=None):
+        start = min([node.lineno] + [d.lineno for d in getattr(node, "decorator_list", [])])
+        end = node.end_lineno or node.lineno
+        return Symbol(name=name, kind=kind, start_line=start, end_line=end, start_byte=offsets[start - 1],
+                      end_byte=offsets[min(end, len(offsets) - 1)], parent=parent,
+                      calls=[] if kind in ("import", "class") else _calls(node))
+
+    symbols = []
+    for node in tree.body:
+        if isinstance(node, ast.Import):
+            symbols.extend(make(node, alias.name, "import") for alias in node.names)
+        elif isinstance(node, ast.ImportFrom):
+            symbols.append(make(node, node.module or ".", "import"))
+        elif isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)):
+            symbols.append(make(node, node.name, "function"))
+        elif isinstance(node, ast.ClassDef):
+            symbols.append(make(node, node.name, "class"))
+            for item in node.body:
+                if isinstance(item, (ast.FunctionDef, ast.AsyncFunctionDef)):
+                    symbols.append(make(item, f"{node.name}.{item.name}", "method", parent=node.name))
+    return symbols
+
+
+def generic_symbols(code: str) -> list[Symbol]:
+    """Top level definitions found by pattern, each running up to the next one."""
+    lines = split_lines(code)
+    offsets = _byte_offsets(code)
+    line_starts = [0]
+    for text in lines:
+        line_starts.append(line_starts[-1] + len(text))
+    symbols = []
+    for match in IMPORT.finditer(code):
+        line = bisect.bisect_right(line_starts, match.start())
+        symbols.append(Symbol(match[1], "import", line, line, offsets[line - 1], offsets[line]))
+
+    defs = [i for i, line in enumerate(lines) if BOUNDARY.match(line) and DEFINITION.search(line)]
+    for begin, end in zip(defs, defs[1:] + [len(lines)]):
+        match = DEFINITION.search(lines[begin])
+        body = "".join(lines[begin:end])
+        kind = "class" if re.match(r".*\b(?:class|struct|interface|contract|trait)\s", lines[begin]) else "function"
+        symbols.append(Symbol(match[1], kind, begin + 1, end, offsets[begin], offsets[end],
+                              calls=sorted(set(CALL.findall(body)) - {match[1]})))
+    return symbols
+
+
+def index_source(path: str, code: str) -> list[Symbol]:
+    if path.endswith(".py"):
+        try:
+            return python_symbols(code)
+        except (SyntaxError, ValueError):
+            log.debug("can't parse %s, using pattern symbols", path)
+    return generic_symbols(code)
+
+
+class SymbolIndex:
+    """Symbols per file for one repo, cached by blob sha in the repo's .pierre directory."""
+
+    def __init__(self, org: str, name: str, local_path: str):
+        self.canon_name = org + "." + name
+        self.tmp_path = os.path.join(local_path, ".pierre")
+        self.path = os.path.join(self.tmp_path, f"{self.canon_name}_symbols.json")
+        self.lock = _cache_locks.setdefault(self.canon_name, Lock())
+        self.cache: dict[str, list[dict]] | None = None
+        self.dirty = False
+
+    def _load(self):
+        if self.cache is None:
+            self.cache = {}
+            if os.path.exists(self.path):
+                with open(self.path, "rb") as f:
+                    self.cache = json.load(f)
+
+    def symbols(self, path: str, code: str) -> list[Symbol]:
+        sha = blob_sha(code.encode())
+        with self.lock:
+            self._load()
+            if sha in self.cache:
+                return [Symbol(**sym) for sym in self.cache[sha]]
+        symbols = index_source(path, code)
+        with self.lock:
+            self.cache[sha] = [asdict(sym) for sym in symbols]
+            self.dirty = True
+        return symbols
+
+    def save(self):
+        with self.lock:
+            if not self.dirty:
+                return
+            os.makedirs(self.tmp_path, exist_ok=True)
+            with open(self.path + ".tmp", "w") as f:
+                json.dump(self.cache, f)
+            os.replace(self.path + ".tmp", self.path)
+            self.dirty = False
+
+
+def select_symbols(files: dict[str, list[Symbol]], query: str) -> set[tuple[str, str]]:
+    """(path, symbol name) for symbols named in the query, plus their callers and callees across files."""
+    terms = set(tokenize(query))
+
+    def named(sym):
+        return sym.short_name.lower() in terms or (sym.parent or "").lower() in terms
+
+    selected = {(path, sym.name) for path, syms in files.items() for sym in syms if sym.kind != "import" and named(sym)}
+    # a named class brings its methods
+    classes = {(path, name) for path, name in selected if any(s.name == name and s.kind == "class" for s in files[path])}
+    selected |= {(path, s.name) for path, name in classes for s in files[path] if s.parent == name}
+
+    names = {name.rsplit(".", 1)[-1] for _, name in selected}
+    callees = {c for path, syms in files.items() for s in syms if (path, s.name) in selected for c in s.calls}
+    for path, syms in files.items():
+        for sym in syms:
+            if sym.kind == "import":
+                continue
+            if sym.short_name in callees or names.intersection(sym.calls):
+                selected.add((path, sym.name))
+    return selected
+
+
+def render_slice(code: str, symbols: list[Symbol], keep: set[str]) -> str:
+    """The file with everything but imports, kept symbols and the headers of their classes elided."""
+    lines = split_lines(code)
+    wanted = [False] * len(lines)
+    by_name = {s.name: s for s in symbols}
+    for sym in symbols:
+        if sym.kind == "import" or sym.name in keep:
+            for i in range(sym.start_line - 1, min(sym.end_line, len(lines))):
+                wanted[i] = True
+            if sym.parent in by_name:
+                wanted[by_name[sym.parent].start_line - 1] = True
+
+    out = []
+    i = 0
+    while i < len(lines):
+        if wanted[i]:
+            out.append(lines[i])
+            i += 1
+            continue
+        j = i
+        while j < len(lines) and not wanted[j]:
+            j += 1
+        if "".join(lines[i:j]).strip():
+            out.append(f"... (lines {i + 1}-{j} omitted)\n")
+        else:
+            out.extend(lines[i:j])
+        i = j
+    return "".join(out)
+
+
+def make_slicer(org: str, name: str, local_path: str, query: str, min_tokens: int = SLICE_MIN_TOKENS):
+    """A partition transform that trims big files to the symbols relevant to query.
+
+    Files where nothing relevant is found are sent whole.
+    """
+    index = SymbolIndex(org, name, local_path)
+
+    def slicer(contents: dict[str, str]) -> dict[str, str]:
+        files = {path: index.symbols(path, code) for path, code in contents.items()}
+        index.save()
+        selected = select_symbols(files, query)
+        out = {}
+        for path, code in contents.items():
+            keep = {sym_name for sym_path, sym_name in selected if sym_path == path}
+            if not keep or count_tokens(code) < min_tokens:
+                out[path] = code
+                continue
+            out[path] = render_slice(code, files[path], keep)
+            log.debug("sliced %s to %s symbols", path, len(keep))
+        return out
+
+    return slicer
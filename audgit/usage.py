@@ -0,0 +1,205 @@
+"""token, latency and cache-hit accounting for every llm call, attributed to the job, repo and handler it ran for"""
+
+import contextvars
+import os
+import sqlite3
+import time
+import logging
+from dataclasses import dataclass, field
+from threading import Lock
+from typing import Callable, TypeVar
+
+log = logging.getLogger("audgit")
+
+DEFAULT_USAGE_DB = os.environ.get("AUDGIT_USAGE_DB", os.path.expanduser("~/.audgit/usage.db"))
+USAGE_ENABLED = os.environ.get("AUDGIT_USAGE", "1") != "0"
+
+# usd per million (prompt, completion) tokens, for the report's cost column
+PRICES = {
+    "claude-2": (11.02, 32.68),
+    "claude-instant-1": (1.63, 5.51),
+}
+
+GROUPS = ("job", "repo", "handler", "model", "call")
+
+# who a call is made for, set by the monitor (job, handler) and the handler (repo)
+job_var: contextvars.ContextVar[str | None] = contextvars.ContextVar("audgit_job", default=None)
+repo_var: contextvars.ContextVar[str | None] = contextvars.ContextVar("audgit_repo", default=None)
+handler_var: contextvars.ContextVar[str | None] = contextvars.ContextVar("audgit_handler", default=None)
+
+T = TypeVar("T")
+
+
+def tag(job: str | None = None, repo: str | None = None, handler: str | None = None):
+    """Attribute calls made from here on, in the current context, to job/repo/handler."""
+    if job is not None:
+        job_var.set(job)
+    if repo is not None:
+        repo_var.set(repo)
+    if handler is not None:
+        handler_var.set(handler)
+
+
+def job_context(job: str | None = None, repo: str | None = None, handler: str | None = None) -> contextvars.Context:
+    """A fresh context tagged for one job, steps of the job are run in it with ctx.run()."""
+    ctx = contextvars.Context()
+    ctx.run(tag, job, repo, handler)
+    return ctx
+
+
+def propagate(fn: Callable[..., T]) -> Callable[..., T]:
+    """fn bound to the caller's context, for work handed to a thread pool. Each call runs in its own copy."""
+    ctx = contextvars.copy_context()
+
+    def run(*args, **kwargs):
+        return ctx.copy().run(fn, *args, **kwargs)
+
+    return run
+
+
+def price(model: str, prompt_tokens: int, completion_tokens: int) -> float:
+    prompt_price, completion_price = PRICES.get(model, (0.0, 0.0))
+    return (prompt_tokens * prompt_price + completion_tokens * completion_price) / 1e6
+
+
+@dataclass
+class Call:
+    call: str
+    model: str
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    latency: float = 0.0
+    # one row can stand for several calls that were all answered from a cache
+    calls: int = 1
+    cached: int = 0
+    ok: bool = True
+    job: str | None = field(default_factory=job_var.get)
+    repo: str | None = field(default_factory=repo_var.get)
+    handler: str | None = field(default_factory=handler_var.get)
+    at: float = field(default_factory=time.time)
+
+
+class UsageStore:
+    def __init__(self, path: str = DEFAULT_USAGE_DB):
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.path = path
+        self.lock = Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        with self.lock:
+            self.db.execute("PRAGMA journal_mode=WAL")
+            self.db.execute("PRAGMA synchronous=NORMAL")
+            self.db.execute(
+                "CREATE TABLE IF NOT EXISTS calls ("
+                "at REAL, job TEXT, repo TEXT, handler TEXT, call TEXT, model TEXT, "
+                "prompt_tokens INTEGER, completion_tokens INTEGER, latency REAL, calls INTEGER, cached INTEGER, ok INTEGER)"
+            )
+            self.db.execute("CREATE INDEX IF NOT EXISTS calls_at ON calls (at)")
+
+    def add(self, call: Call):
+        with self.lock:
+            self.db.execute(
+                "INSERT INTO calls VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (call.at, call.job, call.repo, call.handler, call.call, call.model, call.prompt_tokens,
+                 call.completion_tokens, call.latency, call.calls, call.cached, int(call.ok)),
+            )
+
+    def summary(self, by: str = "repo", since: float | None = None, limit: int | None = None) -> list[dict]:
+        """Totals grouped by one of GROUPS, most expensive first."""
+        if by not in GROUPS:
+            raise ValueError(f"can't group usage by {by}, one of {GROUPS}")
+        # cost depends on the model, so sum per (group, model) first
+        query = (
+            f"SELECT {by}, model, sum(calls), sum(cached), sum(1 - ok), sum(prompt_tokens), sum(completion_tokens), "
+            f"sum(latency) FROM calls WHERE at >= ? GROUP BY {by}, model"
+        )
+        with self.lock:
+            rows = self.db.execute(query, (since or 0,)).fetchall()
+
+        totals: dict[str | None, dict] = {}
+        for key, model, calls, cached, failed, prompt_tokens, completion_tokens, latency in rows:
+            row = totals.setdefault(key, {
+                by: key, "calls": 0, "cached": 0, "failed": 0, "prompt_tokens": 0, "completion_tokens": 0,
+                "latency": 0.0, "cost_usd": 0.0,
+            })
+            row["calls"] += calls
+            row["cached"] += cached
+            row["failed"] += failed
+            row["prompt_tokens"] += prompt_tokens
+            row["completion_tokens"] += completion_tokens
+            row["latency"] += latency
+            row["cost_usd"] += price(model, prompt_tokens, completion_tokens)
+
+        for row in totals.values():
+            row["latency"] = round(row["latency"], 3)
+            row["cost_usd"] = round(row["cost_usd"], 6)
+        ordered = sorted(totals.values(), key=lambda r: (r["cost_usd"], r["prompt_tokens"]), reverse=True)
+        return ordered[:limit] if limit else ordered
+
+    def close(self):
+        with self.lock:
+            self.db.close()
+
+
+_store: UsageStore | None = None
+_store_lock = Lock()
+
+
+def get_store() -> UsageStore:
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = UsageStore()
+    return _store
+
+
+def set_store(store: UsageStore | None):
+    global _store
+    with _store_lock:
+        _store = store
+
+
+def count_tokens(text: str) -> int:
+    from audgit import llm
+
+    try:
+        return llm.count_tokens(text)
+    except Exception:
+        # the tokenizer isn't there, a rough estimate beats no number
+        log.debug("token count failed, estimating", exc_info=True)
+        return len(text) // 4
+
+
+def record(call: str, model: str, prompt: str, completion: str, latency: float, ok: bool = True):
+    """Account one completed (or failed) llm call. Never raises, accounting must not fail a job."""
+    if not USAGE_ENABLED:
+        return
+    try:
+        get_store().add(Call(call, model, count_tokens(prompt), count_tokens(completion) if completion else 0,
+                             latency, ok=ok))
+    except Exception:
+        log.exception("recording usage failed")
+
+
+def record_cached(call: str, model: str, hits: int):
+    """Account hits calls that a cache answered without going to the model."""
+    if not USAGE_ENABLED or not hits:
+        return
+    try:
+        get_store().add(Call(call, model, calls=hits, cached=hits))
+    except Exception:
+        log.exception("recording usage failed")
+
+
+def report(by: str = "repo", since: float | None = None, limit: int | None = None,
+           store: UsageStore | None = None) -> str:
+    rows = (store or get_store()).summary(by, since, limit)
+    header = f"{by:<40}{'calls':>8}{'cached':>8}{'failed':>8}{'prompt':>12}{'completion':>12}{'seconds':>10}{'usd':>10}"
+    lines = [header]
+    for row in rows:
+        lines.append(
+            f"{str(row[by])[:39]:<40}{row['calls']:>8}{row['cached']:>8}{row['failed']:>8}{row['prompt_tokens']:>12}"
+            f"{row['completion_tokens']:>12}{row['latency']:>10.1f}{row['cost_usd']:>10.4f}"
+        )
+    return "\n".join(lines)
@@ -0,0 +1,207 @@
+"""local stand-ins for the services a review talks to: relays, github, an lnurl wallet and the completion api"""
+
+import json
+import os
+import queue
+import random
+import re
+import subprocess
+import threading
+import time
+import uuid
+from dataclasses import dataclass, field
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from types import SimpleNamespace
+from urllib.parse import parse_qs, urlsplit
+
+WORDS = "the handler retries the request when the cache misses and the lock is held by another worker".split()
+
+
+class Server:
+    """A handler class served on a random local port from a daemon thread."""
+
+    def __init__(self, handler: type[BaseHTTPRequestHandler]):
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+        self.httpd.daemon_threads = True
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self.thread.start()
+
+    @property
+    def host(self) -> str:
+        return f"127.0.0.1:{self.httpd.server_port}"
+
+    @property
+    def url(self) -> str:
+        return f"http://{self.host}"
+
+    def close(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+class JsonHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def reply(self, obj, status: int = 200):
+        body = json.dumps(obj).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+# --- github ---------------------------------------------------------------------------------------------------
+
+
+def make_fixture_repo(root: str, owner: str, repo: str, files: int = 40, seed: int = 1) -> str:
+    """A git repo of generated python modules at root/owner/repo.git, clonable with file://root as github url."""
+    rnd = random.Random(seed)
+    path = os.path.join(root, owner, f"{repo}.git")
+    os.makedirs(path, exist_ok=True)
+    for n in range(files):
+        funcs = []
+        for f in range(rnd.randrange(3, 12)):
+            callee = f"helper_{rnd.randrange(files)}_{rnd.randrange(3)}"
+            body = "\n".join(f"    # {' '.join(rnd.choice(WORDS) for _ in range(10))}" for _ in range(rnd.randrange(2, 10)))
+            funcs.append(f"def helper_{n}_{f}(value):\n{body}\n    return {callee}(value)\n")
+        pkg = os.path.join(path, f"pkg{n % 5}")
+        os.makedirs(pkg, exist_ok=True)
+        with open(os.path.join(pkg, f"module_{n}.py"), "w") as fh:
+            fh.write(f'"""module {n}"""\n\n' + "\n\n".join(funcs))
+    git = ["git", "-C", path, "-c", "user.name=bench", "-c", "user.email=bench@localhost"]
+    subprocess.run(git + ["init", "-q"], check=True)
+    subprocess.run(git + ["add", "-A"], check=True)
+    subprocess.run(git + ["commit", "-q", "-m", "fixture"], check=True)
+    return path
+
+
+class GitHubHandler(JsonHandler):
+    """GET /repos/{owner}/{repo}/issues/{n}"""
+    latency = 0.0
+
+    def do_GET(self):
+        time.sleep(self.latency)
+        match = re.match(r"/repos/([^/]+)/([^/]+)/issues/(\d+)$", urlsplit(self.path).path)
+        if not match:
+            return self.reply({"message": "Not Found"}, 404)
+        n = int(match[3])
+        self.reply({
+            "number": n,
+            "title": f"helper_{n}_1 returns the wrong value",
+            "body": f"Calling helper_{n}_1 from module_{n} gives a stale result when the cache misses.",
+        })
+
+
+# --- lnurl ----------------------------------------------------------------------------------------------------
+
+
+class LnurlHandler(JsonHandler):
+    """lnurl-pay for user@host: invoices settle pay_delay seconds after they are created."""
+    pay_delay = 0.0
+    invoices: dict[str, float] = {}
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        base = f"http://{self.headers['Host']}"
+        if match := re.match(r"/.well-known/lnurlp/([^/]+)$", url.path):
+            return self.reply({"callback": f"{base}/lnurlp/{match[1]}/callback", "tag": "payRequest"})
+        if re.match(r"/lnurlp/[^/]+/callback$", url.path):
+            invoice = uuid.uuid4().hex
+            self.invoices[invoice] = time.monotonic()
+            amount = parse_qs(url.query).get("amount", ["0"])[0]
+            return self.reply({"pr": f"lnbc{amount}n1{invoice}", "verify": f"{base}/verify/{invoice}"})
+        if match := re.match(r"/verify/([0-9a-f]+)$", url.path):
+            created = self.invoices.get(match[1])
+            if created is None:
+                return self.reply({"status": "ERROR"}, 404)
+            return self.reply({"settled": time.monotonic() - created >= self.pay_delay})
+        self.reply({"status": "ERROR"}, 404)
+
+
+# --- completions ----------------------------------------------------------------------------------------------
+
+
+class CompletionHandler(JsonHandler):
+    """POST /v1/complete, with a time to first token and a token rate.
+
+    File selection prompts get a list of paths from their file tree, everything else gets filler text.
+    """
+    first_token = 0.5
+    tokens_per_second = 200.0
+    tokens = 300
+    description_tokens = 20
+
+    def do_POST(self):
+        req = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        prompt = req["prompt"]
+        tree = re.search(r"<CodeToReview>(\{.*?\})</CodeToReview>", prompt, re.DOTALL)
+        if tree and "list of up to 10 files" in prompt:
+            paths = list(json.loads(tree[1]))[:3]
+            pieces = [json.dumps(paths)]
+        else:
+            count = self.description_tokens if req.get("model", "").startswith("claude-instant") else self.tokens
+            pieces = [f" {WORDS[i % len(WORDS)]}" for i in range(min(count, req.get("max_tokens_to_sample", count)))]
+
+        time.sleep(self.first_token)
+        if req.get("stream"):
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Connection", "close")
+            self.end_headers()
+            for piece in pieces:
+                event = {"type": "completion", "completion": piece, "stop_reason": None, "model": req["model"]}
+                self.wfile.write(f"event: completion\ndata: {json.dumps(event)}\n\n".encode())
+                self.wfile.flush()
+                time.sleep(1 / self.tokens_per_second)
+            self.close_connection = True
+            return
+        time.sleep(len(pieces) / self.tokens_per_second)
+        self.reply({"type": "completion", "completion": "".join(pieces), "stop_reason": "stop_sequence",
+                    "model": req["model"]})
+
+
+def handler(base: type[BaseHTTPRequestHandler], **settings) -> type[BaseHTTPRequestHandler]:
+    """Subclass of a fake handler with its class level settings replaced, so servers don't share them."""
+    return type(base.__name__, (base,), settings)
+
+
+# --- relays ---------------------------------------------------------------------------------------------------
+
+
+@dataclass
+class Published:
+    at: float
+    event: object
+
+
+@dataclass
+class FakeRelayManager:
+    """In-process relay pool: jobs are injected into message_pool, published results are recorded."""
+    message_pool: SimpleNamespace = field(default_factory=lambda: SimpleNamespace(
+        events=queue.Queue(), eose_notices=queue.Queue(), notices=queue.Queue()))
+    published: list[Published] = field(default_factory=list)
+    on_publish: object = None
+    lock: threading.Lock = field(default_factory=threading.Lock)
+
+    def inject(self, event):
+        self.message_pool.events.put(SimpleNamespace(event=event))
+
+    def publish_event(self, event):
+        item = Published(time.monotonic(), event)
+        with self.lock:
+            self.published.append(item)
+        if self.on_publish:
+            self.on_publish(item)
+
+    def add_subscription_on_all_relays(self, sub_id, filters):
+        self.message_pool.eose_notices.put(sub_id)
+
+    def close_subscription_on_all_relays(self, sub_id):
+        pass
+
+    def close_all_relay_connections(self):
+        pass
@@ -0,0 +1,91 @@
+"""compare crawler link extractors on pages/sec and peak memory
+
+    python benchmarks/links.py [corpus_dir] [--repeat N]
+
+The corpus is a directory of saved html pages, without one a synthetic docs-like corpus is generated.
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from audgit.links import EXTRACTORS  # noqa: E402
+
+
+def synthetic_corpus(pages: int = 200, seed: int = 1) -> list[bytes]:
+    rnd = random.Random(seed)
+    words = "crawler frontier index page section guide api reference install configure release notes".split()
+    corpus = []
+    for n in range(pages):
+        parts = ["<html><head><title>page</title><style>a[href] { color: red }</style></head><body><nav>"]
+        parts += [f'<a href="/docs/{rnd.randrange(pages)}">{rnd.choice(words)}</a>' for _ in range(40)]
+        parts.append("</nav><main>")
+        for _ in range(rnd.randrange(20, 200)):
+            text = " ".join(rnd.choice(words) for _ in range(60))
+            parts.append(f'<p class="body">{text} <a href="/docs/{rnd.randrange(pages)}#s{n}">more</a></p>')
+        parts.append("<script>var x = '<a href=\"/nope\">';</script></main></body></html>")
+        corpus.append("\n".join(parts).encode())
+    return corpus
+
+
+def load_corpus(path: str) -> list[bytes]:
+    corpus = []
+    for root, _dirs, files in os.walk(path):
+        for name in sorted(files):
+            if name.endswith((".html", ".htm")):
+                with open(os.path.join(root, name), "rb") as f:
+                    corpus.append(f.read())
+    return corpus
+
+
+def bench(name: str, corpus: list[bytes], repeat: int) -> dict:
+    extractor = EXTRACTORS[name]
+    links = 0
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for page in corpus:
+            links += len(extractor.links(page))
+    elapsed = time.perf_counter() - start
+
+    # memory is measured on a separate pass, tracing slows everything down
+    tracemalloc.start()
+    for page in corpus:
+        extractor.links(page)
+    _current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    pages = len(corpus) * repeat
+    return {
+        "extractor": name,
+        "pages/sec": pages / elapsed,
+        "MB/sec": sum(map(len, corpus)) * repeat / elapsed / 1e6,
+        "links/page": links / pages,
+        "peak KB": peak / 1024,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="link extractor benchmark")
+    parser.add_argument("corpus", nargs="?", help="directory of saved .html pages")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    corpus = load_corpus(args.corpus) if args.corpus else synthetic_corpus()
+    if not corpus:
+        sys.exit(f"no .html pages in {args.corpus}")
+    print(f"{len(corpus)} pages, {sum(map(len, corpus)) / 1e6:.1f} MB")
+
+    rows = [bench(name, corpus, args.repeat) for name in EXTRACTORS]
+    cols = list(rows[0])
+    print("  ".join(f"{c:>12}" for c in cols))
+    for row in rows:
+        print("  ".join(f"{v:>12.1f}" if isinstance(v, float) else f"{v:>12}" for v in row.values()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,208 @@
+"""offline end to end replay of code reviews through Monitor, reporting per stage latency and throughput
+
+    python benchmarks/replay.py --jobs 20 --llm-first-token 0.5 --llm-tps 200
+
+Relays, github, the lnurl wallet and the completion api are local stand-ins (see fakes.py), the fixture repos
+are cloned over file://. Nothing leaves the machine.
+"""
+
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import uuid
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from fakes import (  # noqa: E402
+    CompletionHandler, FakeRelayManager, GitHubHandler, LnurlHandler, Published, Server, handler, make_fixture_repo,
+)
+
+# (stage, from result, to result), "job" is when the job event reached the monitor
+STAGES = [
+    ("ack", "job", "issue_ack"),
+    ("files", "issue_ack", "claude_files"),
+    ("first_token", "claude_files", "claude_solution_progress"),
+    ("solution", "claude_files", "claude_solution"),
+    ("total", "job", "claude_solution"),
+]
+
+
+def percentile(values: list[float], p: float) -> float:
+    """Nearest rank percentile."""
+    ordered = sorted(values)
+    rank = max(0, min(len(ordered) - 1, int(round(p / 100 * len(ordered) + 0.5)) - 1))
+    return ordered[rank]
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="offline code review replay benchmark")
+    parser.add_argument("--jobs", type=int, default=10, help="number of review jobs")
+    parser.add_argument("--interval", type=float, default=0.0, help="seconds between job arrivals")
+    parser.add_argument("--repos", type=int, default=1, help="fixture repos the jobs are spread over")
+    parser.add_argument("--files", type=int, default=40, help="python modules per fixture repo")
+    parser.add_argument("--workers", type=int, default=10, help="monitor executor threads")
+    parser.add_argument("--aio", action="store_true", help="use the asyncio relay loop")
+    parser.add_argument("--warm", action="store_true", help="reuse clones and description caches of earlier runs")
+    parser.add_argument("--github-latency", type=float, default=0.05)
+    parser.add_argument("--pay-delay", type=float, default=0.0, help="seconds until an invoice settles")
+    parser.add_argument("--pay-poll", type=float, default=0.2, help="payment watcher poll interval")
+    parser.add_argument("--llm-first-token", type=float, default=0.5, help="completion latency to first token")
+    parser.add_argument("--llm-tps", type=float, default=200.0, help="completion tokens per second")
+    parser.add_argument("--llm-tokens", type=int, default=300, help="tokens per review completion")
+    parser.add_argument("--timeout", type=float, default=600.0)
+    parser.add_argument("--json", help="also write the report to this file")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+
+    root = tempfile.mkdtemp(prefix="audgit-replay-")
+    owner = "bench" if args.warm else f"bench-{uuid.uuid4().hex[:8]}"
+    repos = [f"repo{i}" for i in range(args.repos)]
+    for repo in repos:
+        make_fixture_repo(root, owner, repo, files=args.files)
+
+    github = Server(handler(GitHubHandler, latency=args.github_latency))
+    lnurl = Server(handler(LnurlHandler, pay_delay=args.pay_delay, invoices={}))
+    completions = Server(handler(CompletionHandler, first_token=args.llm_first_token,
+                                 tokens_per_second=args.llm_tps, tokens=args.llm_tokens))
+
+    from nostr.event import Event
+    from nostr.key import PrivateKey
+
+    # audgit reads its endpoints and keys at import time
+    os.environ.update({
+        "AUDGIT_GITHUB_API": github.url,
+        "AUDGIT_GITHUB_URL": f"file://{root}",
+        "AUDGIT_LNURL_SCHEME": "http",
+        "LIGHTNING_ADDRESS": f"bench@{lnurl.host}",
+        "ANTHROPIC_BASE_URL": completions.url,
+        "ANTHROPIC_API_KEY": "bench",
+        "GITHUB_TOKEN": "bench",
+        "NOSTR_PRIVKEY": PrivateKey().hex(),
+        # fake calls with fake costs stay out of the real usage database
+        "AUDGIT_USAGE_DB": os.path.join(root, "usage.db"),
+    })
+
+    from audgit import usage
+    from audgit.code_review import code_review
+    from audgit.monitor import Executor, Monitor
+    from audgit.payments import PaymentWatcher
+    from audgit.store import JobStore
+
+    relay = FakeRelayManager()
+
+    class ReplayMonitor(Monitor):
+        def _subscribe(self, filter):
+            sub_id = uuid.uuid1().hex
+            relay.add_subscription_on_all_relays(sub_id, filter)
+            return relay, sub_id
+
+        def get_done(self):
+            return set()
+
+    monitor = ReplayMonitor(debug=False, store=JobStore(":memory:"))
+    monitor.executor = Executor(max_workers=args.workers)
+    monitor.payments = PaymentWatcher(interval=args.pay_poll)
+    monitor.add_handler("code-review", code_review)
+
+    marks: dict[str, dict[str, float]] = {}
+    failed: set[str] = set()
+    lock = threading.Lock()
+    finished = threading.Event()
+
+    def on_publish(item: Published):
+        tags = {tag[0]: tag[1] for tag in item.event.tags if len(tag) > 1}
+        job_id = tags.get("e")
+        with lock:
+            job = marks.setdefault(job_id, {})
+            result = tags.get("R") or tags.get("status")
+            job.setdefault(result, item.at)
+            if tags.get("status") in ("failure", "error"):
+                failed.add(job_id)
+            done = sum(1 for j in marks.values() if "claude_solution" in j or "failure" in j)
+        if done >= args.jobs:
+            finished.set()
+
+    relay.on_publish = on_publish
+
+    if args.aio:
+        runner = threading.Thread(target=monitor.start_async, daemon=True)
+    else:
+        runner = threading.Thread(target=monitor.start, daemon=True)
+    runner.start()
+
+    client = PrivateKey()
+    started = time.monotonic()
+    for n in range(args.jobs):
+        repo = repos[n % len(repos)]
+        event = Event(content=f"https://github.com/{owner}/{repo}/issues/{n + 1}", kind=65123,
+                      tags=[["j", "code-review"]])
+        client.sign_event(event)
+        with lock:
+            marks.setdefault(event.id, {})["job"] = time.monotonic()
+        relay.inject(event)
+        if args.interval:
+            time.sleep(args.interval)
+
+    completed = finished.wait(args.timeout)
+    wall = time.monotonic() - started
+
+    if args.aio:
+        monitor.shutdown()
+    else:
+        monitor.stop = True
+        relay.message_pool.events.put(None)
+    runner.join(timeout=10)
+    calls = usage.get_store().summary("call")
+    usage.get_store().close()
+    for server in (github, lnurl, completions):
+        server.close()
+    shutil.rmtree(root, ignore_errors=True)
+    if not args.warm:
+        shutil.rmtree(f"/tmp/repo/{owner}", ignore_errors=True)
+
+    ok = sum(1 for job_id, job in marks.items() if "claude_solution" in job and job_id not in failed)
+    report = {
+        "jobs": args.jobs,
+        "ok": ok,
+        "failed": len(failed),
+        "timed_out": not completed,
+        "wall_seconds": round(wall, 3),
+        "jobs_per_minute": round(ok / wall * 60, 2) if wall else 0.0,
+        "stages": {},
+        # tokens per llm call type, with the cost the price table gives them
+        "usage": calls,
+    }
+    for stage, start, end in STAGES:
+        values = [job[end] - job[start] for job in marks.values() if start in job and end in job]
+        if values:
+            report["stages"][stage] = {
+                "n": len(values),
+                "p50": round(percentile(values, 50), 3),
+                "p95": round(percentile(values, 95), 3),
+                "p99": round(percentile(values, 99), 3),
+            }
+
+    print(f"jobs {report['jobs']}  ok {report['ok']}  failed {report['failed']}  "
+          f"wall {report['wall_seconds']}s  jobs/min {report['jobs_per_minute']}"
+          + ("  (timed out)" if report["timed_out"] else ""))
+    print(f"{'stage':<12}{'n':>6}{'p50':>10}{'p95':>10}{'p99':>10}")
+    for stage, row in report["stages"].items():
+        print(f"{stage:<12}{row['n']:>6}{row['p50']:>10.3f}{row['p95']:>10.3f}{row['p99']:>10.3f}")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+
+    sys.exit(0 if completed and not failed else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,14 @@
+import pytest
+
+from audgit import usage
+from audgit.usage import UsageStore
+
+
+@pytest.fixture(autouse=True)
+def usage_store(monkeypatch):
+    """Llm usage goes to an in-memory store, never ~/.audgit/usage.db, with tokens counted as words."""
+    store = UsageStore(":memory:")
+    usage.set_store(store)
+    monkeypatch.setattr(usage, "count_tokens", lambda text: len(text.split()))
+    yield store
+    usage.set_store(None)
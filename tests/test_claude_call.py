@@ -0,0 +1,78 @@
+import os
+import re
+import threading
+import time
+from types import SimpleNamespace
+
+import pytest
+
+os.environ.setdefault("ANTHROPIC_API_KEY", "test")
+
+from audgit import claude_call, llm, usage  # noqa: E402
+
+
+class ReviewCompletions:
+    """Partial answers name their file and come back slowest first, the summary lists the partials it was given."""
+
+    def __init__(self, files):
+        self.files = files
+        self.lock = threading.Lock()
+        self.active = self.peak = 0
+
+    def answer(self, prompt):
+        if "<CodeToReview>" not in prompt:
+            return " | ".join(re.findall(r"partial for [\w.]+", prompt))
+        name = re.search(r"<FileName>([^<]+)</FileName>", prompt)[1]
+        with self.lock:
+            self.active += 1
+            self.peak = max(self.peak, self.active)
+        # the first chunk finishes last
+        time.sleep(0.01 * (len(self.files) - self.files.index(name)))
+        with self.lock:
+            self.active -= 1
+        return f"partial for {name}"
+
+    def create(self, model, max_tokens_to_sample, prompt, stream=False):
+        text = self.answer(prompt)
+        if stream:
+            return iter([SimpleNamespace(completion=word) for word in re.split(r"(?<= )", text)])
+        return SimpleNamespace(completion=text)
+
+
+@pytest.fixture
+def review(monkeypatch):
+    files = [f"m{n}.py" for n in range(6)]
+    # one chunk per file
+    monkeypatch.setattr(claude_call, "partition", lambda paths, transform=None: ({p: "x = 1\n"} for p in paths))
+    completions = ReviewCompletions(files)
+    monkeypatch.setattr(llm, "get_client", lambda: SimpleNamespace(completions=completions))
+    return files, completions
+
+
+def test_map_partials_keep_chunk_order(review):
+    files, completions = review
+
+    answer = claude_call.best_solution_claude_call("title", "body", files, max_concurrency=3)
+
+    assert answer == " | ".join(f"partial for {name}" for name in files)
+    assert completions.peak == 3
+    assert [r["calls"] for r in usage.get_store().summary("call")] == [6, 1]
+
+
+def test_stream_map_partials_keep_chunk_order(review):
+    files, completions = review
+
+    deltas = list(claude_call.best_solution_claude_stream("title", "body", files, max_concurrency=4))
+
+    assert len(deltas) > 1
+    assert "".join(deltas) == " | ".join(f"partial for {name}" for name in files)
+    assert completions.peak == 4
+
+
+def test_single_chunk_is_streamed_without_summary(review):
+    _, completions = review
+
+    deltas = list(claude_call.best_solution_claude_stream("title", "body", ["m3.py"]))
+
+    assert deltas == ["partial ", "for ", "m3.py"]
+    assert {r["call"] for r in usage.get_store().summary("call")} == {"partial_solution"}
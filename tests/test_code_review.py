@@ -0,0 +1,81 @@
+import os
+from types import SimpleNamespace
+
+import pytest
+
+os.environ.setdefault("ANTHROPIC_API_KEY", "test")
+os.environ.setdefault("GITHUB_TOKEN", "test")
+os.environ.setdefault("LIGHTNING_ADDRESS", "test@localhost")
+
+from nostr.event import Event  # noqa: E402
+
+from audgit import code_review, llm  # noqa: E402
+from audgit.code_review import batch_stream, stream_progress  # noqa: E402
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def monotonic(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(code_review, "time", clock)
+    return clock
+
+
+def test_batch_stream_flushes_every_n_deltas(clock):
+    assert list(batch_stream(iter("abcdefg"), every_tokens=3, every_seconds=60)) == ["abc", "def", "g"]
+    assert list(batch_stream(iter(""), every_tokens=3, every_seconds=60)) == []
+
+
+def test_batch_stream_flushes_slow_streams_on_time(clock):
+    def deltas():
+        for text, delay in (("a", 1), ("b", 1), ("c", 2), ("d", 0), ("e", 5)):
+            clock.now += delay
+            yield text
+
+    assert list(batch_stream(deltas(), every_tokens=100, every_seconds=3)) == ["abc", "de"]
+
+
+def test_progress_events_stitch_back_into_the_solution():
+    request = Event(content="https://github.com/o/r/issues/1", public_key="ab" * 32)
+    events = []
+
+    def drive():
+        final = yield from stream_progress(request, ["Use ", "a lock ", "here."])
+        events.append(final)
+
+    progress = list(drive())
+
+    assert [e.content for e in progress] == ["Use ", "a lock ", "here."]
+    tags = [dict((tag[0], tag[1]) for tag in e.tags) for e in progress]
+    assert [t["seq"] for t in tags] == ["0", "1", "2"]
+    assert [t["offset"] for t in tags] == ["0", "4", "11"]
+    assert all(t["R"] == "claude_solution_progress" and t["status"] == "processing" for t in tags)
+    assert all(t["e"] == request.id and t["p"] == request.public_key for t in tags)
+    assert events == ["Use a lock here."]
+
+    # every slice sits at its offset in the final result
+    for event, tag in zip(progress, tags):
+        offset = int(tag["offset"])
+        assert events[0][offset:offset + len(event.content)] == event.content
+
+
+def test_streamed_completion_is_batched_into_progress(monkeypatch):
+    words = [f"w{n} " for n in range(10)]
+
+    class Completions:
+        def create(self, model, max_tokens_to_sample, prompt, stream=False):
+            return iter([SimpleNamespace(completion=word) for word in words])
+
+    monkeypatch.setattr(llm, "get_client", lambda: SimpleNamespace(completions=Completions()))
+    request = Event(content="https://github.com/o/r/issues/1", public_key="ab" * 32)
+    progress = list(stream_progress(request, batch_stream(llm.stream("fix it"), every_tokens=4, every_seconds=60)))
+
+    assert [e.content for e in progress] == ["".join(words[:4]), "".join(words[4:8]), "".join(words[8:])]
+    assert [dict((t[0], t[1]) for t in e.tags)["offset"] for e in progress] == ["0", "12", "24"]
@@ -0,0 +1,423 @@
+import io
+import json
+import os
+import tarfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from types import SimpleNamespace
+from urllib.parse import parse_qs, urlsplit
+
+import pytest
+
+import audgit.crawler as crawler_mod
+from audgit.crawler import Crawler, HostLimiter
+from audgit.spool import Body
+
+
+class Site(BaseHTTPRequestHandler):
+    # /docs/N links to /docs/2N and /docs/2N+1, up to /docs/31
+    statuses: list = []
+
+    def do_GET(self):
+        n = int(self.path.rstrip("/").rsplit("/", 1)[-1] or 1)
+        time.sleep(0.02)
+        if self.headers.get("If-None-Match") == f'"{n}"':
+            self.statuses.append(304)
+            self.send_response(304)
+            self.end_headers()
+            return
+        self.statuses.append(200)
+        links = "".join(f'<a href="/docs/{k}">{k}</a>' for k in (2 * n, 2 * n + 1) if k < 32)
+        body = f"<html><body><p>page {n}</p>{links}<a href='/other'>x</a></body></html>".ljust(200).encode()
+        self.send_response(200)
+        self.send_header("ETag", f'"{n}"')
+        self.send_header("Content-Type", "text/html")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def site():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Site)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{server.server_port}"
+    server.shutdown()
+
+
+def test_crawl_web_workers_visit_each_page_once(site):
+    crawler = Crawler(workers=4, cache_dir=None)
+    urls = [out.url for out in crawler.crawl(f"{site}/docs/*1")]
+    assert sorted(urls) == sorted(f"{site}/docs/{n}" for n in range(1, 32))
+
+
+def test_crawl_web_stops_early_consumer(site):
+    crawler = Crawler(workers=4, cache_dir=None)
+    gen = crawler.crawl(f"{site}/docs/*1")
+    assert next(gen).url == f"{site}/docs/1"
+    gen.close()
+
+
+def test_crawl_web_backpressure_and_spooling(site):
+    crawler = Crawler(workers=4, cache_dir=None, queue_size=2, spool_size=100)
+    outputs = []
+    for out in crawler.crawl(f"{site}/docs/*1"):
+        time.sleep(0.01)
+        outputs.append(out)
+    assert len(outputs) == 31
+    assert all(isinstance(out.content, Body) for out in outputs)
+    assert all(out.open().read().startswith(b"<html>") for out in outputs)
+
+    # workers blocked on a full queue let go once the consumer stops
+    before = threading.active_count()
+    gen = Crawler(workers=4, cache_dir=None, queue_size=1).crawl(f"{site}/docs/*1")
+    next(gen)
+    time.sleep(0.2)
+    gen.close()
+    deadline = time.monotonic() + 2
+    while threading.active_count() > before and time.monotonic() < deadline:
+        time.sleep(0.05)
+    assert threading.active_count() <= before
+
+
+def test_crawl_web_recrawl_is_served_from_cache(site, tmp_path):
+    first = Crawler(workers=4, cache_dir=str(tmp_path))
+    pages = {out.url: out.content for out in first.crawl(f"{site}/docs/*1")}
+    assert first.cache_stats["misses"] == 31
+
+    Site.statuses = []
+    again = Crawler(workers=4, cache_dir=str(tmp_path))
+    assert {out.url: out.content for out in again.crawl(f"{site}/docs/*1")} == pages
+    assert Site.statuses == [304] * 31
+    assert again.cache_stats["hit_rate"] == 1.0
+
+
+
+@pytest.mark.skipif(bool(os.environ.get("AUDGIT_HTTP_CACHE")), reason="a cache directory is configured")
+def test_http_cache_is_opt_in(site):
+    crawler = Crawler(workers=4)
+    assert len(list(crawler.crawl(f"{site}/docs/*1"))) == 31
+    assert crawler.http_cache is None and crawler.cache_stats == {}
+
+
+class Mirrors(BaseHTTPRequestHandler):
+    """/ links to /v1 and /v2, the same text but for one word, only /v2 links on to /v2/extra."""
+    text = " ".join(f"word{n % 37} line{n % 11}" for n in range(300))
+
+    def do_GET(self):
+        bodies = {
+            "/": '<a href="/v1">v1</a> <a href="/v2">v2</a> ' + " ".join(f"index{n}" for n in range(40)),
+            "/v1": self.text,
+            "/v2": self.text.replace("word5", "changed", 1) + ' <a href="/v2/extra">extra</a>',
+            "/v2/extra": " ".join(f"extra{n}" for n in range(40)),
+        }
+        body = f"<html><body>{bodies[self.path]}</body></html>".encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/html")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.mark.parametrize("dedupe_links", [True, False])
+def test_crawl_web_skips_near_duplicates(dedupe_links):
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Mirrors)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    site = f"http://127.0.0.1:{server.server_port}"
+    try:
+        # one worker, so /v1 is always seen before /v2
+        crawler = Crawler(workers=1, cache_dir=None, dedupe=True, dedupe_links=dedupe_links)
+        urls = [out.url for out in crawler.crawl(f"{site}/")]
+    finally:
+        server.shutdown()
+    assert urls == [f"{site}/", f"{site}/v1"] + ([f"{site}/v2/extra"] if dedupe_links else [])
+    assert crawler.dedupe_stats["duplicates"] == 1
+    assert crawler.dedupe_stats["duplicate_bytes"] > 1000
+
+
+class RelativeSite(BaseHTTPRequestHandler):
+    # a /docs/ index whose pages only use relative links, /docs/start redirects to it
+    pages = {
+        "/docs/": '<a href="guide.html">guide</a> <a href="api/">api</a>',
+        "/docs/guide.html": '<a href="./">index</a> <a href="faq.html">faq</a>',
+        "/docs/faq.html": '<a href="../outside.html">out</a>',
+        "/docs/api/": '<a href="../guide.html">guide</a>',
+    }
+
+    def do_GET(self):
+        if self.path == "/docs/start":
+            self.send_response(302)
+            self.send_header("Location", "/docs/")
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        if self.path not in self.pages:
+            self.send_error(404)
+            return
+        body = f"<html><body>{self.pages[self.path]}</body></html>".encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/html")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.mark.parametrize("start, expected", [
+    ("/docs/*", ["/docs/"]),
+    # the redirect's links resolve against /docs/, then /docs/ itself is found as ./
+    ("/docs/*start", ["/docs/start", "/docs/"]),
+])
+def test_crawl_web_resolves_relative_links(start, expected):
+    server = ThreadingHTTPServer(("127.0.0.1", 0), RelativeSite)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    site = f"http://127.0.0.1:{server.server_port}"
+    try:
+        crawler = Crawler(workers=2, cache_dir=None)
+        urls = [out.url for out in crawler.crawl(site + start)]
+    finally:
+        server.shutdown()
+    # ../outside.html is out of scope, ./ and /docs/ are one page
+    expected = expected + ["/docs/guide.html", "/docs/faq.html", "/docs/api/"]
+    assert sorted(urls) == sorted(site + path for path in expected)
+
+
+def test_host_limiter_spaces_requests():
+    limiter = HostLimiter(per_host=1, delay=0.05)
+    started = []
+
+    def fetch():
+        with limiter.slot("http://example.com/a"):
+            started.append(time.monotonic())
+
+    threads = [threading.Thread(target=fetch) for _ in range(3)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    started.sort()
+    assert started[2] - started[0] >= 0.095
+
+
+def test_crawl_web_depth_is_per_level(site):
+    crawler = Crawler(workers=4, max_depth=2, cache_dir=None)
+    urls = {out.url for out in crawler.crawl(f"{site}/docs/*1")}
+    assert urls == {f"{site}/docs/{n}" for n in range(1, 8)}
+    assert crawler.abort_reason == "depth"
+
+
+def test_crawl_web_budgets_are_exact(site):
+    crawler = Crawler(workers=4, max_pages=5, cache_dir=None)
+    assert len(list(crawler.crawl(f"{site}/docs/*1"))) == 5
+    assert crawler.abort_reason == "size"
+
+    crawler = Crawler(workers=4, max_total_size=3 * 200 + 10, cache_dir=None)
+    outputs = list(crawler.crawl(f"{site}/docs/*1"))
+    assert len(outputs) == 3
+    assert crawler.abort_reason == "size"
+
+
+class Flaky(BaseHTTPRequestHandler):
+    """/ links to four slow pages that drop the connection, then to ten good ones."""
+
+    def do_GET(self):
+        if self.path.startswith("/bad"):
+            time.sleep(0.2)
+            self.close_connection = True
+            return
+        links = "" if self.path != "/" else "".join(
+            f'<a href="/{name}">{name}</a>' for name in [f"bad{n}" for n in range(4)] + [f"good{n}" for n in range(10)]
+        )
+        body = f"<html><body>{self.path}{links}</body></html>".encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/html")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def test_crawl_web_page_budget_survives_failed_fetches():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Flaky)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        # while four workers wait on bad pages the other two find the rest of the budget reserved
+        crawler = Crawler(workers=6, max_pages=5, cache_dir=None)
+        urls = [out.url for out in crawler.crawl(f"http://127.0.0.1:{server.server_port}/*")]
+    finally:
+        server.shutdown()
+
+    # the failed fetches hand their reservations back, the good pages behind them fill the budget
+    assert len(urls) == 5 and not any("/bad" in url for url in urls)
+    assert crawler.abort_reason == "size"
+
+
+class FakeTree:
+    def __init__(self, paths):
+        self.truncated = False
+        self.tree = [SimpleNamespace(path=p, type="blob", mode="100644") for p in paths]
+
+
+class FakeGhRepo:
+    default_branch = "main"
+
+    def __init__(self, api, paths):
+        self.url = f"{api}/repos/org/repo"
+        self.paths = paths
+
+    def get_branch(self, ref):
+        return SimpleNamespace(commit=SimpleNamespace(sha="abc123"))
+
+    def get_git_tree(self, sha, recursive=False):
+        assert sha == "abc123" and recursive
+        return FakeTree(self.paths)
+
+    def get_archive_link(self, archive_format, ref):
+        assert (archive_format, ref) == ("tarball", "abc123")
+        return self.url.replace("/repos/org/repo", "/tarball")
+
+    def get_contents(self, path):
+        raise AssertionError("archive mode shouldn't list contents")
+
+
+def make_tarball(files: dict[str, bytes]) -> bytes:
+    buf = io.BytesIO()
+    with tarfile.open(fileobj=buf, mode="w:gz") as tar:
+        for path, data in files.items():
+            info = tarfile.TarInfo(f"org-repo-abc123/{path}")
+            info.size = len(data)
+            tar.addfile(info, io.BytesIO(data))
+    return buf.getvalue()
+
+
+class FakeGitHub(BaseHTTPRequestHandler):
+    """Issues api with 3 pages of 2 items, the last item a pull request, plus a tarball."""
+    tarball = make_tarball({"README.md": b"# repo", "src/app.py": b"print(1)\n", "ignored.bin": b"x"})
+    requests: list = []
+    pages = 3
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        query = parse_qs(url.query)
+        self.requests.append((url.path, query, self.headers.get("If-None-Match")))
+        if url.path == "/tarball":
+            return self.reply(self.tarball)
+
+        page = int(query.get("page", ["1"])[0])
+        etag = f'"page{page}"'
+        if self.headers.get("If-None-Match") == etag:
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.end_headers()
+            return
+        base = f"http://{self.headers['Host']}{url.path}?{url.query.split('&page=')[0]}"
+        items = []
+        for n in (2 * page - 1, 2 * page):
+            item = {"url": f"/issues/{n}", "title": f"#{n}", "state": "open", "comments": n, "body": "b"}
+            if n == 6:
+                item["pull_request"] = {"url": f"/pulls/{n}"}
+            items.append(item)
+        self.reply(json.dumps(items).encode(), {"ETag": etag, "Link": f'<{base}&page={self.pages}>; rel="last"'})
+
+    def reply(self, body, headers=None):
+        self.send_response(200)
+        for k, v in (headers or {}).items():
+            self.send_header(k, v)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def github(monkeypatch):
+    server = ThreadingHTTPServer(("127.0.0.1", 0), FakeGitHub)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    gh_repo = FakeGhRepo(f"http://127.0.0.1:{server.server_port}", ["README.md", "src/app.py"])
+    monkeypatch.setattr(crawler_mod, "Github", lambda auth=None: SimpleNamespace(get_repo=lambda name: gh_repo))
+    FakeGitHub.requests = []
+    FakeGitHub.pages = 3
+    yield gh_repo
+    server.shutdown()
+
+
+def test_crawl_github(github, tmp_path):
+    outputs = list(Crawler(cache_dir=str(tmp_path)).crawl("https://github.com/org/repo"))
+    assert [o.url for o in outputs] == [
+        "/issues/1", "/issues/2", "/issues/3", "/issues/4", "/issues/5", "/pulls/6",
+        f"{github.url}/contents/README.md?ref=main",
+        f"{github.url}/contents/src/app.py?ref=main",
+    ]
+    assert json.loads(outputs[5].content) == {"type": "pull_request", "title": "#6", "state": "open", "comments": 6, "body": "b"}
+    assert outputs[7].content == b"print(1)\n"
+
+    crawler = Crawler(cache_dir=None, max_total_size=sum(len(o.content) for o in outputs[:7]) + 3)
+    assert len(list(crawler.crawl("https://github.com/org/repo"))) == 7
+    assert crawler.abort_reason == "size"
+
+
+def test_crawl_github_revalidates_pages(github, tmp_path):
+    first = list(Crawler(cache_dir=str(tmp_path)).crawl("https://github.com/org/repo"))
+    FakeGitHub.requests = []
+    again = list(Crawler(cache_dir=str(tmp_path)).crawl("https://github.com/org/repo"))
+    assert [o.content for o in again] == [o.content for o in first]
+    pages = [r for r in FakeGitHub.requests if r[0].endswith("/issues")]
+    assert sorted(etag for *_, etag in pages) == ['"page1"', '"page2"', '"page3"']
+
+
+def test_crawl_github_incremental(github, tmp_path):
+    list(Crawler(cache_dir=str(tmp_path), incremental=True).crawl("https://github.com/org/repo"))
+    first = [r for r in FakeGitHub.requests if r[0].endswith("/issues")]
+    assert all(q["state"] == ["open"] and "since" not in q for _, q, _ in first)
+
+    FakeGitHub.requests = []
+    list(Crawler(cache_dir=str(tmp_path), incremental=True).crawl("https://github.com/org/repo"))
+    again = [r for r in FakeGitHub.requests if r[0].endswith("/issues")]
+    assert all(q["state"] == ["all"] and q["since"][0].endswith("Z") for _, q, _ in again)
+
+
+def test_crawl_github_abort_is_per_crawl(github, tmp_path):
+    crawler = Crawler(cache_dir=str(tmp_path), incremental=True, max_total_size=10)
+    list(crawler.crawl("https://github.com/org/repo"))
+    assert crawler.abort_reason == "size"
+
+    # a complete crawl with the same crawler clears it and records where the next one picks up
+    crawler.max_total_size = crawler_mod.DEFAULT_TOTAL_SIZE
+    list(crawler.crawl("https://github.com/org/repo"))
+    assert crawler.abort_reason == ""
+
+    FakeGitHub.requests = []
+    list(crawler.crawl("https://github.com/org/repo"))
+    again = [r for r in FakeGitHub.requests if r[0].endswith("/issues")]
+    assert again and all("since" in q for _, q, _ in again)
+
+
+def test_crawl_github_stopped_early_fetches_a_window_of_pages(github):
+    FakeGitHub.pages = 50
+    gen = Crawler(cache_dir=None).crawl("https://github.com/org/repo")
+    assert next(gen).url == "/issues/1"
+    gen.close()
+
+    time.sleep(0.2)
+    pages = [r for r in FakeGitHub.requests if r[0].endswith("/issues")]
+    assert len(pages) <= 1 + crawler_mod.GITHUB_PAGE_WORKERS
+
+
+def test_crawl_github_pages_keep_their_order(github):
+    FakeGitHub.pages = 20
+    outputs = list(Crawler(cache_dir=None).crawl("https://github.com/org/repo"))
+    issues = [o.url for o in outputs if o.url.startswith("/issues/")]
+    assert issues == [f"/issues/{n}" for n in range(1, 41) if n != 6]
@@ -0,0 +1,146 @@
+import os
+import random
+import re
+import subprocess
+import threading
+import time
+
+import pytest
+
+os.environ.setdefault("ANTHROPIC_API_KEY", "test")
+
+from audgit import descrips  # noqa: E402
+from audgit.descrips import ThankYouPierre, blob_sha  # noqa: E402
+
+
+@pytest.fixture
+def completions(monkeypatch):
+    """Fake describe calls: the description names the file, answers come back in random order."""
+    prompts = []
+    lock = threading.Lock()
+
+    def complete(prompt, bucket=None):
+        with lock:
+            prompts.append(prompt)
+        time.sleep(random.random() / 100)
+        return "describes " + re.search(r"File: (\S+)", prompt)[1].rsplit("/", 1)[-1]
+
+    monkeypatch.setattr(descrips, "complete", complete)
+    return prompts
+
+
+def test_describe_all_keeps_results_with_their_blob(tmp_path, completions, monkeypatch):
+    pierre = ThankYouPierre("org", "describe-all", str(tmp_path))
+    todo = {}
+    for n in range(20):
+        code = f"value = {n}\n"
+        todo[blob_sha(code.encode())] = (str(tmp_path / f"m{n}.py"), code)
+
+    checkpoints = []
+    monkeypatch.setattr(pierre, "save_descriptions", lambda blobs: checkpoints.append(dict(blobs)))
+
+    blobs = {}
+    pierre.describe_all(todo, blobs, save=True, save_every=5, max_workers=4, bucket=None)
+
+    assert blobs == {sha: f"describes {os.path.basename(name)}" for sha, (name, _) in todo.items()}
+    assert len(completions) == 20
+    # checkpoints along the way, each one a consistent subset of the final result
+    assert len(checkpoints) >= 3
+    for saved in checkpoints:
+        assert saved.items() <= blobs.items()
+    assert [len(c) for c in checkpoints] == sorted(len(c) for c in checkpoints)
+
+
+def make_checkout(path, files: dict[str, str], git: bool = True):
+    for name, text in files.items():
+        (path / name).parent.mkdir(parents=True, exist_ok=True)
+        (path / name).write_text(text)
+    if git:
+        subprocess.run(["git", "-C", str(path), "init", "-q"], check=True)
+        subprocess.run(["git", "-C", str(path), "add", "-A"], check=True)
+
+
+def test_cached_repo_opens_no_source_files(tmp_path, completions, monkeypatch):
+    make_checkout(tmp_path, {"a.py": "a = 1\n", "pkg/b.py": "b = 2\n", "notes.bin": "skip"})
+    first = ThankYouPierre("org", "cached", str(tmp_path)).get_descriptions()
+    assert first == {str(tmp_path / "a.py"): "describes a.py", str(tmp_path / "pkg/b.py"): "describes b.py"}
+    assert len(completions) == 2
+
+    opened = []
+    real_open = open
+
+    def spy(file, *args, **kwargs):
+        opened.append(str(file))
+        return real_open(file, *args, **kwargs)
+
+    monkeypatch.setattr("builtins.open", spy)
+    again = ThankYouPierre("org", "cached", str(tmp_path)).get_descriptions()
+
+    assert again == first
+    assert len(completions) == 2
+    # only the description cache itself is read
+    assert all("/.pierre/" in path for path in opened)
+
+
+def test_renamed_file_keeps_its_description(tmp_path, completions):
+    make_checkout(tmp_path, {"old_name.py": "value = 42\n"})
+    ThankYouPierre("org", "renamed", str(tmp_path)).get_descriptions()
+    subprocess.run(["git", "-C", str(tmp_path), "mv", "old_name.py", "new_name.py"], check=True)
+
+    descriptions = ThankYouPierre("org", "renamed", str(tmp_path)).get_descriptions()
+
+    # same blob, so the description written for the old name comes along
+    assert descriptions == {str(tmp_path / "new_name.py"): "describes old_name.py"}
+    assert len(completions) == 1
+
+
+def test_directory_without_git_is_walked(tmp_path, completions):
+    make_checkout(tmp_path, {"a.py": "a = 1\n", ".hidden.py": "h = 1\n", "build/gen.py": "g = 1\n",
+                             "pkg/b.py": "b = 2\n"}, git=False)
+    pierre = ThankYouPierre("org", "plain", str(tmp_path))
+
+    blobs = pierre.list_blobs()
+    assert sorted(os.path.relpath(name, tmp_path) for name, _, _ in blobs) == ["a.py", "pkg/b.py"]
+    assert all(sha == blob_sha(code.encode()) for _, sha, code in blobs)
+
+    descriptions = pierre.get_descriptions()
+    assert descriptions == {str(tmp_path / "a.py"): "describes a.py", str(tmp_path / "pkg/b.py"): "describes b.py"}
+    assert ThankYouPierre("org", "plain", str(tmp_path)).get_descriptions() == descriptions
+    assert len(completions) == 2
+
+
+def test_crlf_checkout_is_described(tmp_path, completions):
+    make_checkout(tmp_path, {".gitattributes": "*.py text eol=crlf\n", "win.py": "a = 1\nb = 2\n"})
+    git = ["git", "-C", str(tmp_path), "-c", "user.name=test", "-c", "user.email=test@localhost"]
+    subprocess.run(git + ["commit", "-q", "-m", "crlf"], check=True)
+    (tmp_path / "win.py").unlink()
+    subprocess.run(git + ["checkout", "--", "win.py"], check=True)
+    # the working tree has CRLF, the index blob has LF
+    data = (tmp_path / "win.py").read_bytes()
+    assert b"\r\n" in data
+    [(_, sha, _)] = ThankYouPierre("org", "crlf", str(tmp_path)).list_blobs()
+    assert blob_sha(data) != sha
+
+    descriptions = ThankYouPierre("org", "crlf", str(tmp_path)).get_descriptions()
+
+    assert descriptions == {str(tmp_path / "win.py"): "describes win.py"}
+    assert ThankYouPierre("org", "crlf", str(tmp_path)).get_descriptions() == descriptions
+    assert len(completions) == 1
+
+
+def test_file_changed_after_listing_is_skipped(tmp_path, completions):
+    make_checkout(tmp_path, {"a.py": "a = 1\n"})
+    pierre = ThankYouPierre("org", "changed", str(tmp_path))
+    [(filename, sha, code)] = pierre.list_blobs()
+    (tmp_path / "a.py").write_text("a = 2\n")
+
+    assert pierre.describe(sha, filename, code) == (sha, filename, False)
+    assert completions == []
+
+
+def test_missing_directory_has_no_blobs(tmp_path):
+    pierre = ThankYouPierre("org", "missing", str(tmp_path / "gone"))
+    (tmp_path / "gone" / ".pierre").rmdir()
+    (tmp_path / "gone").rmdir()
+
+    assert pierre.list_blobs() == []
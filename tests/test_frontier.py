@@ -0,0 +1,50 @@
+from audgit.frontier import Frontier, VisitedSet, canonicalize
+
+
+def test_canonicalize():
+    assert canonicalize("HTTP://Docs.Example.com:80/a/b/?z=1&a=2#top") == "http://docs.example.com/a/b?a=2&z=1"
+    assert canonicalize("https://example.com") == "https://example.com/"
+    assert canonicalize("https://example.com:8443/x/") == "https://example.com:8443/x"
+
+
+def test_visited_set():
+    visited = VisitedSet()
+    assert visited.add("http://a/")
+    assert not visited.add("http://a/")
+    assert "http://a/" in visited
+    assert "http://b/" not in visited
+    assert len(visited) == 1
+
+
+def test_frontier_dedupes_variants_and_limits_depth():
+    frontier = Frontier(max_depth=1)
+    assert frontier.add("http://a/docs", 0)
+    assert not frontier.add("http://a/docs/#intro", 0)
+    assert frontier.add("http://a/docs/x?b=1&a=2", 1)
+    assert not frontier.add("http://a/docs/x?a=2&b=1", 1)
+    assert not frontier.add("http://a/docs/y", 2)
+    assert frontier.too_deep == 1
+
+    assert frontier.next() == ("http://a/docs", 0)
+    assert frontier.next() == ("http://a/docs/x?b=1&a=2", 1)
+    frontier.task_done()
+    frontier.task_done()
+    assert frontier.next() is None
+    assert not frontier.add("http://a/docs/z", 1)
+
+
+def test_requeue_puts_a_url_back_in_front():
+    frontier = Frontier(max_depth=3)
+    frontier.add("http://a/1", 0)
+    frontier.add("http://a/2", 0)
+
+    url, depth = frontier.next()
+    frontier.requeue(url, depth)
+    frontier.task_done()
+
+    # a requeued url isn't a duplicate, the crawl doesn't end while it waits
+    assert frontier.next() == ("http://a/1", 0)
+    assert frontier.next() == ("http://a/2", 0)
+    frontier.finish()
+    frontier.requeue("http://a/1", 0)
+    assert not frontier.queue
@@ -0,0 +1,57 @@
+import os
+import subprocess
+
+os.environ.setdefault("GITHUB_TOKEN", "test")
+
+from audgit.get_repo_files import sync_file_tree, sync_repo  # noqa: E402
+
+
+def commit(path, files: dict[str, str]):
+    for name, text in files.items():
+        os.makedirs(os.path.dirname(os.path.join(path, name)) or path, exist_ok=True)
+        with open(os.path.join(path, name), "w") as f:
+            f.write(text)
+    git = ["git", "-C", path, "-c", "user.name=test", "-c", "user.email=test@localhost"]
+    subprocess.run(git + ["add", "-A"], check=True)
+    subprocess.run(git + ["commit", "-q", "-m", "change"], check=True)
+
+
+def make_remote(tmp_path):
+    remote = str(tmp_path / "remote")
+    os.makedirs(remote)
+    subprocess.run(["git", "-C", remote, "init", "-q"], check=True)
+    commit(remote, {"a.py": "a = 1\n", "pkg/b.py": "b = 2\n"})
+    return remote
+
+
+def test_sync_repo_reports_changed_paths(tmp_path):
+    remote = make_remote(tmp_path)
+    local = str(tmp_path / "local")
+
+    first = sync_repo(f"file://{remote}", local)
+    assert first.previous_head is None and first.changed is None
+
+    again = sync_repo(f"file://{remote}", local)
+    assert again.head == first.head and again.previous_head == first.head
+    assert again.changed == []
+
+    commit(remote, {"pkg/b.py": "b = 3\n", "c.py": "c = 4\n"})
+    moved = sync_repo(f"file://{remote}", local)
+    assert moved.previous_head == first.head and moved.head != first.head
+    assert sorted(moved.changed) == ["c.py", "pkg/b.py"]
+    with open(os.path.join(local, "pkg/b.py")) as f:
+        assert f.read() == "b = 3\n"
+
+
+def test_sync_file_tree_returns_the_sync(tmp_path):
+    remote = make_remote(tmp_path)
+    local = str(tmp_path / "local")
+
+    files, sync = sync_file_tree(f"file://{remote}", local)
+    assert sorted(files) == ["a.py", "pkg/b.py"] and sync.changed is None
+
+    # a failed refresh keeps the checkout but reports no sync
+    files, sync = sync_file_tree(f"file://{tmp_path}/missing", local)
+    assert sorted(files) == ["a.py", "pkg/b.py"] and sync is None
+
+    assert sync_file_tree(f"file://{tmp_path}/missing", str(tmp_path / "never")) == ([], None)
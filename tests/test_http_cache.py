@@ -0,0 +1,85 @@
+import os
+from unittest.mock import MagicMock
+
+from audgit.http_cache import HttpCache
+
+
+def response(status, headers, body=b""):
+    res = MagicMock(status_code=status, headers=headers, content=body)
+    res.__enter__.return_value = res
+    return res
+
+
+def test_fresh_responses_skip_the_network(tmp_path):
+    cache = HttpCache(str(tmp_path))
+    session = MagicMock()
+    session.get.return_value = response(200, {"Cache-Control": "max-age=60"}, b"body")
+    assert cache.get(session, "http://a/x").content == b"body"
+    assert cache.get(session, "http://a/x").from_cache
+    assert session.get.call_count == 1
+    assert cache.stats["hits"] == 1 and cache.stats["misses"] == 1
+
+
+def test_no_store_is_not_cached(tmp_path):
+    cache = HttpCache(str(tmp_path))
+    session = MagicMock()
+    session.get.return_value = response(200, {"ETag": '"1"', "Cache-Control": "no-store"}, b"body")
+    cache.get(session, "http://a/x")
+    cache.get(session, "http://a/x")
+    assert "If-None-Match" not in session.get.call_args.kwargs["headers"]
+
+
+def test_lru_eviction(tmp_path):
+    cache = HttpCache(str(tmp_path), max_bytes=250)
+    session = MagicMock()
+    for name in "abc":
+        session.get.return_value = response(200, {"ETag": f'"{name}"'}, name.encode() * 100)
+        cache.get(session, f"http://a/{name}")
+    # a was used least recently, it goes first
+    assert cache.lookup(cache.key("http://a/a")) is None
+    assert cache.lookup(cache.key("http://a/c")) is not None
+    assert cache.stats["evicted"] == 1
+    assert cache.stats["bytes"] == 200
+    assert HttpCache(str(tmp_path)).size == 200
+
+
+def test_body_evicted_after_lookup_is_a_miss(tmp_path):
+    cache = HttpCache(str(tmp_path))
+    session = MagicMock()
+    session.get.return_value = response(200, {"Cache-Control": "max-age=60"}, b"body")
+    cache.get(session, "http://a/x")
+
+    # eviction removes the body between lookup and read
+    lookup = cache.lookup
+
+    def evicting_lookup(key):
+        entry = lookup(key)
+        os.remove(cache.body_path(key))
+        return entry
+
+    cache.lookup = evicting_lookup
+    session.get.return_value = response(200, {"Cache-Control": "max-age=60"}, b"new body")
+    res = cache.get(session, "http://a/x")
+
+    assert res.content == b"new body" and not res.from_cache
+    assert session.get.call_count == 2
+    assert cache.stats["hits"] == 0 and cache.stats["misses"] == 2
+
+
+def test_body_evicted_during_revalidation_is_fetched_again(tmp_path):
+    cache = HttpCache(str(tmp_path))
+
+    def get(url, headers, timeout, stream):
+        if "If-None-Match" in headers:
+            os.remove(cache.body_path(cache.key(url)))
+            return response(304, {})
+        return response(200, {"ETag": '"1"'}, b"body")
+
+    session = MagicMock()
+    session.get.side_effect = get
+    cache.get(session, "http://a/x")
+    res = cache.get(session, "http://a/x")
+
+    assert res.content == b"body"
+    assert [bool(c.kwargs["headers"]) for c in session.get.call_args_list] == [False, True, False]
+    assert cache.stats["revalidated"] == 0 and cache.stats["misses"] == 2
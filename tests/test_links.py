@@ -0,0 +1,53 @@
+from audgit.links import HrefScanner, RegexExtractor, SoupExtractor, extract_links
+
+PAGE = b"""<html><head><style>a[href="/css"] {}</style></head><body>
+<A HREF="/one">1</A> <a class=x href='/two?a=1&amp;b=2'>2</a> <a href=/three>3</a>
+<!-- <a href="/commented">no</a> -->
+<script>document.write('<a href="/scripted">no</a>')</script>
+<a name="anchor">no href</a> <a href="">empty</a>
+<a
+  href="/four">4</a>
+</body></html>"""
+
+
+def test_regex_matches_soup():
+    expected = ["/one", "/two?a=1&b=2", "/three", "/four"]
+    assert RegexExtractor().links(PAGE) == expected
+    assert SoupExtractor().links(PAGE) == expected
+
+
+def test_scanner_handles_any_chunk_boundary():
+    expected = RegexExtractor().links(PAGE)
+    for size in (1, 2, 3, 7, 16, 64):
+        scanner = HrefScanner()
+        out = []
+        for i in range(0, len(PAGE), size):
+            out += scanner.feed(PAGE[i:i + size])
+        out += scanner.close()
+        assert out == expected, size
+
+
+def test_big_pages_use_process_pool():
+    page = b"<p>filler</p>" * 1000 + b'<a href="/far">x</a>'
+    assert extract_links(page, "regex", threshold=1024) == ["/far"]
+    assert extract_links(page, "soup", threshold=0) == ["/far"]
+
+
+def test_spooled_pages_use_process_pool_by_path(monkeypatch):
+    from audgit import links
+    from audgit.spool import spool
+
+    page = b"<p>filler</p>" * 1000 + b'<a href="/far">x</a>'
+    body, _ = spool([page[i:i + 1000] for i in range(0, len(page), 1000)], spool_size=4096)
+    assert body.on_disk
+
+    sent = []
+    submit = links.get_pool().submit
+    monkeypatch.setattr(links.get_pool(), "submit", lambda fn, *args: sent.append(args) or submit(fn, *args))
+
+    assert extract_links(body, "regex", threshold=1024) == ["/far"]
+    assert extract_links(body, "soup", threshold=1024) == ["/far"]
+    # under the threshold it is scanned in place
+    assert extract_links(body, "regex", threshold=0) == ["/far"]
+    assert sent == [("regex", body.path), ("soup", body.path)]
+    body.close()
@@ -0,0 +1,111 @@
+from types import SimpleNamespace
+
+import anthropic
+import httpx
+import pytest
+
+from audgit import llm, ratelimit, usage
+
+request = httpx.Request("POST", "https://api.anthropic.com/v1/complete")
+
+
+def status_error(cls, code, retry_after=None):
+    headers = {"retry-after": retry_after} if retry_after else {}
+    return cls(f"status {code}", request=request, response=httpx.Response(code, headers=headers, request=request),
+               body=None)
+
+
+class Completions:
+    """Raises the queued errors in turn before answering; stream_error breaks a stream after its first word."""
+
+    def __init__(self, *errors, stream_error=None):
+        self.errors = list(errors)
+        self.stream_error = stream_error
+        self.calls = 0
+
+    def create(self, model, max_tokens_to_sample, prompt, stream=False):
+        self.calls += 1
+        if self.errors:
+            raise self.errors.pop(0)
+        if stream:
+            return self.words()
+        return SimpleNamespace(completion="the answer")
+
+    def words(self):
+        yield SimpleNamespace(completion="one ")
+        if self.stream_error:
+            raise self.stream_error
+        yield SimpleNamespace(completion="two")
+
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    slept = []
+    monkeypatch.setattr(ratelimit.time, "sleep", slept.append)
+    return slept
+
+
+def use(monkeypatch, completions):
+    monkeypatch.setattr(llm, "get_client", lambda: SimpleNamespace(completions=completions))
+    return completions
+
+
+@pytest.mark.parametrize("error, retryable", [
+    (status_error(anthropic.RateLimitError, 429), True),
+    (status_error(anthropic.InternalServerError, 500), True),
+    (status_error(anthropic.APIStatusError, 529), True),
+    (anthropic.APIConnectionError(request=request), True),
+    (anthropic.APITimeoutError(request=request), True),
+    (status_error(anthropic.BadRequestError, 400), False),
+    (status_error(anthropic.AuthenticationError, 401), False),
+    (status_error(anthropic.NotFoundError, 404), False),
+    (ValueError("bad prompt"), False),
+])
+def test_is_retryable(error, retryable):
+    assert llm.is_retryable(error) is retryable
+
+
+def test_complete_retries_overload_and_rate_limits(sleeps, monkeypatch):
+    completions = use(monkeypatch, Completions(
+        status_error(anthropic.InternalServerError, 503),
+        status_error(anthropic.RateLimitError, 429, retry_after="7"),
+        anthropic.APIConnectionError(request=request),
+    ))
+
+    assert llm.complete("fix it") == "the answer"
+    assert completions.calls == 4
+    assert len(sleeps) == 3 and sleeps[1] == 7
+    [row] = usage.get_store().summary("call")
+    assert row["calls"] == 1 and row["failed"] == 0
+
+
+def test_complete_does_not_retry_client_errors(sleeps, monkeypatch):
+    completions = use(monkeypatch, Completions(status_error(anthropic.BadRequestError, 400)))
+
+    with pytest.raises(anthropic.BadRequestError):
+        llm.complete("fix it")
+    assert completions.calls == 1 and sleeps == []
+    assert usage.get_store().summary("call")[0]["failed"] == 1
+
+
+def test_complete_gives_up_after_the_retry_budget(sleeps, monkeypatch):
+    monkeypatch.setattr(llm, "LLM_RETRIES", 2)
+    completions = use(monkeypatch, Completions(*[status_error(anthropic.RateLimitError, 429)] * 5))
+
+    with pytest.raises(anthropic.RateLimitError):
+        llm.complete("fix it")
+    assert completions.calls == 3 and len(sleeps) == 2
+
+
+def test_stream_retries_opening_but_not_a_partial_answer(sleeps, monkeypatch):
+    completions = use(monkeypatch, Completions(status_error(anthropic.RateLimitError, 429)))
+    assert "".join(llm.stream("fix it")) == "one two"
+    assert completions.calls == 2 and len(sleeps) == 1
+
+    broken = use(monkeypatch, Completions(stream_error=anthropic.APIConnectionError(request=request)))
+    received = []
+    with pytest.raises(anthropic.APIConnectionError):
+        for text in llm.stream("fix it"):
+            received.append(text)
+    # the words already handed out can't be taken back, so the stream isn't reopened
+    assert received == ["one "] and broken.calls == 1
@@ -0,0 +1,87 @@
+import json
+import urllib.request
+
+import pytest
+
+from audgit import metrics
+from audgit.metrics import Histogram, Registry, span
+from audgit.pipeline import Pipeline
+
+
+def test_histogram_buckets_and_quantiles():
+    hist = Histogram(buckets=(0.1, 1, 10, float("inf")))
+    for value in (0.05, 0.5, 0.5, 5, 50):
+        hist.observe(value)
+    assert hist.counts == [1, 2, 1, 1]
+    assert hist.count == 5 and hist.sum == pytest.approx(56.05)
+    assert hist.quantile(0.5) == 1
+    assert hist.quantile(0.99) == float("inf")
+
+
+def test_prometheus_text():
+    reg = Registry()
+    reg.describe("jobs_total", "Jobs seen")
+    reg.inc("jobs_total", handler="code-review")
+    reg.inc("jobs_total", 2, handler="code-review")
+    reg.set_gauge("queue_depth", lambda: 3)
+    reg.observe("stage_seconds", 0.2, stage='say "hi"')
+
+    text = reg.prometheus()
+    assert "# HELP jobs_total Jobs seen\n# TYPE jobs_total counter\n" in text
+    assert 'jobs_total{handler="code-review"} 3\n' in text
+    assert "# TYPE queue_depth gauge\nqueue_depth 3\n" in text
+    assert 'stage_seconds_bucket{stage="say \\"hi\\"",le="0.1"} 0\n' in text
+    assert 'stage_seconds_bucket{stage="say \\"hi\\"",le="0.25"} 1\n' in text
+    assert 'stage_seconds_bucket{stage="say \\"hi\\"",le="+Inf"} 1\n' in text
+    assert 'stage_seconds_count{stage="say \\"hi\\""} 1\n' in text
+
+
+def test_broken_gauge_is_skipped():
+    reg = Registry()
+    reg.set_gauge("broken", lambda: 1 / 0)
+    reg.set_gauge("fine", 1)
+    assert reg.prometheus() == "# TYPE fine gauge\nfine 1\n"
+
+
+def test_span_records_duration_and_errors():
+    metrics.registry.clear()
+    with span("work", kind="test"):
+        pass
+    with pytest.raises(ValueError):
+        with span("work", kind="test"):
+            raise ValueError()
+
+    snap = metrics.registry.snapshot()
+    [hist] = [h for h in snap["histograms"] if h["name"] == "audgit_span_seconds"]
+    assert hist["labels"] == {"kind": "test", "span": "work"} and hist["count"] == 2
+    [errors] = snap["counters"]
+    assert errors["name"] == "audgit_span_errors_total" and errors["value"] == 1
+
+
+def test_pipeline_stages_are_timed():
+    metrics.registry.clear()
+    pipe = Pipeline("test")
+    pipe.stage("a", lambda: 1)
+    pipe.stage("b", lambda a: a + 1, deps=["a"])
+    pipe.start()
+    assert pipe.result("b", timeout=5) == 2
+
+    stages = {h["labels"]["stage"] for h in metrics.registry.snapshot()["histograms"]
+              if h["name"] == "audgit_stage_seconds"}
+    assert stages == {"a", "b"}
+
+
+def test_endpoint_serves_text_and_json():
+    metrics.registry.clear()
+    metrics.registry.inc("audgit_jobs_total", handler="code-review")
+    server = metrics.serve(0)
+    try:
+        base = f"http://127.0.0.1:{server.server_port}"
+        with urllib.request.urlopen(f"{base}/metrics") as res:
+            assert res.headers["Content-Type"].startswith("text/plain")
+            assert 'audgit_jobs_total{handler="code-review"} 1' in res.read().decode()
+        with urllib.request.urlopen(f"{base}/metrics.json") as res:
+            assert json.load(res)["counters"][0]["value"] == 1
+    finally:
+        server.shutdown()
+        server.server_close()
@@ -1,3 +1,4 @@
+import queue
 import threading
 import time
 from unittest.mock import patch, MagicMock
@@ -7,6 +8,8 @@ from dotenv import load_dotenv
 from nostr.event import Event
 
 from audgit.monitor import Monitor, Executor, get_tag
+from audgit.payments import AwaitPayment
+from audgit.store import JobStore
 
 # Load environment variables from .env file in the tests directory
 load_dotenv()
@@ -41,6 +44,12 @@ def mock_submit(self, fn, *args, **kwargs):
     return fn(*args, **kwargs)
 
 
+@pytest.fixture(autouse=True)
+def state_db(tmp_path, monkeypatch):
+    # every test starts without a job state checkpoint
+    monkeypatch.setenv("AUDGIT_STATE_DB", str(tmp_path / "state.db"))
+
+
 # Test cases
 
 def test_get_tag():
@@ -148,6 +157,194 @@ def test_monitor_start_parallel(monitor: MonitorEx):
     monitor.start(once=False)
 
 
+@pytest.mark.parametrize("monitor", [[
+    [
+        Event(created_at=int(time.time()),
+              tags=[["status", "done"], ["e", event1.id], ["R", "result"], ["status", "success"]])
+    ],
+    [event1,
+     Event(created_at=int(time.time()), tags=[["status", "in_progress"], ["e", "event2"], ["j", "handler_name"]]),
+     ]
+]], indirect=True)
+def test_monitor_run_async_once(monitor: MonitorEx):
+    processed_events = set()
+
+    def mock_handle_event(event: Event):
+        processed_events.add(event.id)
+        return []
+
+    monitor.add_handler("handler_name", mock_handle_event)
+
+    monitor.start_async(once=True)
+
+    # the job has finished by the time run() returns
+    assert processed_events == {monitor.get_events[1].id}
+
+
+@pytest.mark.parametrize("monitor", [[
+    [],
+    [
+        Event(created_at=int(time.time()), tags=[["status", "in_progress"], ["e", str(i)], ["j", "handler_name"]])
+        for i in range(100)
+    ]
+]], indirect=True)
+def test_monitor_run_async_parallel(monitor: MonitorEx):
+    processed_events = set()
+
+    async def mock_handle_event(event: Event):
+        processed_events.add(event.id)
+        yield Event(content="result", tags=[["e", event.id]])
+
+    monitor.add_handler("handler_name", mock_handle_event)
+
+    monitor.start_async()
+
+    assert processed_events == {ev.id for ev in monitor.get_events}
+
+
+def test_monitor_run_async_cancel():
+    import asyncio
+
+    manager = MagicMock()
+    manager.message_pool.events = queue.Queue()
+
+    started = threading.Event()
+    release = threading.Event()
+
+    def slow_handler(event: Event):
+        started.set()
+        release.wait(10)
+        yield Event(content="late", tags=[["e", event.id]])
+
+    async def scenario(monitor):
+        task = asyncio.create_task(monitor.run())
+        msg = MagicMock()
+        msg.event = Event(created_at=int(time.time()), tags=[["j", "handler_name"]])
+        manager.message_pool.events.put(msg)
+        await asyncio.get_running_loop().run_in_executor(None, started.wait, 10)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        release.set()
+
+    with patch("audgit.monitor.PrivateKey.from_hex", mock_from_hex), \
+            patch("audgit.monitor.Monitor.enum", side_effect=mock_enum([])), \
+            patch("audgit.monitor.Monitor._subscribe", return_value=(manager, "sub-id")):
+        monitor = Monitor(debug=True)
+        monitor.add_handler("handler_name", slow_handler)
+        asyncio.run(scenario(monitor))
+
+    assert started.is_set()
+    manager.publish_event.assert_not_called()
+    manager.close_all_relay_connections.assert_called_once()
+
+
+def test_monitor_restart_uses_job_store(tmp_path):
+    store = JobStore(str(tmp_path / "jobs.db"))
+    old = Event(created_at=int(time.time()) - 86400, tags=[["j", "handler_name"]])
+    handled = Event(created_at=int(time.time()) - 86400 + 1, tags=[["j", "handler_name"]])
+    store.set_state(handled.id, "success", handler="handler_name", created_at=handled.created_at)
+    store.set_last_seen(handled.created_at - 10)
+
+    manager = MagicMock()
+    manager.message_pool.events.get = MagicMock(side_effect=[MagicMock(event=handled), MagicMock(event=old)])
+
+    processed = []
+
+    with patch("audgit.monitor.PrivateKey.from_hex", mock_from_hex), \
+            patch("audgit.monitor.Monitor.enum") as enum, \
+            patch("audgit.monitor.Monitor._subscribe", return_value=(manager, "sub-id")):
+        monitor = Monitor(debug=True, store=store)
+        monitor.add_handler("handler_name", lambda ev: processed.append(ev.id) or [])
+        monitor.start_async(once=True)
+
+    # no relay replay, the day old job missed while down is picked up, the handled one is not
+    enum.assert_not_called()
+    assert processed == [old.id]
+    assert store.get_state(old.id) == "started"
+    assert store.last_seen() == old.created_at
+
+
+def test_monitor_restart_after_relay_replay(tmp_path):
+    store = JobStore(str(tmp_path / "jobs.db"))
+    job = Event(created_at=int(time.time()) - 600, tags=[["j", "handler_name"]])
+    reply = Event(created_at=int(time.time()) - 500, tags=[["e", job.id], ["status", "success"]])
+
+    with patch("audgit.monitor.PrivateKey.from_hex", mock_from_hex), \
+            patch("audgit.monitor.Monitor.enum", side_effect=mock_enum([reply])):
+        first = Monitor(debug=True, store=store)
+        first.add_handler("handler_name", lambda ev: [])
+        assert job.id in first.get_done()
+
+    # no claim was made, the restart still knows the job was answered without replaying the relays
+    with patch("audgit.monitor.PrivateKey.from_hex", mock_from_hex), \
+            patch("audgit.monitor.Monitor.enum") as enum:
+        again = Monitor(debug=True, store=store)
+        again.add_handler("handler_name", lambda ev: [])
+        done = again.get_done()
+
+    enum.assert_not_called()
+    assert store.get_state(job.id) == "success"
+    assert not again.is_new_job(job, done)
+    assert again.since <= first.since
+
+
+def test_monitor_restart_requeues_unanswered_claims(tmp_path):
+    store = JobStore(str(tmp_path / "jobs.db"))
+    # claimed by a run that died before publishing anything, long before the last checkpoint
+    stuck = Event(created_at=int(time.time()) - 86400, tags=[["j", "handler_name"]])
+    store.set_state(stuck.id, "started", handler="handler_name", created_at=stuck.created_at)
+    store.set_last_seen(int(time.time()) - 60)
+
+    manager = MagicMock()
+    manager.message_pool.events.get = MagicMock(side_effect=[MagicMock(event=stuck)])
+
+    processed = []
+
+    with patch("audgit.monitor.PrivateKey.from_hex", mock_from_hex), \
+            patch("audgit.monitor.Monitor.enum"), \
+            patch("audgit.monitor.Monitor._subscribe", return_value=(manager, "sub-id")):
+        monitor = Monitor(debug=True, store=store)
+        monitor.add_handler("handler_name", lambda ev: processed.append(ev.id) or [])
+        monitor.start_async(once=True)
+
+    assert processed == [stuck.id]
+    assert monitor.since <= stuck.created_at
+    assert store.get_state(stuck.id) == "started"
+
+
+def test_handle_event_parks_on_payment():
+    with patch("audgit.monitor.PrivateKey.from_hex", mock_from_hex):
+        monitor = Monitor(debug=True)
+
+    watched = []
+    monitor.payments.watch = lambda url, callback, timeout: watched.append((url, callback))
+    monitor.executor.submit = lambda fn, *args: fn(*args)
+
+    paid = []
+
+    def handler(event):
+        paid.append((yield AwaitPayment("https://example.com/verify")))
+        yield Event(content="solution", tags=[["e", event.id], ["status", "success"]])
+
+    monitor.add_handler("handler_name", handler)
+    manager = MagicMock()
+    event = Event(created_at=int(time.time()), tags=[["j", "handler_name"]])
+
+    monitor.handle_event(event, manager)
+
+    # parked: nothing published, no thread held
+    assert [url for url, _ in watched] == ["https://example.com/verify"]
+    assert paid == []
+    manager.publish_event.assert_not_called()
+
+    watched[0][1](True)
+
+    assert paid == [True]
+    manager.publish_event.assert_called_once()
+    assert monitor.store.get_state(event.id) == "success"
+
+
 def test_monitor_add_handler_and_start():
     events = [
         MagicMock(tags=[("status", "done"), ("e", "ref_event1")]),
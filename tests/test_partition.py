@@ -0,0 +1,72 @@
+import pytest
+
+from audgit import partition as part
+from audgit.partition import Piece, pack, partition, split_source
+
+
+@pytest.fixture(autouse=True)
+def word_tokens(monkeypatch):
+    # one token per whitespace separated word keeps budgets easy to reason about
+    monkeypatch.setattr(part, "count_tokens", lambda text: len(text.split()))
+    monkeypatch.setattr(part, "count_line_tokens", lambda lines: [len(line.split()) for line in lines])
+
+
+def test_pack_first_fit_decreasing():
+    pieces = [Piece(f"d{i}/f.py", "", tokens) for i, tokens in enumerate([6, 5, 4, 3, 2])]
+
+    bins = pack(pieces, budget=10)
+
+    assert [sum(p.tokens for p in b) for b in bins] == [10, 10]
+
+
+def test_pack_keeps_directory_together():
+    pieces = [Piece("a/x.py", "", 3), Piece("b/y.py", "", 6), Piece("a/z.py", "", 3)]
+
+    bins = pack(pieces, budget=10)
+
+    names = [sorted(p.name for p in b) for b in bins]
+    assert ["a/x.py", "a/z.py"] in names
+
+
+def test_split_source_at_definitions():
+    content = "import os\n\ndef a():\n    return 1 2 3\n\n# about b\ndef b():\n    return 4 5 6\n"
+
+    pieces = split_source("m.py", content, budget=10)
+
+    assert [p.name for p in pieces] == ["m.py:1-5", "m.py:6-8"]
+    assert pieces[1].content.startswith("# about b")
+    assert "".join(p.content for p in pieces) == content
+
+
+def test_split_source_long_definition():
+    content = "def a():\n" + "    x = 1\n" * 20
+
+    pieces = split_source("m.py", content, budget=9)
+
+    assert all(p.tokens <= 9 for p in pieces)
+    assert "".join(p.content for p in pieces) == content
+
+
+def test_split_source_line_numbers_ignore_form_feeds():
+    content = "import os\n\x0c\ndef a():\n    return 1 2 3\n\x0c\ndef b():\n    return 4 5 6\n"
+
+    pieces = split_source("m.py", content, budget=10)
+
+    # line numbers count \n only, as editors and tracebacks do
+    assert [p.name for p in pieces] == ["m.py:1-5", "m.py:6-7"]
+    assert pieces[1].content == "def b():\n    return 4 5 6\n"
+    assert "".join(p.content for p in pieces) == content
+
+
+def test_partition_oversized_file(tmp_path):
+    big = tmp_path / "big.py"
+    big.write_text("".join(f"def f{i}():\n    return {i}\n\n" for i in range(30)))
+    small = tmp_path / "small.py"
+    small.write_text("x = 1\n")
+
+    chunks = list(partition([str(big), str(small), str(tmp_path / "missing.py")], budget=40))
+
+    assert len(chunks) > 1
+    names = [name for chunk in chunks for name in chunk]
+    assert str(small) in names
+    assert all(name.startswith(str(big) + ":") for name in names if name != str(small))
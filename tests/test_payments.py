@@ -0,0 +1,104 @@
+import threading
+
+import pytest
+
+from audgit.payments import PaymentWatcher
+
+
+def test_watcher_multiplexes_invoices():
+    settled = {"paid": False}
+    checks = []
+
+    def check(url):
+        checks.append(url)
+        return settled[url] if url in settled else Exception("bad invoice")
+
+    watcher = PaymentWatcher(interval=0.01)
+    watcher.check = check
+
+    results = {}
+    done = threading.Event()
+
+    def callback(name):
+        def inner(res):
+            results[name] = res
+            if len(results) == 3:
+                done.set()
+        return inner
+
+    watcher.watch("paid", callback("paid"))
+    watcher.watch("paid", callback("paid-again"), timeout=0.05)
+    watcher.watch("broken", callback("broken"))
+
+    # nothing settles until we say so, the short one times out
+    threading.Timer(0.2, lambda: settled.update(paid=True)).start()
+    assert done.wait(5)
+
+    assert results["paid"] is True
+    assert results["paid-again"] is False
+    assert isinstance(results["broken"], Exception)
+    assert watcher.pending == 0
+    assert watcher.thread is not None
+
+
+def test_wait_raises_verification_errors():
+    watcher = PaymentWatcher(interval=0.01)
+    watcher.check = lambda url: Exception("Error: payment verification failure  500")
+
+    with pytest.raises(Exception, match="verification failure"):
+        watcher.wait("url", timeout=1)
+
+
+def test_malformed_verify_replies_dont_stall_the_others():
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class Wallet(BaseHTTPRequestHandler):
+        replies = {"/paid": b'{"settled": true}', "/lnurl-error": b'{"status": "ERROR"}', "/html": b"<html>"}
+
+        def do_GET(self):
+            body = self.replies[self.path]
+            self.send_response(200)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Wallet)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base = f"http://127.0.0.1:{server.server_port}"
+    try:
+        watcher = PaymentWatcher(interval=0.01)
+        assert watcher.check(f"{base}/paid") is True
+        assert isinstance(watcher.check(f"{base}/lnurl-error"), Exception)
+        assert isinstance(watcher.check(f"{base}/html"), Exception)
+    finally:
+        server.shutdown()
+
+
+def test_deadlines_fire_when_a_check_raises():
+    def check(url):
+        if url == "raises":
+            raise RuntimeError("boom")
+        return url == "paid"
+
+    watcher = PaymentWatcher(interval=0.01)
+    watcher.check = check
+
+    results = {}
+    done = threading.Event()
+
+    def callback(name):
+        def inner(res):
+            results[name] = res
+            if len(results) == 2:
+                done.set()
+        return inner
+
+    watcher.watch("paid", callback("paid"))
+    watcher.watch("raises", callback("raises"), timeout=0.1)
+
+    assert done.wait(5)
+    assert results == {"paid": True, "raises": False}
+    assert watcher.pending == 0
@@ -0,0 +1,137 @@
+import threading
+import time
+
+import pytest
+
+from audgit.pipeline import Pipeline
+
+
+def test_independent_stages_run_concurrently():
+    barrier = threading.Barrier(2, timeout=5)
+
+    pipe = Pipeline("test")
+    pipe.stage("a", lambda: (barrier.wait(), 1)[1])
+    pipe.stage("b", lambda: (barrier.wait(), 2)[1])
+    pipe.stage("sum", lambda a, b: a + b, deps=["a", "b"])
+    pipe.start()
+
+    # a and b only get past the barrier if they run at the same time
+    assert pipe.result("sum", timeout=5) == 3
+    assert set(pipe.timings) == {"a", "b", "sum"}
+    assert pipe.timings["sum"]["start"] >= pipe.timings["a"]["start"]
+
+
+def test_dependent_starts_when_inputs_ready():
+    release = threading.Event()
+
+    pipe = Pipeline("test")
+    pipe.stage("fast", lambda: "fast")
+    pipe.stage("slow", lambda: release.wait(5) and "slow")
+    pipe.stage("after_fast", lambda fast: fast + "!", deps=["fast"])
+    pipe.start()
+
+    # does not wait for the unrelated slow stage
+    assert pipe.result("after_fast", timeout=5) == "fast!"
+    release.set()
+    assert pipe.result("slow", timeout=5) == "slow"
+
+
+def test_failure_propagates_downstream():
+    def boom():
+        raise ValueError("no issue")
+
+    ran = []
+    pipe = Pipeline("test")
+    pipe.stage("issue", boom)
+    pipe.stage("files", lambda issue: ran.append(issue), deps=["issue"])
+    pipe.start()
+
+    with pytest.raises(ValueError, match="no issue"):
+        pipe.result("files", timeout=5)
+    assert ran == []
+
+
+def test_cancel_skips_pending_stages():
+    release = threading.Event()
+    ran = []
+
+    pipe = Pipeline("test")
+    pipe.stage("slow", lambda: release.wait(5))
+    pipe.stage("next", lambda slow: ran.append(slow), deps=["slow"])
+    pipe.start()
+    time.sleep(0.05)
+    pipe.cancel()
+    release.set()
+
+    with pytest.raises(RuntimeError, match="cancelled"):
+        pipe.result("next", timeout=5)
+    assert pipe.result("slow", timeout=5) is True
+    assert ran == []
+
+
+def test_unknown_dependency():
+    pipe = Pipeline("test")
+    with pytest.raises(ValueError):
+        pipe.stage("files", lambda issue: None, deps=["issue"])
+
+
+class SlowLock:
+    """Pauses after every release, so whatever follows a critical section overlaps with the other thread."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+
+    def __enter__(self):
+        self.lock.acquire()
+
+    def __exit__(self, *exc):
+        self.lock.release()
+        time.sleep(0.01)
+
+
+def test_stage_failed_by_two_inputs_at_once():
+    pipe = Pipeline("test")
+    pipe.lock = SlowLock()
+    pipe.stage("a", lambda: None)
+    pipe.stage("b", lambda: None)
+    pipe.stage("both", lambda a, b: None, deps=["a", "b"])
+    pipe.stages["a"].future.set_exception(ValueError("no a"))
+    pipe.stages["b"].future.set_exception(ValueError("no b"))
+
+    # the callbacks of both inputs find everything done and race to fail the stage, only one may
+    errors = []
+
+    def ready():
+        try:
+            pipe._ready(pipe.stages["both"])
+        except Exception as ex:
+            errors.append(ex)
+
+    threads = [threading.Thread(target=ready) for _ in range(2)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(5)
+
+    assert errors == []
+    with pytest.raises(ValueError):
+        pipe.result("both", timeout=5)
+
+def test_cancel_fails_a_chain_of_pending_stages():
+    release = threading.Event()
+
+    pipe = Pipeline("test")
+    pipe.stage("slow", lambda: release.wait(5))
+    pipe.stage("next", lambda slow: slow, deps=["slow"])
+    pipe.stage("last", lambda nxt: nxt, deps=["next"])
+    pipe.start()
+
+    cancel = threading.Thread(target=pipe.cancel, daemon=True)
+    cancel.start()
+    cancel.join(5)
+    release.set()
+
+    assert not cancel.is_alive()
+    for name in ("next", "last"):
+        with pytest.raises(RuntimeError, match="cancelled"):
+            pipe.result(name, timeout=5)
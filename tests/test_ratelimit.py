@@ -0,0 +1,82 @@
+import threading
+import time
+
+import pytest
+
+from audgit import ratelimit
+from audgit.ratelimit import TokenBucket, retry_call
+
+
+class Status(Exception):
+    def __init__(self, status_code, retry_after=None):
+        super().__init__(status_code)
+        self.status_code = status_code
+        self.response = type("Response", (), {"headers": {"retry-after": retry_after} if retry_after else {}})()
+
+
+def retryable(ex):
+    return ex.status_code == 429 or ex.status_code >= 500
+
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    slept = []
+    monkeypatch.setattr(ratelimit.time, "sleep", slept.append)
+    return slept
+
+
+def failing(*errors, result="ok"):
+    calls = []
+
+    def fn():
+        calls.append(1)
+        if len(calls) <= len(errors):
+            raise errors[len(calls) - 1]
+        return result
+    return fn, calls
+
+
+def test_bucket_paces_callers():
+    bucket = TokenBucket(rate=50, capacity=1)
+    start = time.monotonic()
+    threads = [threading.Thread(target=bucket.acquire) for _ in range(6)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    # the first token is there already, the other five come at 50 per second
+    assert time.monotonic() - start >= 5 / 50 * 0.9
+
+
+def test_bucket_reports_wait():
+    bucket = TokenBucket(rate=10, capacity=2)
+    assert bucket.try_acquire() == 0 and bucket.try_acquire() == 0
+    assert 0 < bucket.try_acquire() <= 0.1
+
+
+def test_retries_rate_limits_and_server_errors(sleeps):
+    fn, calls = failing(Status(429), Status(503), Status(500))
+    assert retry_call(fn, is_retryable=retryable, base_delay=1, max_delay=30) == "ok"
+    assert len(calls) == 4
+    # exponential backoff with jitter in [delay/2, delay]
+    assert [0.5 <= sleeps[0] <= 1, 1 <= sleeps[1] <= 2, 2 <= sleeps[2] <= 4] == [True] * 3
+
+
+def test_retry_after_is_honored(sleeps):
+    fn, _ = failing(Status(429, retry_after="7"))
+    assert retry_call(fn, is_retryable=retryable) == "ok"
+    assert sleeps == [7.0]
+
+
+def test_client_errors_are_not_retried(sleeps):
+    fn, calls = failing(Status(400))
+    with pytest.raises(Status):
+        retry_call(fn, is_retryable=retryable)
+    assert len(calls) == 1 and sleeps == []
+
+
+def test_gives_up_after_retries(sleeps):
+    fn, calls = failing(*[Status(529)] * 5)
+    with pytest.raises(Status):
+        retry_call(fn, is_retryable=retryable, retries=2)
+    assert len(calls) == 3 and len(sleeps) == 2
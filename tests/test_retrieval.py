@@ -0,0 +1,27 @@
+from collections import Counter
+
+from audgit.retrieval import BM25Index, identifiers, path_terms, tokenize
+
+
+def test_tokenize_splits_identifiers():
+    assert tokenize("parseRelayURL get_file_tree") == [
+        "parserelayurl", "parse", "relay", "url", "get_file_tree", "get", "tree"
+    ]
+
+
+def test_identifiers():
+    code = "import os\nfrom audgit.monitor import Monitor\n\nclass Crawler:\n    def safe_get(self):\n        pass\n"
+
+    assert identifiers(code) == ["Crawler", "safe_get", "os", "audgit.monitor"]
+
+
+def test_bm25_ranks_matching_files_first():
+    index = BM25Index()
+    index.add("audgit/lightning.py", path_terms("audgit/lightning.py") + Counter(tokenize("lnurl invoice callback")))
+    index.add("audgit/crawler.py", path_terms("audgit/crawler.py") + Counter(tokenize("crawl web pages")))
+    index.add("README.md", path_terms("README.md"))
+
+    ranked = index.search("the crawler fetches the same pages twice", k=2)
+
+    assert [name for name, _ in ranked] == ["audgit/crawler.py", "audgit/lightning.py"]
+    assert ranked[0][1] > 0 and ranked[1][1] == 0
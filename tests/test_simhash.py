@@ -0,0 +1,34 @@
+import random
+
+from audgit.simhash import SimHashIndex, distance, fingerprint, words
+
+rnd = random.Random(7)
+VOCAB = [f"w{i}" for i in range(500)]
+TEXT = " ".join(rnd.choice(VOCAB) for _ in range(400))
+
+
+def page(text: str) -> bytes:
+    return f"<html><head><script>var a = 1;</script></head><body><p>{text}</p></body></html>".encode()
+
+
+def test_words_streams_across_chunks():
+    doc = b"<p>Hello wor" + b"ld</p><!-- hidden --><scr" + b"ipt>x = 1</script><b>Bye</b>"
+    chunked = [doc[i:i + 3] for i in range(0, len(doc), 3)]
+    assert list(words(chunked)) == list(words([doc])) == ["hello", "world", "bye"]
+
+
+def test_near_duplicates_are_close():
+    edited = TEXT.replace(TEXT.split()[200], "changed", 1)
+    other = " ".join(rnd.choice(VOCAB) for _ in range(400))
+    a, b, c = fingerprint([page(TEXT)]), fingerprint([page(edited)]), fingerprint([page(other)])
+    assert distance(a, b) <= 3
+    assert distance(a, c) > 10
+    assert fingerprint([page("too short")]) is None
+
+
+def test_index_finds_within_distance():
+    index = SimHashIndex(max_distance=3)
+    assert index.check_and_add(0xFFFF0000FFFF0000, "a") is None
+    assert index.check_and_add(0xFFFF0000FFFF0007, "b") == "a"
+    assert index.check_and_add(0x0000FFFF0000FFFF, "c") is None
+    assert len(index) == 2
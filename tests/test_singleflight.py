@@ -0,0 +1,55 @@
+import threading
+import time
+
+import pytest
+
+from audgit.singleflight import SingleFlight
+
+
+def test_concurrent_callers_share_one_call():
+    flight = SingleFlight()
+    calls = []
+
+    def clone():
+        calls.append(1)
+        time.sleep(0.2)
+        return "head"
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(flight.do(("org", "repo"), clone))) for _ in range(5)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert calls == [1]
+    assert results == ["head"] * 5
+    # finished calls are not cached
+    assert flight.do(("org", "repo"), clone) == "head" and len(calls) == 2
+
+
+def test_waiters_get_the_exception():
+    flight = SingleFlight()
+    started = threading.Event()
+
+    def fail():
+        started.set()
+        time.sleep(0.1)
+        raise RuntimeError("clone failed")
+
+    errors = []
+
+    def waiter():
+        started.wait(5)
+        try:
+            flight.do("key", lambda: "not run")
+        except RuntimeError as ex:
+            errors.append(ex)
+
+    t = threading.Thread(target=waiter)
+    t.start()
+    with pytest.raises(RuntimeError):
+        flight.do("key", fail)
+    t.join()
+
+    assert [str(ex) for ex in errors] == ["clone failed"]
@@ -0,0 +1,44 @@
+from audgit.spool import Body, open_content, spool
+
+
+def test_small_content_stays_bytes():
+    content, truncated = spool([b"ab", b"cd"], spool_size=10)
+    assert content == b"abcd" and not truncated
+
+
+def test_big_content_is_spooled_and_cut():
+    content, truncated = spool([b"x" * 40] * 10, spool_size=64, max_size=100)
+    assert isinstance(content, Body) and truncated
+    assert len(content) == 100
+    assert content.on_disk
+    assert b"".join(content.chunks(size=30)) == b"x" * 100
+
+
+def test_readers_are_independent():
+    content, _ = spool([b"0123456789"] * 3, spool_size=8)
+    a, b = content.open(), open_content(content)
+    assert a.read(5) == b"01234"
+    assert b.read(12) == b"012345678901"
+    assert a.read() == b"56789" + b"0123456789" * 2
+
+
+def test_spilled_body_has_a_path_until_closed():
+    import gc
+    import os
+
+    content, _ = spool([b"x" * 100] * 3, spool_size=64)
+    path = content.path
+    with open(path, "rb") as f:
+        assert f.read() == b"x" * 300
+    content.close()
+    assert not os.path.exists(path)
+
+    # dropped without close, the finalizer removes it
+    content, _ = spool([b"x" * 100] * 3, spool_size=64)
+    path = content.path
+    del content
+    gc.collect()
+    assert not os.path.exists(path)
+
+    small, _ = spool([b"x"], spool_size=64)
+    assert small == b"x"
@@ -0,0 +1,38 @@
+from audgit.store import JobStore
+
+
+def test_job_states(tmp_path):
+    store = JobStore(str(tmp_path / "state.db"))
+    assert store.last_seen() is None
+
+    store.set_state("a", "started", handler="code-review", created_at=100)
+    store.set_state("a", "payment_required")
+    store.set_state("b", "failure", handler="code-review", created_at=200)
+
+    assert store.get_state("a") == "payment_required"
+    assert store.get_state("missing") is None
+    assert store.job_ids() == {"a", "b"}
+    assert [job[0] for job in store.jobs()] == ["b", "a"]
+    assert store.jobs(state="failure")[0][:4] == ("b", "code-review", "failure", 200)
+
+
+def test_last_seen_only_moves_forward(tmp_path):
+    path = str(tmp_path / "state.db")
+    store = JobStore(path)
+    store.set_last_seen(200)
+    store.set_last_seen(100)
+    store.close()
+
+    assert JobStore(path).last_seen() == 200
+
+
+def test_release_claims_forgets_unanswered_jobs(tmp_path):
+    store = JobStore(str(tmp_path / "state.db"))
+    store.set_state("claimed", "started", handler="code-review", created_at=100)
+    store.set_state("answered", "started", handler="code-review", created_at=200)
+    store.set_state("answered", "payment_required")
+    store.set_state("failed", "failure", handler="code-review", created_at=300)
+
+    assert store.release_claims() == [("claimed", 100)]
+    assert store.job_ids() == {"answered", "failed"}
+    assert store.release_claims() == []
@@ -0,0 +1,95 @@
+import os
+
+os.environ.setdefault("ANTHROPIC_API_KEY", "test")
+
+from audgit import symbols  # noqa: E402
+from audgit.symbols import SymbolIndex, index_source, make_slicer, render_slice, select_symbols  # noqa: E402
+
+CODE = '''import os
+from json import dumps
+
+
+def helper(x):
+    return x * 2
+
+
+def unrelated():
+    return os.getcwd()
+
+
+class Crawler:
+    def __init__(self):
+        self.depth = 0
+
+    @property
+    def limit(self):
+        return 10
+
+    def worker(self):
+        return helper(self.limit)
+
+
+def run():
+    return Crawler().worker()
+'''
+
+
+def test_python_symbols():
+    syms = {s.name: s for s in index_source("m.py", CODE)}
+
+    assert syms["os"].kind == "import" and syms["json"].kind == "import"
+    assert syms["Crawler.worker"].kind == "method"
+    assert syms["Crawler.worker"].calls == ["helper"]
+    assert syms["Crawler.limit"].start_line == 17  # decorator included
+    assert CODE.encode()[syms["helper"].start_byte:syms["helper"].end_byte].startswith(b"def helper")
+
+
+def test_generic_symbols():
+    syms = index_source("m.js", "import x from 'y'\n\nfunction a() {\n  return b(1)\n}\n\nfunction b(n) {}\n")
+
+    assert [(s.name, s.kind, s.start_line, s.end_line) for s in syms] == [
+        ("x", "import", 1, 1), ("a", "function", 3, 6), ("b", "function", 7, 7)
+    ]
+    assert syms[1].calls == ["b"]
+
+
+def test_select_callers_and_callees():
+    files = {"m.py": index_source("m.py", CODE)}
+
+    selected = {name for _, name in select_symbols(files, "Crawler.worker returns the wrong value")}
+
+    # the method, its callee helper, and run() which calls worker
+    assert {"Crawler.worker", "helper", "run"} <= selected
+    assert "unrelated" not in selected
+
+
+def test_render_slice():
+    syms = index_source("m.py", CODE)
+
+    out = render_slice(CODE, syms, {"helper"})
+
+    assert "def helper" in out and "import os" in out
+    assert "def unrelated" not in out and "omitted" in out
+
+
+def test_form_feed_keeps_lines_aligned():
+    # ast counts a form feed as part of its line, str.splitlines would start a new one
+    code = "import os\n\x0c\ndef a():\n    return 1\n\x0c\ndef b():\n    x = os.sep\n    return x\n"
+    syms = {s.name: s for s in index_source("m.py", code)}
+
+    assert code.encode()[syms["b"].start_byte:syms["b"].end_byte] == b"def b():\n    x = os.sep\n    return x\n"
+    out = render_slice(code, list(syms.values()), {"b"})
+    assert "def b():\n    x = os.sep\n    return x\n" in out and "def a" not in out
+
+
+def test_slicer_caches_symbols(tmp_path, monkeypatch):
+    monkeypatch.setattr(symbols, "count_tokens", lambda text: len(text.split()))
+    slicer = make_slicer("org", "repo", str(tmp_path), "fix unrelated", min_tokens=10)
+
+    out = slicer({"m.py": CODE, "small.py": "x = 1\n"})
+
+    assert "def unrelated" in out["m.py"] and "def helper" not in out["m.py"]
+    assert out["small.py"] == "x = 1\n"
+    index = SymbolIndex("org", "repo", str(tmp_path))
+    index._load()
+    assert len(index.cache) == 2
@@ -0,0 +1,83 @@
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+
+import pytest
+
+from audgit import llm, usage
+from audgit.pipeline import Pipeline
+from audgit.usage import Call, UsageStore
+
+
+class FakeCompletions:
+    def create(self, model, max_tokens_to_sample, prompt, stream=False):
+        if stream:
+            return iter([SimpleNamespace(completion=word) for word in ("one ", "two ", "three")])
+        return SimpleNamespace(completion="the answer")
+
+
+def test_summary_groups_and_prices():
+    store = UsageStore(":memory:")
+    store.add(Call("describe", "claude-instant-1", 1_000_000, 0, 1.0, repo="a/x"))
+    store.add(Call("describe", "claude-instant-1", calls=5, cached=5, repo="a/x"))
+    store.add(Call("summarize", "claude-2", 1_000_000, 1_000_000, 2.0, repo="b/y"))
+    store.add(Call("summarize", "claude-2", 10, 0, 0.5, ok=False, repo="b/y"))
+
+    by_repo = store.summary("repo")
+    assert [row["repo"] for row in by_repo] == ["b/y", "a/x"]
+    assert by_repo[0]["cost_usd"] == pytest.approx(11.02 + 32.68, abs=1e-3)
+    assert by_repo[0]["failed"] == 1 and by_repo[0]["latency"] == 2.5
+    assert by_repo[1] == {
+        "repo": "a/x", "calls": 6, "cached": 5, "failed": 0, "prompt_tokens": 1_000_000,
+        "completion_tokens": 0, "latency": 1.0, "cost_usd": 1.63,
+    }
+    assert [row["call"] for row in store.summary("call", limit=1)] == ["summarize"]
+
+    with pytest.raises(ValueError):
+        store.summary("prompt")
+
+
+def test_calls_are_attributed_through_pools(usage_store):
+    def call(n):
+        usage.record("partial_solution", "claude-2", "a b c", "d e", 0.1)
+        return n
+
+    def job():
+        usage.tag(repo="org/repo")
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            assert list(executor.map(usage.propagate(call), range(4))) == [0, 1, 2, 3]
+        pipe = Pipeline("test")
+        pipe.stage("stage", lambda: call(4))
+        pipe.start().result("stage", timeout=5)
+
+    usage.job_context(job="job-1", handler="code-review").run(job)
+    # calls made outside any job are kept, unattributed
+    usage.record("describe", "claude-instant-1", "x", "y", 0.1)
+
+    [row] = [r for r in usage_store.summary("job") if r["job"] == "job-1"]
+    assert row["calls"] == 5 and row["prompt_tokens"] == 15 and row["completion_tokens"] == 10
+    assert {r["repo"] for r in usage_store.summary("repo")} == {"org/repo", None}
+    assert {r["handler"]: r["calls"] for r in usage_store.summary("handler")} == {"code-review": 5, None: 1}
+
+
+def test_llm_calls_are_recorded(usage_store, monkeypatch):
+    monkeypatch.setattr(llm, "get_client", lambda: SimpleNamespace(completions=FakeCompletions()))
+
+    assert llm.complete("why is it slow", purpose="which_files") == "the answer"
+    assert "".join(llm.stream("fix it", model="claude-2", purpose="summarize")) == "one two three"
+    # a stream dropped half way is accounted with what arrived, as not ok
+    partial = llm.stream("fix it", purpose="summarize")
+    next(partial)
+    partial.close()
+
+    rows = {row["call"]: row for row in usage_store.summary("call")}
+    assert rows["which_files"]["prompt_tokens"] == 4 and rows["which_files"]["completion_tokens"] == 2
+    assert rows["summarize"]["calls"] == 2 and rows["summarize"]["failed"] == 1
+    assert rows["summarize"]["completion_tokens"] == 3 + 1
+
+
+def test_report_lists_rows(usage_store):
+    usage.record_cached("describe", "claude-instant-1", 3)
+    report = usage.report("model")
+    assert report.splitlines()[0].split() == ["model", "calls", "cached", "failed", "prompt", "completion",
+                                              "seconds", "usd"]
+    assert report.splitlines()[1].split()[:3] == ["claude-instant-1", "3", "3"]